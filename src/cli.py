@@ -0,0 +1,235 @@
+"""Command-line tools for Gather Metrics.
+
+Score a cohort file offline, without starting the web application:
+
+    python -m src.cli score input.tsv -o output.tsv --workers 8
+
+Compile the growth references in data/ into the reference store:
+
+    python -m src.cli build-references
+
+Compress the static and data files served by the application:
+
+    python -m src.cli build-assets
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from typing import Optional, Sequence
+
+from .cohort import CohortWriter, read_chunks, read_header, score_rows
+from .config import settings
+from .models import ReferenceModel
+from .utils.assets import ASSET_DIRECTORIES, AssetManifest
+from .utils.reference_registry import CENTILES, reference_registry
+from .utils.reference_store import ReferenceStore, build_store
+
+
+def score_file(
+    input_path: str,
+    output_path: str,
+    workers: int,
+    chunk_size: int,
+    reference_date: Optional[date] = None,
+    model: ReferenceModel = ReferenceModel.normal,
+) -> dict[str, float]:
+    """Score a cohort file into output_path and return throughput statistics.
+
+    Chunks are scored by a pool of worker processes, with at most two chunks
+    per worker in flight, and written in input order as soon as they are ready.
+    """
+    started = time.perf_counter()
+    reference_date = reference_date or date.today()
+    header = read_header(input_path)
+    rows = errors = 0
+
+    # Compile the reference tables before the workers are forked
+    reference_registry.load()
+
+    with CohortWriter(output_path, header) as writer:
+
+        def write(scored: list[dict[str, str]]) -> None:
+            nonlocal rows, errors
+            writer.write(scored)
+            rows += len(scored)
+            errors += sum(1 for row in scored if row["errors"])
+
+        chunks = read_chunks(input_path, chunk_size)
+        if workers <= 1:
+            for chunk in chunks:
+                write(score_rows(chunk, reference_date, model))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending: deque[Future] = deque()
+                for chunk in chunks:
+                    pending.append(
+                        executor.submit(score_rows, chunk, reference_date, model)
+                    )
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "errors": errors,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+    }
+
+
+def _score(args: argparse.Namespace) -> int:
+    try:
+        summary = score_file(
+            args.input,
+            args.output,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            reference_date=args.reference_date,
+            model=args.model,
+        )
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    print(
+        f"Scored {summary['rows']:.0f} rows ({summary['errors']:.0f} with errors) "
+        f"in {summary['seconds']:.2f}s with {args.workers} worker(s): "
+        f"{summary['rows_per_second']:.0f} rows/s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _build_references(args: argparse.Namespace) -> int:
+    try:
+        checksum = build_store(args.data_dir, args.output, CENTILES)
+        keys = ReferenceStore(args.output).keys()
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    for key in keys:
+        print(f"{key.measure} {key.reference} {key.sex}", file=sys.stderr)
+    print(
+        f"Compiled {len(keys)} reference tables into {args.output} "
+        f"(sha256 {checksum})",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _build_assets(args: argparse.Namespace) -> int:
+    try:
+        written = AssetManifest(tuple(args.directories)).build(args.output)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Wrote {len(written)} compressed assets to {args.output}", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score = subparsers.add_parser(
+        "score",
+        help="Add head circumference percentiles to a CSV/TSV file.",
+        description=(
+            "Add hcirc_percentile and errors columns to a CSV/TSV file with the "
+            "columns age_unit, age_value, sex, hcirc_value and hcirc_unit. "
+            "Files ending in .tsv, .tab or .txt are tab-separated."
+        ),
+    )
+    score.add_argument("input", help="Cohort file to score.")
+    score.add_argument("-o", "--output", required=True, help="Scored file to write.")
+    score.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes (default: all cores).",
+    )
+    score.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Rows read and scored at a time (default: 10000).",
+    )
+    score.add_argument(
+        "--reference-date",
+        type=date.fromisoformat,
+        default=None,
+        help="Date used to compute ages from dates of birth (default: today).",
+    )
+    score.add_argument(
+        "--model",
+        type=ReferenceModel,
+        choices=list(ReferenceModel),
+        metavar="{" + ",".join(model.value for model in ReferenceModel) + "}",
+        default=ReferenceModel.normal,
+        help="Reference model used to compute the percentiles (default: normal).",
+    )
+    score.set_defaults(handler=_score)
+
+    build_references = subparsers.add_parser(
+        "build-references",
+        help="Compile the growth references into the reference store.",
+        description=(
+            "Compile every data/{measure}_model/[{reference}/]{male,female}.tsv "
+            "file into one checksummed store, which the application maps "
+            "read-only. Rebuild it whenever the reference files change."
+        ),
+    )
+    build_references.add_argument(
+        "--data-dir",
+        default="data",
+        help="Directory of the references (default: data).",
+    )
+    build_references.add_argument(
+        "-o",
+        "--output",
+        default=settings.reference_store_path or "build/references.bin",
+        help="Store to write (default: REFERENCE_STORE_PATH).",
+    )
+    build_references.set_defaults(handler=_build_references)
+
+    build_assets = subparsers.add_parser(
+        "build-assets",
+        help="Compress the static and data files served by the application.",
+        description=(
+            "Write the gzip and brotli variants of the static and data files, "
+            "named after their contents, so that the application does not "
+            "compress them itself. Stale variants are never served."
+        ),
+    )
+    build_assets.add_argument(
+        "directories",
+        nargs="*",
+        default=list(ASSET_DIRECTORIES),
+        help="Directories of the assets (default: static data).",
+    )
+    build_assets.add_argument(
+        "-o",
+        "--output",
+        default=settings.asset_cache_dir or "build/assets",
+        help="Directory to write the variants to (default: ASSET_CACHE_DIR).",
+    )
+    build_assets.set_defaults(handler=_build_assets)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
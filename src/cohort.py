@@ -0,0 +1,101 @@
+import csv
+import os
+from datetime import date
+from typing import Iterator, Optional
+
+from .models import ReferenceModel
+from .services import calculate_hcirc_percentile_batch
+
+# Columns of a cohort file, mirroring PatientInput, and the columns added to it
+INPUT_COLUMNS = ("age_unit", "age_value", "sex", "hcirc_value", "hcirc_unit")
+OUTPUT_COLUMNS = ("hcirc_percentile", "errors")
+
+
+def detect_delimiter(file_path: str) -> str:
+    """Return the delimiter of a cohort file: tabs for .tsv/.tab/.txt, commas otherwise."""
+    extension = os.path.splitext(file_path)[1].lower()
+    return "\t" if extension in (".tsv", ".tab", ".txt") else ","
+
+
+def read_header(file_path: str) -> list[str]:
+    """Return the header of a cohort file, checking that it has every input column."""
+    with open(file_path, newline="", encoding="utf-8-sig") as file:
+        header = next(csv.reader(file, delimiter=detect_delimiter(file_path)), [])
+
+    missing = [column for column in INPUT_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}.")
+    return header
+
+
+def count_rows(file_path: str) -> int:
+    """Return the number of data rows in a cohort file."""
+    with open(file_path, newline="", encoding="utf-8-sig") as file:
+        rows = sum(1 for _ in csv.reader(file, delimiter=detect_delimiter(file_path)))
+    return max(rows - 1, 0)
+
+
+def read_chunks(file_path: str, chunk_size: int) -> Iterator[list[dict[str, str]]]:
+    """Yield the rows of a cohort file, chunk_size rows at a time."""
+    with open(file_path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.DictReader(file, delimiter=detect_delimiter(file_path))
+        chunk: list[dict[str, str]] = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def score_rows(
+    rows: list[dict[str, str]],
+    reference_date: Optional[date] = None,
+    model: ReferenceModel = ReferenceModel.normal,
+) -> list[dict[str, str]]:
+    """Return the rows with their hcirc_percentile, or the errors that prevented it.
+
+    Runs in worker processes, so it only takes and returns picklable values.
+    """
+    records = [{column: row.get(column) for column in INPUT_COLUMNS} for row in rows]
+    results = calculate_hcirc_percentile_batch(records, reference_date, model)
+
+    for row, result in zip(rows, results):
+        if "hcirc_percentile" in result:
+            row["hcirc_percentile"] = str(result["hcirc_percentile"])
+            row["errors"] = ""
+        else:
+            row["hcirc_percentile"] = ""
+            row["errors"] = "; ".join(
+                f"{'.'.join(map(str, error['loc'])) or 'record'}: {error['msg']}"
+                for error in result["errors"]
+            )
+    return rows
+
+
+class CohortWriter:
+    """Write scored rows to a cohort file incrementally, with the output columns added."""
+
+    def __init__(self, file_path: str, header: list[str]) -> None:
+        fieldnames = header + [c for c in OUTPUT_COLUMNS if c not in header]
+        self._file = open(file_path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(
+            self._file,
+            fieldnames=fieldnames,
+            delimiter=detect_delimiter(file_path),
+            extrasaction="ignore",
+        )
+        self._writer.writeheader()
+
+    def write(self, rows: list[dict[str, str]]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "CohortWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
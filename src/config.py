@@ -1,4 +1,7 @@
 import logging
+import os
+import tempfile
+from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -15,6 +18,111 @@ class Settings(BaseSettings):
         "http://127.0.0.1:8000",
     ]
 
+    # Production server (python -m src.server): address, number of worker
+    # processes, requests served by a worker before it is replaced (0 never
+    # replaces them) plus a random jitter, and seconds given to in-flight
+    # requests when stopping. X-Forwarded-* headers are only trusted from
+    # server_forwarded_allow_ips, a comma-separated list of proxy addresses
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_workers: int = os.cpu_count() or 1
+    server_max_requests: int = 10000
+    server_max_requests_jitter: int = 1000
+    server_graceful_timeout: float = 30.0
+    server_forwarded_allow_ips: str = "127.0.0.1"
+
+    # Cohort jobs: where uploads and results are stored, how many processes
+    # score them, rows per chunk, largest upload, and how long finished jobs
+    # are kept
+    jobs_dir: str = os.path.join(tempfile.gettempdir(), "gather-metrics-jobs")
+    jobs_max_workers: int = 2
+    jobs_chunk_size: int = 10000
+    jobs_max_upload_bytes: int = 500 * 1024 * 1024
+    jobs_retention_seconds: int = 24 * 60 * 60
+
+    # Where rate limit counters are kept, and how they are counted. The
+    # default memory:// storage is per process; mmap:///path/to/file shares
+    # the counters between every worker on the host
+    rate_limit_storage_uri: str = "memory://"
+    rate_limit_strategy: str = "fixed-window"
+
+    # Quotas, in cost units, shared by every route. Requests are counted per
+    # IP address in the anonymous tier, or per client when they carry an API
+    # key (X-API-Key) listed in rate_limit_api_keys, which maps keys to client
+    # IDs. Clients are in the tier given by rate_limit_client_tiers, or else
+    # in the client tier
+    rate_limit_tiers: dict[str, str] = {
+        "anonymous": "1000/minute",
+        "client": "10000/minute",
+    }
+    rate_limit_api_keys: dict[str, str] = {}
+    rate_limit_client_tiers: dict[str, str] = {}
+
+    # Serve request, stage timing, rate limit and cache metrics at /metrics
+    # in the Prometheus text format. Each worker process reports its own
+    metrics_enabled: bool = True
+
+    # Per-request CPU and allocation profiling, outside development only.
+    # Requests carrying profiling_token in X-Profile-Token are profiled, and
+    # a profiling_sample_rate fraction of the others; profiles are written to
+    # profiling_dir
+    profiling_enabled: bool = False
+    profiling_token: Optional[str] = None
+    profiling_sample_rate: float = 0.0
+    profiling_dir: str = os.path.join(tempfile.gettempdir(), "gather-metrics-profiles")
+
+    # Where compiled templates are cached between restarts (None disables
+    # the cache), and how many rendered result cards are kept in memory
+    templates_bytecode_cache_dir: Optional[str] = os.path.join(
+        tempfile.gettempdir(), "gather-metrics-templates"
+    )
+    result_card_cache_size: int = 1024
+
+    # Number of growth curve parameter sets kept in memory, and how long
+    # clients may cache them, in seconds
+    curves_cache_size: int = 128
+    curves_max_age: int = 24 * 60 * 60
+
+    # Single percentile results kept in memory, and for how long in seconds
+    # (0 disables the cache). Ages (in years) and head circumferences (in cm)
+    # are rounded to these quanta before lookup and computation; 0 keeps
+    # exact values
+    result_cache_size: int = 10000
+    result_cache_ttl_seconds: Optional[float] = 60 * 60
+    result_cache_age_quantum_years: float = 0.0
+    result_cache_hcirc_quantum_cm: float = 0.0
+
+    # Compiled reference store (python -m src.cli build-references), mapped
+    # read-only and shared by every process; the TSV files in data/ are read
+    # instead when it does not exist. References are chosen per request, and
+    # reference_default when none is given
+    reference_store_path: Optional[str] = "build/references.bin"
+    reference_default: str = "default"
+
+    # Compressed variants of the static and data files (python -m src.cli
+    # build-assets); files without one there are compressed on first request
+    asset_cache_dir: Optional[str] = "build/assets"
+
+    # Poll the reference files every this many seconds and reload the tables
+    # when they change; None only reloads them when a worker starts, on SIGUSR1
+    # and through the admin API
+    reference_watch_interval_seconds: Optional[float] = None
+
+    # Token of the admin API, sent in X-Admin-Token; None disables it
+    admin_token: Optional[str] = None
+
+    # Resample the reference tables onto a uniform age grid of this many days
+    # for constant-time lookups; None keeps exact interpolation
+    reference_grid_step_days: Optional[float] = None
+
+    # Maximum number of records accepted by the batch API
+    batch_max_size: int = 1000
+
+    # Records scored per chunk by the streaming API, and the longest
+    # accepted record line in bytes
+    stream_chunk_size: int = 500
+    stream_max_line_bytes: int = 65536
+
     # CSP Policy
     csp_policy: str = (
         "default-src 'self'; "
@@ -0,0 +1,356 @@
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import date
+from enum import Enum
+from typing import Any, Callable, Optional
+
+from .cohort import CohortWriter, count_rows, read_chunks, read_header, score_rows
+from .config import logger, settings
+from .models import ReferenceModel
+
+# Job IDs are uuid4 hex strings, also used in file names
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+INTERRUPTED_ERROR = (
+    "The job was interrupted by a server restart, please upload the file again."
+)
+QUOTA_ERROR = (
+    "The rate limit was exceeded before every row was scored, "
+    "please try again later."
+)
+UPLOAD_TOO_LARGE_ERROR = "The uploaded file is too large."
+
+
+class UploadTooLarge(ValueError):
+    """The uploaded file is larger than allowed."""
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class CohortJob:
+    def __init__(
+        self,
+        job_id: str,
+        input_path: str,
+        output_path: str,
+        reference_date: date,
+        model: ReferenceModel = ReferenceModel.normal,
+    ) -> None:
+        self.job_id = job_id
+        self.input_path = input_path
+        self.output_path = output_path
+        self.reference_date = reference_date
+        self.model = model
+        self.header: list[str] = []
+        self.status = JobStatus.queued
+        self.rows_total = 0
+        self.rows_processed = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Server process running the job
+        self.pid = os.getpid()
+
+    def to_dict(self) -> dict[str, Any]:
+        progress = 1.0 if self.status == JobStatus.done else 0.0
+        if self.status != JobStatus.done and self.rows_total:
+            progress = min(self.rows_processed / self.rows_total, 1.0)
+        return {
+            "job_id": self.job_id,
+            "status": self.status.value,
+            "rows_total": self.rows_total,
+            "rows_processed": self.rows_processed,
+            "progress": round(progress, 4),
+            "error": self.error,
+        }
+
+    def to_state(self) -> dict[str, Any]:
+        """Return the job as saved to its state file, for the other workers."""
+        return {
+            **self.to_dict(),
+            "input_path": self.input_path,
+            "output_path": self.output_path,
+            "reference_date": self.reference_date.isoformat(),
+            "model": self.model.value,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "pid": self.pid,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, Any]) -> "CohortJob":
+        job = cls(
+            job_id=state["job_id"],
+            input_path=state["input_path"],
+            output_path=state["output_path"],
+            reference_date=date.fromisoformat(state["reference_date"]),
+            model=ReferenceModel(state["model"]),
+        )
+        job.status = JobStatus(state["status"])
+        job.rows_total = state["rows_total"]
+        job.rows_processed = state["rows_processed"]
+        job.error = state["error"]
+        job.created_at = state["created_at"]
+        job.finished_at = state["finished_at"]
+        job.pid = state.get("pid", job.pid)
+        return job
+
+    @property
+    def unfinished(self) -> bool:
+        return self.status in (JobStatus.queued, JobStatus.running)
+
+    def interrupt(self) -> None:
+        """Mark an unfinished job as failed, since it will never finish."""
+        self.status = JobStatus.failed
+        self.error = INTERRUPTED_ERROR
+        self.finished_at = time.time()
+
+
+class CohortJobManager:
+    """Run cohort scoring jobs in a bounded process pool, off the event loop.
+
+    Files are read and written in chunks from a thread, and each chunk is
+    scored in the process pool, so a large upload neither blocks the event
+    loop nor holds the whole file in memory.
+
+    The state of every job is also saved next to its files, so that jobs run
+    by one server worker can be polled and downloaded through any other.
+    Jobs do not survive their worker: they are marked as failed when it shuts
+    down, or when they are read after it died without shutting down.
+    """
+
+    def __init__(
+        self,
+        jobs_dir: str,
+        max_workers: int,
+        chunk_size: int,
+        retention_seconds: float,
+    ) -> None:
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.retention_seconds = retention_seconds
+        self.jobs: dict[str, CohortJob] = {}
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            # Spawned workers don't inherit the server's threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def new_job(
+        self,
+        file_name: str,
+        reference_date: Optional[date] = None,
+        model: ReferenceModel = ReferenceModel.normal,
+    ) -> CohortJob:
+        """Register a job and return it, with paths for its input and output files.
+
+        The files keep the extension of file_name, which sets their delimiter.
+        """
+        self.prune()
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        job_id = uuid.uuid4().hex
+        extension = os.path.splitext(file_name)[1].lower()
+        job = CohortJob(
+            job_id=job_id,
+            input_path=os.path.join(self.jobs_dir, f"{job_id}.input{extension}"),
+            output_path=os.path.join(self.jobs_dir, f"{job_id}.output{extension}"),
+            reference_date=reference_date or date.today(),
+            model=model,
+        )
+        self.jobs[job_id] = job
+        self._save(job)
+        return job
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: CohortJob) -> None:
+        path = self._state_path(job.job_id)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(job.to_state(), file)
+        os.replace(f"{path}.tmp", path)
+
+    def start(
+        self, job: CohortJob, charge: Optional[Callable[[int], bool]] = None
+    ) -> None:
+        """Check the input file of a job and start scoring it in the background.
+
+        Each chunk is first passed to charge, if given, with its number of
+        rows, and the job fails once charge returns False. Raises ValueError
+        when the file is not a cohort file.
+        """
+        try:
+            job.header = read_header(job.input_path)
+        except UnicodeDecodeError as e:
+            raise ValueError("The file must be a UTF-8 encoded CSV or TSV.") from e
+
+        job.task = asyncio.create_task(self._run(job, charge))
+
+    async def _run(
+        self, job: CohortJob, charge: Optional[Callable[[int], bool]] = None
+    ) -> None:
+        job.status = JobStatus.running
+        loop = asyncio.get_running_loop()
+        try:
+            job.rows_total = await asyncio.to_thread(count_rows, job.input_path)
+
+            chunks = read_chunks(job.input_path, self.chunk_size)
+            try:
+                with CohortWriter(job.output_path, job.header) as writer:
+                    while rows := await asyncio.to_thread(next, chunks, None):
+                        if charge is not None and not charge(len(rows)):
+                            job.status = JobStatus.failed
+                            job.error = QUOTA_ERROR
+                            return
+                        scored = await loop.run_in_executor(
+                            self.executor,
+                            score_rows,
+                            rows,
+                            job.reference_date,
+                            job.model,
+                        )
+                        await asyncio.to_thread(writer.write, scored)
+                        job.rows_processed += len(scored)
+                        self._save(job)
+            finally:
+                chunks.close()
+
+            job.status = JobStatus.done
+        except Exception as e:
+            logger.error(f"Cohort job {job.job_id} failed", exc_info=e)
+            job.status = JobStatus.failed
+            job.error = "The file could not be processed."
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+
+    def get(self, job_id: str) -> Optional[CohortJob]:
+        """Return a job of this worker, or a snapshot of a job of another worker."""
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        job = self._load(job_id)
+        if job is None:
+            return None
+
+        if job.unfinished and not _process_alive(job.pid):
+            job.interrupt()
+            self._save(job)
+        return job
+
+    def _load(self, job_id: str) -> Optional[CohortJob]:
+        """Return the job saved in a state file, or None without a readable one."""
+        try:
+            with open(self._state_path(job_id)) as file:
+                return CohortJob.from_state(json.load(file))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def remove(self, job_id: str) -> None:
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return
+        for path in (job.input_path, job.output_path, self._state_path(job_id)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def prune(self) -> None:
+        """Forget finished jobs older than the retention period, and their files.
+
+        The whole jobs directory is pruned, including the jobs of other and of
+        restarted workers: their files are removed once none of them has been
+        modified for the retention period, unless their job is still running.
+        """
+        now = time.time()
+        for job in list(self.jobs.values()):
+            if job.finished_at and now - job.finished_at > self.retention_seconds:
+                self.remove(job.job_id)
+
+        try:
+            names = os.listdir(self.jobs_dir)
+        except FileNotFoundError:
+            return
+        files: dict[str, list[str]] = {}
+        for name in names:
+            job_id = name.split(".", 1)[0]
+            if JOB_ID_PATTERN.fullmatch(job_id) and job_id not in self.jobs:
+                files.setdefault(job_id, []).append(os.path.join(self.jobs_dir, name))
+
+        for job_id, paths in files.items():
+            try:
+                modified = max(os.path.getmtime(path) for path in paths)
+            except FileNotFoundError:
+                # Pruned meanwhile by another worker
+                continue
+            if now - modified <= self.retention_seconds:
+                continue
+            job = self._load(job_id)
+            if job is not None and job.unfinished and _process_alive(job.pid):
+                continue
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def shutdown(self) -> None:
+        for job in self.jobs.values():
+            if job.unfinished:
+                job.interrupt()
+                self._save(job)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+job_manager = CohortJobManager(
+    jobs_dir=settings.jobs_dir,
+    max_workers=settings.jobs_max_workers,
+    chunk_size=settings.jobs_chunk_size,
+    retention_seconds=settings.jobs_retention_seconds,
+)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user
+        return True
+    return True
+
+
+def save_upload(source, destination: str, max_bytes: int) -> None:
+    """Copy an uploaded file to disk in chunks, up to max_bytes.
+
+    Raises UploadTooLarge when the upload is larger than max_bytes.
+    """
+    written = 0
+    with open(destination, "wb") as file:
+        while block := source.read(1 << 20):
+            written += len(block)
+            if written > max_bytes:
+                raise UploadTooLarge(UPLOAD_TOO_LARGE_ERROR)
+            file.write(block)
@@ -1,13 +1,20 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import URL
 from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from .config import logger, settings
+from .jobs import job_manager
 from .routes import router
+from .utils.assets import ASSETS_PREFIX, AssetsApp, asset_manifest
+from .utils.metrics import MetricsMiddleware
+from .utils.profiling import setup_profiling
 from .utils.rate_limiter import setup_rate_limiter
+from .utils.reference_registry import reference_registry
+from .utils.reference_reload import ReferenceVersionMiddleware, ReferenceWatcher
 
 ############# FASTAPI APP ###############
 app = FastAPI(
@@ -17,18 +24,74 @@ app = FastAPI(
 )
 
 
-############# MIDDLEWARE TO LOG EXCEPTIONS ###############
-@app.middleware("http")
-async def log_exceptions(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        # Log the error with traceback
-        logger.error("Exception occurred", exc_info=e)
-        return JSONResponse(
-            status_code=500, content={"message": "Internal Server Error"}
-        )
+############# REFERENCE DATA ###############
+# Compile the reference tables once at startup instead of on the first request
+reference_registry.load()
+
+# Fingerprint the static and data files before serving them, and the changed
+# ones again whenever the reference tables, which are data files, are reloaded
+asset_manifest.load()
+reference_registry.on_load(asset_manifest.load)
+
+
+############# MIDDLEWARE ###############
+class SecurityMiddleware:
+    """Log unhandled exceptions and add the security headers to every response.
+
+    A plain ASGI middleware: responses are streamed through unchanged, with
+    the headers, built once from the settings, added to their start message.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.log_requests = settings.environment != "development"
+        self.headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in (
+                ("Content-Security-Policy", settings.csp_policy),
+                ("X-Content-Type-Options", "nosniff"),
+                ("X-Frame-Options", "DENY"),
+                (
+                    "Strict-Transport-Security",
+                    "max-age=63072000; includeSubDomains; preload",
+                ),
+                ("Referrer-Policy", "strict-origin-when-cross-origin"),
+            )
+        ]
+        self.header_names = {name for name, _ in self.headers}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.log_requests:
+            logger.info(f"New request: {scope['method']} {URL(scope=scope)}")
+
+        response_started = False
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                message["headers"] = [
+                    header
+                    for header in message.get("headers", [])
+                    if header[0].lower() not in self.header_names
+                ] + self.headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        except Exception as e:
+            # Log the error with traceback
+            logger.error("Exception occurred", exc_info=e)
+            if response_started:
+                raise
+            response = JSONResponse(
+                status_code=500, content={"message": "Internal Server Error"}
+            )
+            await response(scope, receive, send_with_headers)
 
 
 ############# MIDDLEWARE TO FORCE HTTPS ###############
@@ -36,35 +99,7 @@ if settings.environment != "development":
     # Middleware to force HTTPS in production
     app.add_middleware(HTTPSRedirectMiddleware)
 
-    @app.middleware("http")
-    async def add_security_headers(request: Request, call_next):
-        logger.info(f"New request: {request.method} {request.url}")
-        # Process the request and get the response
-        response = await call_next(request)
-
-        # Add HSTS header in production
-        response.headers["Strict-Transport-Security"] = (
-            "max-age=63072000; includeSubDomains; preload"
-        )
-
-        return response
-
-
-############# MIDDLEWARE FOR SECURITY ###############
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        response.headers["Content-Security-Policy"] = settings.csp_policy
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["Strict-Transport-Security"] = (
-            "max-age=63072000; includeSubDomains; preload"
-        )
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        return response
-
-
-app.add_middleware(SecurityHeadersMiddleware)
+app.add_middleware(SecurityMiddleware)
 
 ############# CORS POLICY ###############
 app.add_middleware(
@@ -78,9 +113,38 @@ app.add_middleware(
 ############# RATE LIMITER ###############
 setup_rate_limiter(app)
 
+############# PROFILING ###############
+# Only added when enabled, so that requests pay nothing for it otherwise
+setup_profiling(app, router.routes)
+
+############# REFERENCE VERSION ###############
+# Each request is served from one version of the reference tables, even if
+# they are reloaded meanwhile, and the version is returned in a header
+app.add_middleware(ReferenceVersionMiddleware, registry=reference_registry)
+
+############# METRICS ###############
+# Added last, so that request latencies include every other middleware
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
 ############# ROUTER ###############
 app.include_router(router)
 
+############# COHORT JOBS ###############
+app.add_event_handler("shutdown", job_manager.shutdown)
+
+############# REFERENCE WATCHER ###############
+# Every worker reloads the tables if their files changed since they were loaded
+# when it starts or is signalled, and every interval seconds when set
+reference_watcher = ReferenceWatcher(
+    reference_registry, settings.reference_watch_interval_seconds
+)
+app.add_event_handler("startup", reference_watcher.start)
+app.add_event_handler("shutdown", reference_watcher.stop)
+
 ############# STATIC FILES ###############
+# Fingerprinted URLs from asset_url, cached forever by browsers
+app.mount(ASSETS_PREFIX, AssetsApp(asset_manifest), name="assets")
+# Plain URLs, kept for existing links
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/data", StaticFiles(directory="data"), name="data")
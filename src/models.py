@@ -1,11 +1,10 @@
 from enum import Enum
-from typing import Union
+from typing import NamedTuple, Optional, Union
 
 import numpy as np
-from scipy import stats  # type: ignore
 
-from .utils.csv_loader import load_csv
-from .utils.hcirc_utils import norm_from_percentiles
+from .utils.hcirc_utils import norm_cdf, norm_from_percentiles
+from .utils.reference_registry import reference_registry
 
 
 class Sex(str, Enum):
@@ -13,7 +12,30 @@ class Sex(str, Enum):
     F = "F"
 
 
+class ReferenceModel(str, Enum):
+    # Normal distribution fitted to the 25th and 75th centiles
+    normal = "normal"
+    # Piecewise-linear z-scores through all the reference centiles
+    centiles = "centiles"
+
+
+class PatientRecord(NamedTuple):
+    """A normalized patient: age in years, sex and head circumference in cm.
+
+    The internal representation between validation and computation. A plain
+    tuple is built without validation or a per-instance dict, and unpacks
+    into the arguments of hcirc_percentile; pydantic models are only used at
+    the HTTP boundary.
+    """
+
+    age_years: float
+    sex: Sex
+    hcirc_cm: float
+
+
 class Patient:
+    __slots__ = ("age", "sex", "hcirc")
+
     def __init__(
         self,
         age: Union[int, float],
@@ -37,32 +59,77 @@ class Patient:
         self.sex = Sex(sex)
         self.hcirc = hcirc
 
+    def to_record(self) -> PatientRecord:
+        return PatientRecord(self.age, self.sex, self.hcirc["value_cm"])
+
     def calculate_hcirc_percentile(self) -> float:
+        # Ages above the reference range are capped by the computation itself,
+        # so the patient is left unchanged and can be shared between requests
+        return hcirc_percentile(*self.to_record())
+
+
+def _reference_cdf(
+    reference, age_years, hcirc_cm, model: ReferenceModel = ReferenceModel.normal
+):
+    """Return P(X < hcirc_cm) at age_years under a model of a reference.
+
+    Ages above the reference range are capped at the last reference age.
+    References compiled with an age grid are looked up on the grid instead.
+    """
+    if model == ReferenceModel.centiles:
+        return norm_cdf(reference.centile_model.z_score(age_years, hcirc_cm), 0.0, 1.0)
+
+    if reference.grid is not None:
+        loc, scale = reference.grid.lookup(age_years)
+        return norm_cdf(hcirc_cm, loc, scale)
+
+    age = np.minimum(age_years, reference.max_age)
+    age25 = np.interp(age, reference.age, reference.p25)
+    age75 = np.interp(age, reference.age, reference.p75)
+
+    loc, scale = norm_from_percentiles(age25, 0.25, age75, 0.75)
+    return norm_cdf(hcirc_cm, loc, scale)
+
+
+def hcirc_percentile(
+    age_years: float,
+    sex: str,
+    hcirc_cm: float,
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = None,
+) -> float:
+    """Return the rounded head circumference percentile of a single patient.
+
+    reference names the growth reference to use, the default one for None.
+    """
+    table = reference_registry.get(sex, reference)
+    perc = _reference_cdf(table, age_years, hcirc_cm, model)
+    return float(round(perc * 100, 2))
+
+
+def hcirc_percentiles(
+    age_years,
+    sex,
+    hcirc_cm,
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = None,
+) -> np.ndarray:
+    """Vectorized hcirc_percentile over arrays of patients.
+
+    sex holds plain "M"/"F" codes (Sex.value), since NumPy converts enum
+    members with str() when building an array. Records with an unknown sex
+    are returned as NaN.
+    """
+    age_years = np.asarray(age_years, dtype=np.float64)
+    sex = np.asarray(sex)
+    hcirc_cm = np.asarray(hcirc_cm, dtype=np.float64)
+
+    percentiles = np.full(age_years.shape, np.nan)
+    for table_sex, table in reference_registry.tables_for(reference).items():
+        mask = sex == table_sex
+        if mask.any():
+            percentiles[mask] = _reference_cdf(
+                table, age_years[mask], hcirc_cm[mask], model
+            )
 
-        male = load_csv("data/hcirc_model/male.tsv")
-        maleAge = np.array(male["Age"])
-        male25 = np.array(male["25"])
-        male75 = np.array(male["75"])
-
-        female = load_csv("data/hcirc_model/female.tsv")
-        femaleAge = np.array(female["Age"])
-        female25 = np.array(female["25"])
-        female75 = np.array(female["75"])
-
-        if self.sex == Sex.M:
-            if self.age > max(maleAge):
-                self.age = max(maleAge)
-            age25 = np.interp(self.age, maleAge, male25)
-            age75 = np.interp(self.age, maleAge, male75)
-        elif self.sex == Sex.F:
-            if self.age > max(femaleAge):
-                self.age = max(femaleAge)
-            age25 = np.interp(self.age, femaleAge, female25)
-            age75 = np.interp(self.age, femaleAge, female75)
-
-        loc, scale = norm_from_percentiles(age25, 0.25, age75, 0.75)
-
-        perc = stats.norm.cdf(self.hcirc["value_cm"], loc=loc, scale=scale)
-        perc_rounded = round(perc * 100, 2)
-        self.hcirc["percentile"] = perc_rounded
-        return self.hcirc["percentile"]
+    return np.round(percentiles * 100, 2)
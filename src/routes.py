@@ -1,18 +1,124 @@
+import hmac
+import os
 from datetime import date
-from typing import Union
-
-from fastapi import APIRouter, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from functools import lru_cache
+from typing import Optional, Union
+
+from fastapi import APIRouter, Form, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+)
 from fastapi.templating import Jinja2Templates
-
-from .models import Sex
-from .schemas import AgeUnitEnum, HcircUnitEnum, PatientInput
-from .services import calculate_hcirc_percentile, is_valid_age
+from pydantic import ValidationError
+
+from .config import settings
+from .jobs import (
+    UPLOAD_TOO_LARGE_ERROR,
+    JobStatus,
+    UploadTooLarge,
+    job_manager,
+    save_upload,
+)
+from .models import ReferenceModel, Sex
+from .schemas import (
+    AgeUnitEnum,
+    BatchPatientInput,
+    CohortJobInput,
+    HcircUnitEnum,
+    PatientInput,
+)
+from .services import (
+    calculate_hcirc_curves,
+    calculate_hcirc_percentile,
+    calculate_hcirc_percentile_batch,
+    calculate_hcirc_percentile_stream,
+    is_valid_age,
+    percentile_cache,
+)
 from .types.message import Message
-from .utils.rate_limiter import limiter
+from .utils.assets import asset_manifest
+from .utils.json_codec import FastJSONResponse, json_body_schema, parse_json_body
+from .utils.metrics import CONTENT_TYPE, instrument_templates, metrics, stage_duration
+from .utils.rate_limiter import (
+    COMPUTE_COST,
+    RATE_LIMIT_EXCEEDED,
+    charge_records,
+    quota_charger,
+    rate_limit,
+)
+from .utils.reference_registry import CENTILES, reference_registry
+from .utils.reference_reload import notify_server, reload_references
+from .utils.responses import NDJSONStreamingResponse, is_not_modified
+from .utils.templating import Fragment, compile_templates, create_environment
 
 router = APIRouter()
-templates = Jinja2Templates("src/templates")
+
+############# TEMPLATES ###############
+
+# Templates are compiled once at startup; in development they are still
+# reloaded when they change on disk
+templates_env = create_environment(
+    "src/templates",
+    bytecode_cache_dir=settings.templates_bytecode_cache_dir,
+    auto_reload=settings.environment == "development",
+)
+instrument_templates(templates_env)
+templates = Jinja2Templates(env=templates_env)
+templates.env.globals["asset_url"] = asset_manifest.url
+compile_templates(templates.env)
+
+RESULT_CARD = "sections/hcirc/cards/card_result.html"
+GENERIC_ERROR_TEXT = (
+    "Something went wrong. Please try again later or contact info@gatherfoundation.ch"
+)
+# Header carrying the admin token, for the admin routes
+ADMIN_TOKEN_HEADER = "x-admin-token"
+# age_message sent by the age inputs when they show no message, since empty
+# form fields are read as missing
+NO_AGE_MESSAGE = "none"
+
+# Pages and partials whose output never changes, rendered once
+MAIN_PAGE = Fragment(templates.env, "layouts/main.html", {"result": None})
+DOB_INPUT = Fragment(templates.env, "forms/form_hcirc/input_dob.html")
+AGE_INPUT = Fragment(templates.env, "forms/form_hcirc/input_age.html")
+LEGAL_PAGE = Fragment(templates.env, "clauses/legal.html")
+TOO_MANY_REQUESTS = Fragment(templates.env, "partials/error_429.html", status_code=429)
+INVALID_INPUT_CARD = Fragment(
+    templates.env,
+    RESULT_CARD,
+    {
+        "hcirc_percentile": None,  # Placeholder to clear the result
+        "message": Message(
+            category="error", text="Please check your input and try again."
+        ),
+    },
+    status_code=422,
+)
+ERROR_CARD = Fragment(
+    templates.env,
+    RESULT_CARD,
+    {
+        "hcirc_percentile": None,  # Placeholder to clear the result
+        "message": Message(category="error", text=GENERIC_ERROR_TEXT),
+    },
+    status_code=500,
+)
+
+
+@lru_cache(maxsize=settings.result_card_cache_size)
+def render_result_card(hcirc_percentile: float) -> bytes:
+    """Return the result card of a percentile, which only depends on its value."""
+    return (
+        templates.env.get_template(RESULT_CARD)
+        .render(hcirc_percentile=hcirc_percentile, message=None)
+        .encode()
+    )
 
 
 ############# ROOT ###############
@@ -20,46 +126,46 @@ templates = Jinja2Templates("src/templates")
 
 # Root Route - Landing Page with Form
 @router.get("/", response_class=HTMLResponse, include_in_schema=False)
-@limiter.limit("100/minute")
+@rate_limit()
 async def root(request: Request):
-    return templates.TemplateResponse(
-        request=request, name="layouts/main.html", context={"result": None}
-    )
+    return MAIN_PAGE.response(request)
 
 
 ############# HEAD CIRCUMFERENCE ###############
 
 
 @router.get("/show-dob", response_class=HTMLResponse, include_in_schema=False)
-@limiter.limit("100/minute")
+@rate_limit()
 async def show_dob(request: Request):
-    # Render the HTML for the Date of Birth input field
-    return templates.TemplateResponse(
-        request=request,
-        name="forms/form_hcirc/input_dob.html",
-    )
+    # The HTML for the Date of Birth input field
+    return DOB_INPUT.response(request)
 
 
 @router.get("/show-age", response_class=HTMLResponse, include_in_schema=False)
-@limiter.limit("100/minute")
+@rate_limit()
 async def show_age(request: Request):
-    # Render the HTML for the Age + Unit input field
-    return templates.TemplateResponse(
-        request=request,
-        name="forms/form_hcirc/input_age.html",
-    )
+    # The HTML for the Age + Unit input field
+    return AGE_INPUT.response(request)
 
 
 @router.post("/validate-age", response_class=HTMLResponse, include_in_schema=False)
-@limiter.limit("100/minute")
+@rate_limit()
 async def validate_age(
     request: Request,
     age_value: Union[float, date] = Form(None),
     age_unit: AgeUnitEnum = Form(...),
+    age_message: Optional[str] = Form(None),
 ):
 
     try:
         has_error, context = is_valid_age(age_value, age_unit)
+
+        # The form sends the message it shows; if it is unchanged, the
+        # fragment would be identical, so htmx is told to leave it as is
+        message = context["message"]
+        if age_message == (message.text if message else NO_AGE_MESSAGE):
+            return Response(status_code=204)
+
         context["request"] = request
 
         # Decide which template to render based on age_unit
@@ -85,10 +191,7 @@ async def validate_age(
             request=request,
             name=template_name,
             context={
-                "message": Message(
-                    category="error",
-                    text="Something went wrong. Please try again later or contact info@gatherfoundation.ch",
-                ),
+                "message": Message(category="error", text=GENERIC_ERROR_TEXT),
             },
             status_code=500,
         )
@@ -98,7 +201,7 @@ async def validate_age(
 @router.post(
     "/head-circumference", include_in_schema=False, response_class=HTMLResponse
 )
-@limiter.limit("100/minute")
+@rate_limit(COMPUTE_COST)
 async def display_result(
     request: Request,
     age_unit: str = Form(...),
@@ -108,62 +211,311 @@ async def display_result(
     hcirc_unit: str = Form(...),
 ):
     try:
-        patient_input = PatientInput(
-            age_unit=AgeUnitEnum(age_unit),
-            age_value=age_value,
-            sex=Sex(sex),
-            hcirc_value=hcirc_value,
-            hcirc_unit=HcircUnitEnum(hcirc_unit),
+        with stage_duration.time("validation"):
+            patient_input = PatientInput(
+                age_unit=AgeUnitEnum(age_unit),
+                age_value=age_value,
+                sex=Sex(sex),
+                hcirc_value=hcirc_value,
+                hcirc_unit=HcircUnitEnum(hcirc_unit),
+            )
+
+        with stage_duration.time("normalization"):
+            patient_record = patient_input.to_record()
+        with stage_duration.time("computation"):
+            hcirc_percentile = calculate_hcirc_percentile(patient_record)
+
+        return HTMLResponse(render_result_card(hcirc_percentile))
+
+    except ValueError as e:
+        # The result card with an error message and a placeholder result
+        return INVALID_INPUT_CARD.response(request)
+    except Exception as e:
+        # The result card with a generic error message and a placeholder result
+        return ERROR_CARD.response(request)
+
+
+REFERENCE_QUERY = Query(
+    None,
+    description="Name of the growth reference. Defaults to the configured one.",
+)
+
+
+def check_reference(reference: Optional[str]) -> None:
+    """Reject requests for a growth reference that is not loaded."""
+    if reference is not None and reference not in reference_registry.references:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown reference: {reference}. "
+            f"Available references: {', '.join(sorted(reference_registry.references))}.",
         )
 
-        normalized_data = patient_input.to_normalized()
-        hcirc_percentile = calculate_hcirc_percentile(normalized_data)
 
-        return templates.TemplateResponse(
-            request=request,
-            name="sections/hcirc/cards/card_result.html",
-            context={
-                "hcirc_percentile": hcirc_percentile,
-                "message": None,
-            },
+# Return Result as JSON. The body is decoded and validated in one step
+@router.post(
+    "/api/v1/head-circumference",
+    response_class=FastJSONResponse,
+    openapi_extra=json_body_schema(PatientInput),
+)
+@rate_limit(COMPUTE_COST)
+async def calculate_percentile_api(
+    request: Request,
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = REFERENCE_QUERY,
+):
+    check_reference(reference)
+    with stage_duration.time("validation"):
+        patient_input = await parse_json_body(request, PatientInput)
+    with stage_duration.time("normalization"):
+        patient_record = patient_input.to_record()
+    with stage_duration.time("computation"):
+        hcirc_percentile = calculate_hcirc_percentile(patient_record, model, reference)
+    return FastJSONResponse(content={"hcirc_percentile": hcirc_percentile})
+
+
+# Return Results for a batch of patients as JSON
+@router.post(
+    "/api/v1/head-circumference/batch",
+    response_class=FastJSONResponse,
+    openapi_extra=json_body_schema(BatchPatientInput),
+)
+@rate_limit(COMPUTE_COST)
+async def calculate_percentile_batch_api(request: Request):
+    batch_input = await parse_json_body(request, BatchPatientInput)
+    check_reference(batch_input.reference)
+    if not charge_records(request, len(batch_input.records)):
+        raise HTTPException(status_code=429, detail=RATE_LIMIT_EXCEEDED)
+    results = calculate_hcirc_percentile_batch(
+        batch_input.records,
+        batch_input.reference_date,
+        batch_input.model,
+        batch_input.reference,
+    )
+    return FastJSONResponse(content={"results": results})
+
+
+# Stream Results for newline-delimited JSON records as newline-delimited JSON
+@router.post(
+    "/api/v1/head-circumference/stream",
+    response_class=NDJSONStreamingResponse,
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+            "required": True,
+        }
+    },
+)
+@rate_limit(COMPUTE_COST)
+async def calculate_percentile_stream_api(
+    request: Request,
+    reference_date: Optional[date] = None,
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = REFERENCE_QUERY,
+):
+    check_reference(reference)
+    return NDJSONStreamingResponse(
+        calculate_hcirc_percentile_stream(
+            request.stream(),
+            reference_date,
+            model,
+            reference,
+            charge=quota_charger(request),
         )
+    )
 
-    except ValueError as e:
-        # Render the form with an error message and a placeholder result
-        return templates.TemplateResponse(
-            request=request,
-            name="sections/hcirc/cards/card_result.html",
-            context={
-                "hcirc_percentile": None,  # Placeholder to clear the result
-                "message": Message(
-                    category="error", text="Please check your input and try again."
-                ),
-            },
+
+# Return the reference centile curves of a sex, for charting
+@router.get("/api/v1/head-circumference/curves", response_class=JSONResponse)
+@rate_limit()
+async def get_hcirc_curves(
+    request: Request,
+    sex: Sex,
+    centiles: str = Query(
+        ",".join(CENTILES), description="Comma-separated reference centiles."
+    ),
+    step: Optional[float] = Query(
+        None, ge=1 / 365.25, description="Sampling step in years."
+    ),
+    reference: Optional[str] = REFERENCE_QUERY,
+):
+    check_reference(reference)
+    requested = {centile.strip() for centile in centiles.split(",")}
+    unknown = requested.difference(CENTILES)
+    if unknown:
+        raise HTTPException(
             status_code=422,
+            detail=f"Unknown centiles: {', '.join(sorted(unknown))}. "
+            f"Available centiles: {', '.join(CENTILES)}.",
         )
-    except Exception as e:
-        # Render the form with a generic error message and a placeholder result
-        return templates.TemplateResponse(
-            request=request,
-            name="sections/hcirc/cards/card_result.html",
-            context={
-                "hcirc_percentile": None,  # Placeholder to clear the result
-                "message": Message(
-                    category="error",
-                    text="Something went wrong. Please try again later or contact info@gatherfoundation.ch",
-                ),
-            },
-            status_code=500,
+
+    body, etag = calculate_hcirc_curves(
+        sex,
+        tuple(centile for centile in CENTILES if centile in requested),
+        step,
+        reference,
+        reference_registry.version,
+    )
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.curves_max_age}",
+    }
+    if is_not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Report the hit rate of the percentile result cache
+@router.get("/api/v1/cache/stats", response_class=JSONResponse, include_in_schema=False)
+@rate_limit()
+async def get_cache_stats(request: Request):
+    return {"percentile": percentile_cache.stats()}
+
+
+############# ADMIN ###############
+
+
+# Reload the reference tables without a restart, in the worker serving the
+# request and, through the pre-fork server, in every other one
+@router.post(
+    "/api/v1/admin/references/reload",
+    response_class=JSONResponse,
+    include_in_schema=False,
+)
+@rate_limit()
+async def reload_reference_tables(request: Request):
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not hmac.compare_digest(token.encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    # The request itself is served from the tables pinned when it started
+    previous = reference_registry.version
+    try:
+        snapshot = await reload_references(reference_registry)
+    except (OSError, ValueError) as e:
+        raise HTTPException(
+            status_code=422, detail=f"The reference tables were not reloaded: {e}"
         )
+    notify_server()
+    return {
+        "version": snapshot.version,
+        "previous_version": previous,
+        "references": sorted(snapshot.references),
+    }
+
+
+############# COHORT JOBS ###############
+
+
+# Room allowed in a cohort job request for the multipart framing and the
+# fields other than the file
+FORM_OVERHEAD_BYTES = 64 * 1024
 
 
-# Return Result as JSON
-@router.post("/api/v1/head-circumference", response_class=JSONResponse)
-@limiter.limit("100/minute")
-async def calculate_percentile_api(patient_input: PatientInput, request: Request):
-    normalized_data = patient_input.to_normalized()
-    hcirc_percentile = calculate_hcirc_percentile(normalized_data)
-    return JSONResponse(content={"hcirc_percentile": hcirc_percentile})
+async def parse_cohort_job_form(request: Request) -> CohortJobInput:
+    """Check the declared size of a cohort job request, then parse its form.
+
+    The request has already been charged by rate_limit, so neither rejected
+    nor oversized uploads are parsed. Errors are raised as FastAPI's
+    RequestValidationError, as for a form parameter.
+    """
+    # Uploads must declare their size
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        raise HTTPException(status_code=411, detail="Content-Length is required.")
+    if int(content_length) > settings.jobs_max_upload_bytes + FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_ERROR)
+
+    # One file, and the reference_date and model fields
+    form = await request.form(max_files=1, max_fields=2)
+    # Empty fields are missing, as for form parameters
+    fields = {key: value for key, value in form.items() if value != ""}
+    try:
+        return CohortJobInput.model_validate(fields)
+    except ValidationError as e:
+        await form.close()
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]
+        )
+
+
+# Upload a CSV/TSV file of measurements to be scored in the background
+@router.post(
+    "/api/v1/jobs",
+    response_class=JSONResponse,
+    status_code=202,
+    openapi_extra=json_body_schema(CohortJobInput, "multipart/form-data"),
+)
+@rate_limit(COMPUTE_COST)
+async def create_cohort_job(request: Request):
+    job_input = await parse_cohort_job_form(request)
+    job = job_manager.new_job(
+        job_input.file.filename or "", job_input.reference_date, job_input.model
+    )
+    try:
+        await run_in_threadpool(
+            save_upload,
+            job_input.file.file,
+            job.input_path,
+            settings.jobs_max_upload_bytes,
+        )
+    except UploadTooLarge as e:
+        job_manager.remove(job.job_id)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception:
+        job_manager.remove(job.job_id)
+        raise
+    finally:
+        await job_input.file.close()
+
+    try:
+        # Its rows are charged chunk by chunk, as they are scored
+        job_manager.start(job, charge=quota_charger(request))
+    except ValueError as e:
+        job_manager.remove(job.job_id)
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return JSONResponse(content=job.to_dict(), status_code=202)
+
+
+# Poll the progress of a cohort job
+@router.get("/api/v1/jobs/{job_id}", response_class=JSONResponse)
+@rate_limit()
+async def get_cohort_job(request: Request, job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return JSONResponse(content=job.to_dict())
+
+
+# Download the scored file of a finished cohort job
+@router.get("/api/v1/jobs/{job_id}/result", response_class=FileResponse)
+@rate_limit()
+async def get_cohort_job_result(request: Request, job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job.status != JobStatus.done:
+        raise HTTPException(status_code=409, detail="Job is not finished.")
+
+    extension = os.path.splitext(job.output_path)[1]
+    return FileResponse(job.output_path, filename=f"{job.job_id}{extension}")
+
+
+############# METRICS ###############
+
+
+# Metrics of this worker in the Prometheus text format, not rate limited so
+# that scrapes are never rejected
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
 
 
 ############# OTHER ROUTES ###############
@@ -171,17 +523,9 @@ async def calculate_percentile_api(patient_input: PatientInput, request: Request
 
 @router.get("/too-many-requests", response_class=HTMLResponse, include_in_schema=False)
 async def too_many_requests(request: Request):
-    return templates.TemplateResponse(
-        request=request,
-        name="partials/error_429.html",
-        status_code=429,
-    )
+    return TOO_MANY_REQUESTS.response(request)
 
 
 @router.get("/legal", response_class=HTMLResponse, include_in_schema=False)
 async def legal(request: Request):
-    return templates.TemplateResponse(
-        request=request,
-        name="clauses/legal.html",
-        status_code=200,
-    )
+    return LEGAL_PAGE.response(request)
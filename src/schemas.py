@@ -1,10 +1,12 @@
 from datetime import date
 from enum import Enum
-from typing import Union
+from typing import Any, Optional, Union
 
+from fastapi import UploadFile
 from pydantic import BaseModel, Field, field_validator
 
-from .models import Sex
+from .config import settings
+from .models import PatientRecord, ReferenceModel, Sex
 
 
 class HcircUnitEnum(str, Enum):
@@ -20,6 +22,42 @@ class AgeUnitEnum(str, Enum):
     dob = "dob"
 
 
+# Length of each age unit in years
+AGE_UNIT_YEARS = {
+    AgeUnitEnum.years: 1.0,
+    AgeUnitEnum.months: 12.0,
+    AgeUnitEnum.weeks: 52.1775,
+    AgeUnitEnum.days: 365.25,
+}
+
+
+def normalize_age(
+    age_value: Union[float, date],
+    age_unit: AgeUnitEnum,
+    reference_date: Optional[date] = None,
+) -> float:
+    """Return an age given in age_unit, or as a date of birth, in years.
+
+    A date of birth is measured up to reference_date, which defaults to today.
+    """
+    if age_unit == AgeUnitEnum.dob:
+        assert isinstance(age_value, date)
+        if reference_date is None:
+            reference_date = date.today()
+        elif age_value > reference_date:
+            raise ValueError("Date of birth cannot be after the reference date.")
+        return (reference_date - age_value).days / 365.25
+
+    if isinstance(age_value, date) and age_value == date(1970, 1, 1):
+        # TODO: Stop Pydantic coercing 0.0 into a date
+        return 0.0
+    if not isinstance(age_value, float):
+        raise ValueError("Invalid age value provided.")
+    if age_unit not in AGE_UNIT_YEARS:
+        raise ValueError("Invalid age unit provided.")
+    return age_value / AGE_UNIT_YEARS[age_unit]
+
+
 class NormalizedPatientData(BaseModel):
     age_years: float
     sex: Sex
@@ -41,34 +79,22 @@ class PatientInput(BaseModel):
             raise ValueError("Date of birth cannot be in the future.")
         return v
 
-    def to_normalized(self) -> "NormalizedPatientData":
-        """Normalize input values to years, sex as 'M' or 'F', and head circumference in cm."""
-        # Normalize age to years based on the age_unit
-        if self.age_unit == AgeUnitEnum.dob:
-            assert isinstance(self.age_value, date)
-            today = date.today()
-            age_years = (today - self.age_value).days / 365.25
-        else:
-            if isinstance(self.age_value, date) and self.age_value == date(1970, 1, 1):
-                # TODO: Stop Pydantic coercing 0.0 into a date
-                age_value_float = 0.0
-            elif isinstance(self.age_value, float):
-                age_value_float = self.age_value
-            else:
-                raise ValueError("Invalid age value provided.")
-
-            if age_value_float == 0.0:
-                age_years = 0.0
-            elif self.age_unit == AgeUnitEnum.years:
-                age_years = age_value_float
-            elif self.age_unit == AgeUnitEnum.months:
-                age_years = age_value_float / 12.0
-            elif self.age_unit == AgeUnitEnum.weeks:
-                age_years = age_value_float / 52.1775
-            elif self.age_unit == AgeUnitEnum.days:
-                age_years = age_value_float / 365.25
-            else:
-                raise ValueError("Invalid age unit provided.")
+    def to_normalized(
+        self, reference_date: Optional[date] = None
+    ) -> "NormalizedPatientData":
+        """Normalize input values to years, sex as 'M' or 'F', and head circumference in cm.
+
+        A date of birth is measured up to reference_date, which defaults to today.
+        """
+        age_years, sex, hcirc_cm = self.to_record(reference_date)
+        return NormalizedPatientData(age_years=age_years, sex=sex, hcirc_cm=hcirc_cm)
+
+    def to_record(self, reference_date: Optional[date] = None) -> PatientRecord:
+        """Normalize the input into the PatientRecord used by the computations.
+
+        Same normalization as to_normalized, without building a second model.
+        """
+        age_years = normalize_age(self.age_value, self.age_unit, reference_date)
 
         # Normalize head circumference to cm
         if self.hcirc_value is None or self.hcirc_value < 0:
@@ -79,6 +105,40 @@ class PatientInput(BaseModel):
         else:
             hcirc_cm = self.hcirc_value
 
-        return NormalizedPatientData(
-            age_years=age_years, sex=self.sex, hcirc_cm=hcirc_cm
-        )
+        return PatientRecord(age_years, self.sex, hcirc_cm)
+
+
+class BatchPatientInput(BaseModel):
+    # Records are validated one by one so that a single invalid record, even
+    # one that is not an object, does not reject the whole batch
+    records: list[Any] = Field(
+        min_length=1,
+        max_length=settings.batch_max_size,
+        description="Records with the same fields as a single head circumference request.",
+    )
+    reference_date: Optional[date] = Field(
+        default=None,
+        description="Date used to compute ages from dates of birth. Defaults to today.",
+    )
+    model: ReferenceModel = Field(
+        default=ReferenceModel.normal,
+        description="Reference model used to compute the percentiles.",
+    )
+    reference: Optional[str] = Field(
+        default=None,
+        description="Name of the growth reference. Defaults to the configured one.",
+    )
+
+
+class CohortJobInput(BaseModel):
+    # Validated from the multipart form of a cohort job, which is only parsed
+    # once the size of the upload has been checked
+    file: UploadFile = Field(description="CSV or TSV file of measurements.")
+    reference_date: Optional[date] = Field(
+        default=None,
+        description="Date used to compute ages from dates of birth. Defaults to today.",
+    )
+    model: ReferenceModel = Field(
+        default=ReferenceModel.normal,
+        description="Reference model used to compute the percentiles.",
+    )
@@ -0,0 +1,293 @@
+"""Pre-fork production server for Gather Metrics.
+
+The application, its reference tables and templates are loaded once in the
+master process, which then forks the uvicorn workers. Workers share those
+pages copy-on-write and accept connections from one listening socket:
+
+    python -m src.server --workers 4 --port 80
+
+SIGTERM or SIGINT stops the workers gracefully. SIGHUP replaces them with new
+ones without dropping connections. Workers also restart after serving
+settings.server_max_requests requests. SIGUSR1 reloads the reference tables,
+if their files changed, in the master and then in every worker.
+"""
+
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Optional, Sequence
+
+import uvicorn
+
+from .config import logger, settings
+from .utils.reference_registry import reference_registry
+from .utils.reference_reload import RELOAD_SIGNAL, SERVER_PID_ENV
+
+# Workers exiting faster than this after starting are restarted with a delay
+MIN_WORKER_LIFETIME = 1.0
+
+
+def load_application():
+    """Import the application, which compiles everything it serves, before forking."""
+    from .main import app
+
+    return app
+
+
+def refresh_references() -> None:
+    """Reload the reference tables in the master if their files changed.
+
+    Workers forked afterwards then share the new tables, instead of each
+    reloading them when it starts.
+    """
+    if not reference_registry.changed():
+        return
+    try:
+        snapshot = reference_registry.load()
+    except (OSError, ValueError) as e:
+        logger.error(f"The reference tables were not reloaded: {e}")
+        return
+    logger.info(f"Reloaded the reference tables, version {snapshot.version}")
+    # As at startup, keep the new tables out of the garbage collector
+    gc.collect()
+    gc.freeze()
+
+
+class PreforkServer:
+    def __init__(
+        self,
+        app,
+        host: str,
+        port: int,
+        workers: int,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: float = 30.0,
+        forwarded_allow_ips: str = "127.0.0.1",
+        refresh: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(workers, 1)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.forwarded_allow_ips = forwarded_allow_ips
+        # Called before forking workers, and on RELOAD_SIGNAL before the
+        # workers are signalled, to refresh what the master has loaded
+        self.refresh = refresh
+        self.socket: Optional[socket.socket] = None
+        # Worker PIDs and when they were started
+        self.pids: dict[int, float] = {}
+        self._stopping = False
+        self._reloading = False
+        self._refreshing = False
+
+    def bind(self) -> None:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(2048)
+        self.socket.set_inheritable(True)
+
+    def spawn(self) -> None:
+        """Fork a worker serving the application on the shared socket."""
+        limit_max_requests = None
+        if self.max_requests > 0:
+            # Spread the restarts of the workers over time
+            limit_max_requests = self.max_requests + random.randint(
+                0, self.max_requests_jitter
+            )
+
+        if self.refresh is not None:
+            self.refresh()
+
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = time.monotonic()
+            return
+
+        # Worker: restore the default signal handlers, which uvicorn replaces
+        # with its own graceful shutdown handlers. RELOAD_SIGNAL is ignored
+        # until the application handles it, as it checks the files at startup
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(RELOAD_SIGNAL, signal.SIG_IGN)
+        exit_code = 0
+        try:
+            config = uvicorn.Config(
+                self.app,
+                limit_max_requests=limit_max_requests,
+                timeout_graceful_shutdown=self.graceful_timeout,
+                proxy_headers=True,
+                forwarded_allow_ips=self.forwarded_allow_ips,
+            )
+            uvicorn.Server(config).run(sockets=[self.socket])
+        except BaseException:
+            logger.exception("Worker failed")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def run(self) -> int:
+        if self.socket is None:
+            self.bind()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        signal.signal(RELOAD_SIGNAL, self._handle_refresh)
+        # Lets workers signal the master after an admin reload
+        os.environ[SERVER_PID_ENV] = str(os.getpid())
+
+        # Keep the objects loaded so far out of the garbage collector, which
+        # would otherwise touch, and so copy, their pages in every worker
+        gc.collect()
+        gc.freeze()
+
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} worker(s)")
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.pids:
+            if self._stopping:
+                self._stop()
+                break
+            if self._reloading:
+                self._reloading = False
+                self._reload()
+            if self._refreshing:
+                self._refreshing = False
+                self._refresh()
+            self._reap()
+            time.sleep(0.1)
+
+        self.socket.close()
+        return 0
+
+    def _reap(self) -> None:
+        """Replace the workers that exited, after serving max_requests or failing."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            started = self.pids.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            if os.waitstatus_to_exitcode(status) != 0:
+                logger.warning(f"Worker {pid} exited with status {status}")
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+            if len(self.pids) < self.workers:
+                self.spawn()
+
+    def _reload(self) -> None:
+        """Start a new set of workers, then stop the old ones gracefully."""
+        old_pids = list(self.pids)
+        for _ in range(self.workers):
+            self.spawn()
+        for pid in old_pids:
+            self.pids.pop(pid, None)
+            self._kill(pid, signal.SIGTERM)
+            self._wait(pid)
+
+    def _refresh(self) -> None:
+        """Refresh the master, then signal every worker to check its files."""
+        if self.refresh is not None:
+            self.refresh()
+        for pid in self.pids:
+            self._kill(pid, RELOAD_SIGNAL)
+
+    def _stop(self) -> None:
+        for pid in self.pids:
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for pid in list(self.pids):
+            if not self._wait(pid, deadline):
+                self._kill(pid, signal.SIGKILL)
+                self._wait(pid)
+        self.pids.clear()
+
+    @staticmethod
+    def _kill(pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _wait(pid: int, deadline: Optional[float] = None) -> bool:
+        """Wait for a worker to exit, until deadline if given."""
+        while True:
+            try:
+                exited, _ = os.waitpid(pid, os.WNOHANG if deadline else 0)
+            except ChildProcessError:
+                return True
+            if exited:
+                return True
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+    def _handle_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame) -> None:
+        self._reloading = True
+
+    def _handle_refresh(self, signum, frame) -> None:
+        self._refreshing = True
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.server",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--host", default=settings.server_host)
+    parser.add_argument("--port", type=int, default=settings.server_port)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.server_workers,
+        help="Number of worker processes (default: SERVER_WORKERS, or all cores).",
+    )
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.workers > 1 and settings.rate_limit_storage_uri.startswith("memory"):
+        logger.warning(
+            "Rate limits are counted separately by each worker; set "
+            "RATE_LIMIT_STORAGE_URI to a shared storage such as mmap:///tmp/ratelimit"
+        )
+
+    server = PreforkServer(
+        load_application(),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_requests=settings.server_max_requests,
+        max_requests_jitter=settings.server_max_requests_jitter,
+        graceful_timeout=settings.server_graceful_timeout,
+        forwarded_allow_ips=settings.server_forwarded_allow_ips,
+        refresh=refresh_references,
+    )
+    return server.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,38 @@
+import json
 from datetime import date
-from typing import Any, Union
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Optional, Sequence, Union
 
-from .models import Patient, Sex
-from .schemas import AgeUnitEnum, HcircUnitEnum, NormalizedPatientData, PatientInput
+import numpy as np
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+from .models import (
+    PatientRecord,
+    ReferenceModel,
+    Sex,
+    hcirc_percentile,
+    hcirc_percentiles,
+)
+from .schemas import AgeUnitEnum, NormalizedPatientData, PatientInput, normalize_age
 from .types.message import Message
+from .utils.json_codec import dumps
+from .utils.metrics import cache_metrics, metrics
+from .utils.reference_registry import CENTILES, reference_registry
+from .utils.responses import make_etag
+from .utils.result_cache import ResultCache
+
+# Single percentile results, cleared whenever the reference tables are reloaded
+percentile_cache = ResultCache(
+    max_size=settings.result_cache_size, ttl_seconds=settings.result_cache_ttl_seconds
+)
+reference_registry.on_load(percentile_cache.clear)
+metrics.register_collector(cache_metrics("percentile", percentile_cache.stats))
+
+# Last result line of a stream stopped before its end
+TOO_LONG_ERROR = {"loc": [], "msg": "Record is too long.", "type": "value_error"}
+RATE_LIMIT_ERROR = {"loc": [], "msg": "Rate limit exceeded.", "type": "rate_limit"}
 
 
 def is_valid_age(
@@ -15,8 +44,6 @@ def is_valid_age(
         "message": None,  # Optional[Message] for holding the message object
     }
 
-    print("hello there")
-
     if not age_value:
         return True, context
 
@@ -29,21 +56,8 @@ def is_valid_age(
             )
             return True, context  # has_error is True
 
-    # Create a temporary PatientInput instance for validation
-    patient_input = PatientInput(
-        age_unit=AgeUnitEnum(age_unit),
-        age_value=age_value,
-        sex=Sex.M,  # Temporarily assign valid values for other fields
-        hcirc_value=0,
-        hcirc_unit=HcircUnitEnum.cm,
-    )
-
-    # Normalize the data and check if age is over 21
-    normalized_data = patient_input.to_normalized()
-    age_years = normalized_data.age_years
-
     # Add info message if age is over 21
-    if age_years > 21:
+    if normalize_age(age_value, context["age_unit"]) > 21:
         context["message"] = Message(
             category="info",
             text="Ages over 21 years are accepted, but they won't affect the result.",
@@ -52,11 +66,243 @@ def is_valid_age(
     return False, context  # has_error is False
 
 
-def calculate_hcirc_percentile(patient_data: NormalizedPatientData) -> float:
-    patient = Patient(
-        age=patient_data.age_years,
-        sex=patient_data.sex,
-        hcirc={"value_cm": patient_data.hcirc_cm},
+def calculate_hcirc_percentile(
+    patient_data: Union[PatientRecord, NormalizedPatientData],
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = None,
+) -> float:
+    if patient_data.age_years < 0:
+        raise ValueError("Age must not be a negative number.")
+    if patient_data.hcirc_cm < 0:
+        raise ValueError("Head circumference (value_cm) must not be a negative number.")
+
+    age_years = _quantize(
+        patient_data.age_years, settings.result_cache_age_quantum_years
+    )
+    hcirc_cm = _quantize(patient_data.hcirc_cm, settings.result_cache_hcirc_quantum_cm)
+    sex = Sex(patient_data.sex)
+    reference = reference or reference_registry.default_reference
+
+    # Keyed on the version, so that results computed from tables replaced
+    # meanwhile are never returned
+    return percentile_cache.get_or_compute(
+        (
+            sex.value,
+            age_years,
+            hcirc_cm,
+            model.value,
+            reference,
+            reference_registry.version,
+        ),
+        lambda: hcirc_percentile(age_years, sex, hcirc_cm, model, reference),
+    )
+
+
+def _quantize(value: float, quantum: float) -> float:
+    """Round value to the nearest multiple of quantum, or return it unchanged for 0."""
+    if not quantum:
+        return float(value)
+    return round(value / quantum) * quantum
+
+
+def _normalize_record(record: Any, reference_date: date) -> PatientRecord:
+    """Validate and normalize one raw record, given as a dict or as JSON bytes."""
+    if isinstance(record, bytes):
+        patient_input = PatientInput.model_validate_json(record)
+    elif isinstance(record, dict):
+        patient_input = PatientInput.model_validate(record)
+    else:
+        raise ValueError("Each record must be an object.")
+
+    patient_record = patient_input.to_record(reference_date)
+    if patient_record.age_years < 0:
+        raise ValueError("Age must not be a negative number.")
+    return patient_record
+
+
+def calculate_hcirc_percentile_batch(
+    records: Sequence[Any],
+    reference_date: Optional[date] = None,
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    """Calculate percentiles for a batch of raw records in a single vectorized pass.
+
+    Records are dicts or JSON documents, as bytes, with the fields of
+    PatientInput; any other record gets an error. Results keep the order of
+    the records. Each one holds either the "hcirc_percentile" or the "errors"
+    that prevented its calculation.
+    """
+    if reference_date is None:
+        reference_date = date.today()
+
+    results: list[dict[str, Any]] = []
+    valid_indices: list[int] = []
+    patient_records: list[PatientRecord] = []
+
+    for record in records:
+        try:
+            patient_record = _normalize_record(record, reference_date)
+        except ValidationError as e:
+            results.append(
+                {
+                    "errors": e.errors(
+                        include_url=False, include_context=False, include_input=False
+                    )
+                }
+            )
+            continue
+        except ValueError as e:
+            results.append(
+                {"errors": [{"loc": [], "msg": str(e), "type": "value_error"}]}
+            )
+            continue
+
+        valid_indices.append(len(results))
+        patient_records.append(patient_record)
+        results.append({})
+
+    if patient_records:
+        # Transpose the records into one array per field
+        age_years, sex, hcirc_cm = zip(*patient_records)
+        percentiles = hcirc_percentiles(
+            age_years, [value.value for value in sex], hcirc_cm, model, reference
+        )
+        for index, percentile in zip(valid_indices, percentiles.tolist()):
+            results[index]["hcirc_percentile"] = percentile
+
+    return results
+
+
+async def calculate_hcirc_percentile_stream(
+    body: AsyncIterator[bytes],
+    reference_date: Optional[date] = None,
+    model: ReferenceModel = ReferenceModel.normal,
+    reference: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    max_line_bytes: Optional[int] = None,
+    charge: Optional[Callable[[int], bool]] = None,
+) -> AsyncIterator[bytes]:
+    """Calculate percentiles for a stream of NDJSON records, as a stream of NDJSON results.
+
+    Records are scored through the batch path chunk_size lines at a time, so
+    only one chunk of the input and of the output is held in memory. Blank
+    lines are skipped; every other line gets exactly one result line, in order.
+    Each chunk is first passed to charge, if given, with its number of
+    records, and the stream stops with an error once charge returns False.
+    """
+    if reference_date is None:
+        reference_date = date.today()
+    chunk_size = chunk_size or settings.stream_chunk_size
+    max_line_bytes = max_line_bytes or settings.stream_max_line_bytes
+
+    async def score(lines: list[bytes]) -> Optional[bytes]:
+        if charge is not None and not charge(len(lines)):
+            return None
+        return _to_ndjson(await _score_lines(lines, reference_date, model, reference))
+
+    buffer = b""
+    lines: list[bytes] = []
+    async for data in body:
+        *complete_lines, buffer = (buffer + data).split(b"\n")
+        too_long = len(buffer) > max_line_bytes
+        for line in complete_lines:
+            if len(line) > max_line_bytes:
+                too_long = True
+                break
+            if line.strip():
+                lines.append(line)
+
+        if too_long:
+            # A record this long is not a patient record, stop reading
+            results = await score(lines)
+            if results is None:
+                yield _stream_error(RATE_LIMIT_ERROR)
+                return
+            yield results
+            yield _stream_error(TOO_LONG_ERROR)
+            return
+
+        while len(lines) >= chunk_size:
+            chunk, lines = lines[:chunk_size], lines[chunk_size:]
+            results = await score(chunk)
+            if results is None:
+                yield _stream_error(RATE_LIMIT_ERROR)
+                return
+            yield results
+
+    if buffer.strip():
+        lines.append(buffer)
+    if lines:
+        results = await score(lines)
+        yield _stream_error(RATE_LIMIT_ERROR) if results is None else results
+
+
+async def _score_lines(
+    lines: list[bytes],
+    reference_date: date,
+    model: ReferenceModel,
+    reference: Optional[str],
+) -> list[dict[str, Any]]:
+    # Score off the event loop so large chunks don't stall other requests
+    return await run_in_threadpool(
+        calculate_hcirc_percentile_batch, lines, reference_date, model, reference
     )
-    result = patient.calculate_hcirc_percentile()
-    return result
+
+
+def _stream_error(error: dict[str, Any]) -> bytes:
+    return _to_ndjson([{"errors": [error]}])
+
+
+def _to_ndjson(results: list[dict[str, Any]]) -> bytes:
+    return b"".join(dumps(result) + b"\n" for result in results)
+
+
+@lru_cache(maxsize=settings.curves_cache_size)
+def calculate_hcirc_curves(
+    sex: Sex,
+    centiles: tuple[str, ...] = CENTILES,
+    step: Optional[float] = None,
+    reference_name: Optional[str] = None,
+    version: Optional[str] = None,
+) -> tuple[bytes, str]:
+    """Return the JSON body and ETag of the reference centile curves of a sex.
+
+    Curves are sampled at the reference ages, or every step years when a step
+    is given, from the reference_name growth reference or the default one.
+    Results are cached per parameter set and version, the version of the
+    reference tables they are computed from.
+    """
+    reference = reference_registry.get(sex, reference_name)
+    if step is None:
+        age = reference.age
+    else:
+        count = int((reference.max_age - reference.min_age) / step) + 1
+        age = np.append(reference.min_age + step * np.arange(count), reference.max_age)
+        age = np.unique(np.round(age, 6))
+
+    curves = {
+        centile: np.round(
+            np.interp(
+                age, reference.age, reference.centiles[:, CENTILES.index(centile)]
+            ),
+            3,
+        ).tolist()
+        for centile in centiles
+    }
+    body = json.dumps(
+        {"sex": sex.value, "age": age.tolist(), "centiles": curves},
+        separators=(",", ":"),
+    ).encode()
+    return body, make_etag(body)
+
+
+reference_registry.on_load(calculate_hcirc_curves.cache_clear)
+
+
+def _curves_cache_stats() -> dict[str, int]:
+    info = calculate_hcirc_curves.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+
+metrics.register_collector(cache_metrics("curves", _curves_cache_stats))
@@ -0,0 +1,259 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from functools import partial
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from ..config import settings
+from .responses import is_not_modified
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is an optional dependency
+    brotli = None
+
+ASSET_DIRECTORIES = ("static", "data")
+ASSETS_PREFIX = "/assets"
+
+# Fingerprinted URLs change with their content, so they never need revalidating
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+COMPRESSIBLE_TYPES = (
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "text/",
+)
+
+# Content codings of the compressed variants, and how to compress them
+COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    "gzip": partial(gzip.compress, compresslevel=9, mtime=0)
+}
+if brotli is not None:
+    COMPRESSORS["br"] = partial(brotli.compress, quality=11)
+
+
+class Asset:
+    """An asset file held in memory, with its compressed variants.
+
+    Text assets are compressed on first use, or read from the variants written
+    to cache_dir by python -m src.cli build-assets, which are named after the
+    digest of the file so that they can never be stale.
+    """
+
+    def __init__(self, path: str, body: bytes, cache_dir: Optional[str] = None) -> None:
+        digest = hashlib.sha256(body).hexdigest()
+        stem, extension = os.path.splitext(path)
+
+        self.path = path
+        self.hashed_path = f"{stem}.{digest[:12]}{extension}"
+        self.digest = digest[:32]
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.body = body
+        self.cache_dir = cache_dir
+        self._variants: Optional[dict[str, bytes]] = None
+        if not self.media_type.startswith(COMPRESSIBLE_TYPES):
+            self._variants = {"identity": body}
+
+    @property
+    def compressed(self) -> bool:
+        """Whether the variants are ready, so that serving does not compress."""
+        return self._variants is not None
+
+    @property
+    def variants(self) -> dict[str, bytes]:
+        """Variants keyed by content coding, only kept when smaller than the body."""
+        if self._variants is None:
+            # Concurrent first uses may both compress, to the same variants
+            variants = {"identity": self.body}
+            for coding, compress in COMPRESSORS.items():
+                variant = self._read_cached(coding)
+                if variant is None:
+                    variant = compress(self.body)
+                if len(variant) < len(self.body):
+                    variants[coding] = variant
+            self._variants = variants
+        return self._variants
+
+    def cache_path(self, cache_dir: str, coding: str) -> str:
+        return os.path.join(cache_dir, f"{self.digest}.{coding}")
+
+    def _read_cached(self, coding: str) -> Optional[bytes]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.cache_path(self.cache_dir, coding), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    @property
+    def url(self) -> str:
+        return f"{ASSETS_PREFIX}/{self.hashed_path}"
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Return the smallest variant coding accepted by an Accept-Encoding header."""
+        accepted = set()
+        for item in accept_encoding.lower().split(","):
+            coding, _, params = item.partition(";")
+            try:
+                weight = float(params.strip().removeprefix("q=") or 1)
+            except ValueError:
+                weight = 1.0
+            if weight > 0:
+                accepted.add(coding.strip())
+
+        candidates = [
+            coding
+            for coding in self.variants
+            if coding == "identity" or coding in accepted or "*" in accepted
+        ]
+        return min(candidates, key=lambda coding: len(self.variants[coding]))
+
+    def etag(self, coding: str) -> str:
+        """Return the strong ETag of a variant, which differs between codings."""
+        if coding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{coding}"'
+
+
+class AssetManifest:
+    """Content-hashed assets of the static and data directories.
+
+    Every file is read and fingerprinted when the manifest is loaded, and
+    compressed when first served. Templates link to the fingerprinted URLs
+    with asset_url, which can be cached forever by browsers because they
+    change with the file contents.
+    """
+
+    def __init__(
+        self,
+        directories: tuple[str, ...] = ASSET_DIRECTORIES,
+        cache_dir: Optional[str] = None,
+    ) -> None:
+        self.directories = directories
+        self.cache_dir = cache_dir
+        self._assets: Mapping[str, Asset] = MappingProxyType({})
+        self._by_hashed_path: Mapping[str, Asset] = MappingProxyType({})
+        self._stats: dict[str, tuple[int, int]] = {}
+
+    def load(self) -> None:
+        """Read and fingerprint the new and changed files of the asset directories.
+
+        Files of the same size and modification time as at the previous load
+        keep their fingerprint and compressed variants.
+        """
+        assets = {}
+        stats = {}
+        for directory in self.directories:
+            for root, _, file_names in os.walk(directory):
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(root, file_name)
+                    path = os.path.relpath(file_path, os.path.dirname(directory))
+                    path = path.replace(os.sep, "/")
+                    stat = os.stat(file_path)
+                    stats[path] = (stat.st_size, stat.st_mtime_ns)
+                    if self._stats.get(path) == stats[path] and path in self._assets:
+                        assets[path] = self._assets[path]
+                        continue
+                    with open(file_path, "rb") as file:
+                        assets[path] = Asset(path, file.read(), self.cache_dir)
+
+        self._stats = stats
+        self._assets = MappingProxyType(assets)
+        self._by_hashed_path = MappingProxyType(
+            {asset.hashed_path: asset for asset in assets.values()}
+        )
+
+    def build(self, cache_dir: str) -> list[str]:
+        """Write the compressed variants of every asset to cache_dir.
+
+        Returns the paths of the variants written.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        written = []
+        for asset in self.assets.values():
+            for coding, variant in asset.variants.items():
+                if coding != "identity":
+                    cache_path = asset.cache_path(cache_dir, coding)
+                    with open(cache_path, "wb") as file:
+                        file.write(variant)
+                    written.append(cache_path)
+        return written
+
+    @property
+    def assets(self) -> Mapping[str, Asset]:
+        if not self._assets:
+            self.load()
+        return self._assets
+
+    def get(self, hashed_path: str) -> Optional[Asset]:
+        """Return the asset served at a fingerprinted path, if any."""
+        if not self._assets:
+            self.load()
+        return self._by_hashed_path.get(hashed_path)
+
+    def url(self, path: str) -> str:
+        """Return the fingerprinted URL of an asset, e.g. asset_url('static/styles.css').
+
+        Unknown paths fall back to their plain, unfingerprinted URL.
+        """
+        path = path.lstrip("/")
+        asset = self.assets.get(path)
+        return asset.url if asset is not None else f"/{path}"
+
+
+class AssetsApp:
+    """ASGI app serving the assets of a manifest with immutable caching.
+
+    The variant is chosen from the Accept-Encoding header of the request.
+    Assets not compressed yet are compressed in the thread pool, once, so
+    that the event loop keeps serving meanwhile.
+    """
+
+    def __init__(self, manifest: AssetManifest) -> None:
+        self.manifest = manifest
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+        asset = self.manifest.get(scope["path"].removeprefix(scope["root_path"])[1:])
+
+        if scope["method"] not in ("GET", "HEAD"):
+            response = Response(status_code=405, headers={"Allow": "GET, HEAD"})
+        elif asset is None:
+            response = Response("Not Found", status_code=404, media_type="text/plain")
+        else:
+            if not asset.compressed:
+                await run_in_threadpool(lambda: asset.variants)
+            coding = asset.negotiate(headers.get("accept-encoding", ""))
+            etag = asset.etag(coding)
+            response_headers = {
+                "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+                "ETag": etag,
+                "Vary": "Accept-Encoding",
+            }
+            if coding != "identity":
+                response_headers["Content-Encoding"] = coding
+
+            if is_not_modified(headers.get("if-none-match"), etag):
+                response = Response(status_code=304, headers=response_headers)
+            else:
+                response = Response(
+                    asset.variants[coding],
+                    media_type=asset.media_type,
+                    headers=response_headers,
+                )
+
+        await response(scope, receive, send)
+
+
+asset_manifest = AssetManifest(cache_dir=settings.asset_cache_dir)
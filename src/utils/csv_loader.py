@@ -1,9 +1,17 @@
 from functools import lru_cache
 
-import pandas as pd
+import numpy as np
 
 
 @lru_cache(maxsize=2)
-def load_csv(file_path: str) -> pd.DataFrame:
-    """Load and cache a CSV file."""
-    return pd.read_csv(file_path, sep="\t")
+def load_csv(file_path: str) -> dict[str, np.ndarray]:
+    """Load and cache a numeric TSV file, as one float64 array per column."""
+    with open(file_path, encoding="utf-8") as file:
+        header = file.readline().rstrip("\r\n").split("\t")
+        rows = [line.rstrip("\r\n").split("\t") for line in file if line.strip()]
+
+    try:
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), len(header))
+    except ValueError as e:
+        raise ValueError(f"{file_path} must be a numeric table.") from e
+    return {column: values[:, index] for index, column in enumerate(header)}
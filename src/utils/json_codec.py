@@ -0,0 +1,80 @@
+import copy
+from typing import Any, Callable, TypeVar
+
+import pydantic_core
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional dependency
+    orjson = None
+
+Model = TypeVar("Model", bound=BaseModel)
+
+# Serialize with orjson when it is installed, else with pydantic's own encoder,
+# which is still several times faster than the json module
+dumps: Callable[[Any], bytes] = (
+    orjson.dumps if orjson is not None else pydantic_core.to_json
+)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response serialized with dumps, without whitespace."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+async def parse_json_body(request: Request, model: type[Model]) -> Model:
+    """Decode and validate a JSON request body in one step, with model's validator.
+
+    Errors are raised as FastAPI's RequestValidationError, located in the
+    body, so clients get the same 422 responses as from a body parameter.
+    """
+    try:
+        return model.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]
+        )
+
+
+def json_body_schema(
+    model: type[BaseModel], media_type: str = "application/json"
+) -> dict[str, Any]:
+    """Return the openapi_extra documenting a body of model for a route.
+
+    Routes reading their body with parse_json_body, or parsing their form
+    themselves, have no body parameter, so the schema of model is inlined in
+    the route instead.
+    """
+    return {
+        "requestBody": {
+            "content": {media_type: {"schema": _inline_refs(model)}},
+            "required": True,
+        }
+    }
+
+
+def _inline_refs(model: type[BaseModel]) -> dict[str, Any]:
+    """Return the JSON schema of model with its definitions inlined."""
+    schema = model.model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                name = node["$ref"].rsplit("/", 1)[-1]
+                return resolve(copy.deepcopy(definitions[name]))
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
@@ -0,0 +1,355 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Iterable, Sequence
+
+import jinja2
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the latency histogram buckets, from 100 µs to 10 s
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Metric:
+    """A named metric with one value per combination of label values.
+
+    Every update holds a lock of the metric, which is uncontended in practice:
+    requests are recorded from the event loop thread.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[tuple[str, tuple[str, ...], float]]:
+        """Return the (name suffix, label values, value) samples of the metric."""
+        with self._lock:
+            return [("", labels, value) for labels, value in self._values.items()]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, label_values, value in self.samples():
+            names = self.label_names(suffix)
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(names, label_values)} "
+                f"{_format_value(value)}"
+            )
+        return lines
+
+    def label_names(self, suffix: str) -> tuple[str, ...]:
+        return self.labels
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Histogram of observations, counted in fixed buckets.
+
+    Each observation increments one bucket; the buckets are only made
+    cumulative when the metric is rendered.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: one count per bucket plus +Inf, then the sum
+        self._observations: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            observations = self._observations.get(labels)
+            if observations is None:
+                observations = self._observations[labels] = [0.0] * (
+                    len(self.buckets) + 2
+                )
+            observations[index] += 1
+            observations[-1] += value
+
+    def time(self, *labels: str) -> "Timer":
+        """Return a context manager observing the seconds spent in its block."""
+        return Timer(self, labels)
+
+    def samples(self) -> Iterable[tuple[str, tuple[str, ...], float]]:
+        with self._lock:
+            snapshot = {
+                labels: list(values) for labels, values in self._observations.items()
+            }
+
+        samples = []
+        for labels, observations in snapshot.items():
+            count = 0.0
+            for bound, bucket_count in zip(
+                self.buckets + (math.inf,), observations[:-1]
+            ):
+                count += bucket_count
+                samples.append(("_bucket", labels + (_format_value(bound),), count))
+            samples.append(("_sum", labels, observations[-1]))
+            samples.append(("_count", labels, count))
+        return samples
+
+    def label_names(self, suffix: str) -> tuple[str, ...]:
+        # Buckets are labelled with their upper bound
+        return self.labels + ("le",) if suffix == "_bucket" else self.labels
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class MetricsRegistry:
+    """Metrics of the process, rendered in the Prometheus text format.
+
+    Collectors are callables run on every render, returning metrics whose
+    values are read from elsewhere, such as cache statistics.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+        self.collectors: list[Callable[[], Iterable[Metric]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        # Collectors may return metrics of the same name, such as one per
+        # cache, which are rendered as the samples of a single metric
+        collected: dict[str, Metric] = {}
+        for collector in self.collectors:
+            for metric in collector():
+                existing = collected.setdefault(metric.name, metric)
+                if existing is not metric:
+                    existing._values.update(metric._values)
+
+        lines = []
+        for metric in self.metrics + list(collected.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+############# APPLICATION METRICS ###############
+
+metrics = MetricsRegistry()
+
+http_requests = metrics.counter(
+    "http_requests_total",
+    "HTTP requests served, by method, route and status code.",
+    ("method", "route", "status"),
+)
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time to serve HTTP requests, by method and route.",
+    ("method", "route"),
+)
+http_requests_in_progress = metrics.gauge(
+    "http_requests_in_progress", "HTTP requests being served."
+)
+stage_duration = metrics.histogram(
+    "hcirc_stage_duration_seconds",
+    "Time spent in each stage of a percentile request: validation, "
+    "normalization, computation and rendering.",
+    ("stage",),
+)
+rate_limit_rejections = metrics.counter(
+    "rate_limit_rejections_total",
+    "Requests rejected for exceeding their quota, by tier.",
+    ("tier",),
+)
+rate_limit_storage_full = metrics.counter(
+    "rate_limit_storage_full_total",
+    "Rate limit hits rejected because the mmap:// storage had no free slot.",
+)
+
+
+def route_label(scope: Scope) -> str:
+    """Return the route template that served a request, e.g. /api/v1/jobs/{job_id}.
+
+    Requests to mounted apps are labelled with their mount path. Requests that
+    matched no route share one label, so that arbitrary URLs don't create new
+    series.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "app_root_path" in scope:
+        # Served by a mounted app, such as the static files
+        return scope["root_path"].removeprefix(scope["app_root_path"]) or "/"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Count HTTP requests and observe their latency, per route.
+
+    Route templates are set in the scope by the router, so they are read once
+    the request has been served.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_progress.dec()
+            route = route_label(scope)
+            http_requests.inc(scope["method"], route, str(status))
+            http_request_duration.observe(elapsed, scope["method"], route)
+
+
+class TimedTemplate(jinja2.Template):
+    """Jinja template whose renders are observed as the rendering stage."""
+
+    def render(self, *args, **kwargs) -> str:
+        with stage_duration.time("rendering"):
+            return super().render(*args, **kwargs)
+
+
+def instrument_templates(env: jinja2.Environment) -> None:
+    """Observe the renders of the templates of env, which must not be loaded yet."""
+    env.template_class = TimedTemplate
+
+
+def cache_metrics(name: str, stats: Callable[[], dict]) -> Callable[[], list[Metric]]:
+    """Return a collector of the hits, misses and size of a cache.
+
+    stats returns a dict with hits, misses and size keys, and optionally
+    evictions, as returned by ResultCache.stats.
+    """
+
+    def collect() -> list[Metric]:
+        values = stats()
+        collected: list[Metric] = []
+        for key, metric_type, help in (
+            ("hits", Counter, "Cache lookups that found a value."),
+            ("misses", Counter, "Cache lookups that computed the value."),
+            ("evictions", Counter, "Values evicted from a full cache."),
+            ("size", Gauge, "Values held in a cache."),
+        ):
+            if key not in values:
+                continue
+            suffix = "_total" if metric_type is Counter else ""
+            metric = metric_type(f"cache_{key}{suffix}", help, ("cache",))
+            metric._values[(name,)] = values[key]
+            collected.append(metric)
+        return collected
+
+    return collect
@@ -0,0 +1,186 @@
+import cProfile
+import hmac
+import os
+import random
+import sysconfig
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Sequence
+
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..config import logger, settings
+
+# Header carrying the admin token, to profile one request on demand
+PROFILE_HEADER = "x-profile-token"
+# Header of profiled responses, naming their profile files
+PROFILE_ID_HEADER = "x-profile-id"
+
+# Frames kept per allocation traceback
+TRACEMALLOC_FRAMES = 32
+
+# cProfile and tracemalloc are process-wide, so one request is profiled at a time
+_profiling = threading.Lock()
+
+
+class ProfilingMiddleware:
+    """Capture a CPU profile and an allocation snapshot of selected requests.
+
+    A request is profiled when it carries the admin token in X-Profile-Token,
+    or else with probability sample_rate, and only when it is served by one
+    of routes. Requests run on the event loop thread alongside others, so a
+    profile also contains the work of concurrent requests; work handed to the
+    threadpool is not included.
+
+    Each profile writes two files to directory, named after the profile ID
+    returned in X-Profile-Id:
+
+    - {id}.prof: cProfile statistics, for snakeviz or flameprof.
+    - {id}.alloc.folded: bytes allocated and still alive at the end of the
+      request, per stack in the folded format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Sequence[BaseRoute],
+        token: str,
+        directory: str,
+        sample_rate: float = 0.0,
+    ) -> None:
+        self.app = app
+        self.routes = routes
+        self.token = token.encode()
+        self.directory = directory
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if not _profiling.acquire(blocking=False):
+            # Another request is being profiled
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profile(scope, receive, send)
+        finally:
+            _profiling.release()
+
+    def _selected(self, scope: Scope) -> bool:
+        token = dict(scope["headers"]).get(PROFILE_HEADER.encode())
+        if token is not None:
+            requested = hmac.compare_digest(token, self.token)
+        else:
+            requested = random.random() < self.sample_rate
+        return requested and any(
+            route.matches(scope)[0] == Match.FULL for route in self.routes
+        )
+
+    async def _profile(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.encode(), profile_id.encode())
+                ]
+            await send(message)
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+
+            await run_in_threadpool(self._write, profile_id, profiler, snapshot)
+            logger.info(
+                f"Profiled {scope['method']} {scope['path']} in "
+                f"{elapsed * 1000:.1f} ms as {profile_id}"
+            )
+
+    def _write(
+        self,
+        profile_id: str,
+        profiler: cProfile.Profile,
+        snapshot: tracemalloc.Snapshot,
+    ) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, profile_id)
+        profiler.dump_stats(f"{path}.prof")
+        with open(f"{path}.alloc.folded", "w") as file:
+            file.writelines(allocation_stacks(snapshot))
+
+
+def allocation_stacks(snapshot: tracemalloc.Snapshot) -> list[str]:
+    """Return the folded stacks of a snapshot, one "frame;frame;... bytes" line each.
+
+    Frames go from the outermost call to the allocation, and are written as
+    file:line. Allocations made by tracemalloc itself are left out.
+    """
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    lines = []
+    for statistic in snapshot.statistics("traceback"):
+        # Traceback frames are ordered from the oldest to the most recent call
+        stack = ";".join(
+            f"{_short_path(frame.filename)}:{frame.lineno}"
+            for frame in statistic.traceback
+        )
+        lines.append(f"{stack} {statistic.size}\n")
+    return lines
+
+
+def _short_path(filename: str) -> str:
+    """Return a file name relative to the project, site-packages or the stdlib."""
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix) :]
+    return filename
+
+
+# Longest first, since site-packages is within the stdlib directory
+_PATH_PREFIXES = sorted(
+    {os.getcwd() + os.sep}
+    | {sysconfig.get_paths()[name] + os.sep for name in ("purelib", "stdlib")},
+    key=len,
+    reverse=True,
+)
+
+
+def setup_profiling(app, routes: Sequence[BaseRoute]) -> bool:
+    """Add the profiling middleware to app when the settings allow it.
+
+    Profiling needs PROFILING_ENABLED, an admin PROFILING_TOKEN and an
+    environment other than development. Otherwise nothing is added, so the
+    requests pay nothing for it. Returns whether the middleware was added.
+    """
+    if not settings.profiling_enabled:
+        return False
+    if settings.environment == "development" or not settings.profiling_token:
+        logger.warning(
+            "Profiling is only available outside development, with PROFILING_TOKEN set"
+        )
+        return False
+
+    app.add_middleware(
+        ProfilingMiddleware,
+        routes=routes,
+        token=settings.profiling_token,
+        directory=settings.profiling_dir,
+        sample_rate=settings.profiling_sample_rate,
+    )
+    return True
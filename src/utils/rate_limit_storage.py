@@ -0,0 +1,253 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from limits.storage import SlidingWindowCounterSupport, Storage
+
+from ..config import logger
+from .metrics import rate_limit_storage_full
+
+# Header: magic and number of slots. Slot: key hash, expiry timestamp, count
+_HEADER = struct.Struct("<8sQ")
+_SLOT = struct.Struct("<Qdq")
+_MAGIC = b"GMRATE01"
+
+DEFAULT_SLOTS = 65536
+# Slots probed per key, so every operation touches a bounded number of slots
+PROBES = 8
+# Count returned for a key that finds no free slot, above any limit
+FULL_COUNT = 2**63 - 1
+
+
+class SharedFileStorage(Storage, SlidingWindowCounterSupport):
+    """Rate limit counters in a memory-mapped file shared by every worker on a host.
+
+    Keys are hashed into a fixed-size table of slots, so each operation reads
+    and writes at most PROBES slots under one lock: a thread lock within a
+    process, and an flock on the file across processes. The file never grows:
+    when every probed slot holds a live counter, a new key fails closed, its
+    hits are rejected until one of them expires, and the storage logs a
+    warning and counts it in rate_limit_storage_full_total. Live counters are
+    never evicted, since that would reset the quota of their client.
+
+    The table should have about twice as many slots as there are live keys,
+    one per client and limit, or two with the sliding window counter.
+    Registered as the mmap:// scheme, e.g. mmap:///tmp/gather-metrics-ratelimit
+    or mmap:///tmp/gather-metrics-ratelimit?slots=262144. It supports the
+    fixed-window and sliding-window-counter strategies.
+    """
+
+    STORAGE_SCHEME = ["mmap"]
+
+    def __init__(
+        self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options
+    ) -> None:
+        parsed = urllib.parse.urlparse(uri or "")
+        if not parsed.path:
+            raise ValueError(f"Rate limit storage URI has no file path: {uri}")
+        query = urllib.parse.parse_qs(parsed.query)
+
+        self.path = parsed.path
+        self.slots = int(query.get("slots", [options.get("slots", DEFAULT_SLOTS)])[0])
+        if self.slots < PROBES:
+            raise ValueError(f"Rate limit storage needs at least {PROBES} slots.")
+
+        self._lock = threading.RLock()
+        self._pid: Optional[int] = None
+        self._fd = -1
+        self._map: Optional[mmap.mmap] = None
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self) -> type[Exception]:
+        return OSError
+
+    def _open(self) -> None:
+        # Each process needs its own file description, since flock locks are
+        # shared by the descriptors inherited across fork
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+
+        size = _HEADER.size + self.slots * _SLOT.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, self.slots), 0)
+            elif os.pread(self._fd, _HEADER.size, 0) != _HEADER.pack(
+                _MAGIC, self.slots
+            ):
+                raise OSError(f"{self.path} is not a rate limit storage file.")
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self) -> Iterator[mmap.mmap]:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _slot(
+        self, key: str, now: float, create: bool
+    ) -> tuple[Optional[int], int, float, int]:
+        """Return (offset, key hash, expiry, count) of the slot for key.
+
+        Expired or missing counters have a count of 0. With create, the offset
+        is where a new counter for key should be written, or None when every
+        probed slot holds a live counter.
+        """
+        key_hash = int.from_bytes(
+            hashlib.blake2b(key.encode(), digest_size=8).digest(), "little"
+        )
+        key_hash = key_hash or 1  # 0 marks an empty slot
+        start = key_hash % self.slots
+
+        free = None
+        for probe in range(PROBES):
+            offset = _HEADER.size + ((start + probe) % self.slots) * _SLOT.size
+            slot_hash, expiry, count = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                if expiry <= now:
+                    return offset, key_hash, now, 0
+                return offset, key_hash, expiry, count
+            if create and free is None and (slot_hash == 0 or expiry <= now):
+                free = offset
+
+        if create and free is None:
+            rate_limit_storage_full.inc()
+            logger.warning(
+                "Rate limit storage %s is full around key %s, rejecting its hits. "
+                "Increase its slots.",
+                self.path,
+                key,
+            )
+        return free, key_hash, now, 0
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        now = time.time()
+        with self._locked() as table:
+            offset, key_hash, expires_at, count = self._slot(key, now, create=True)
+            if offset is None:
+                return FULL_COUNT
+            if count == 0:
+                expires_at = now + expiry
+            count += amount
+            _SLOT.pack_into(table, offset, key_hash, expires_at, count)
+        return count
+
+    def decr(self, key: str, amount: int = 1) -> int:
+        now = time.time()
+        with self._locked() as table:
+            offset, key_hash, expires_at, count = self._slot(key, now, create=False)
+            if count == 0:
+                return 0
+            count = max(count - amount, 0)
+            _SLOT.pack_into(table, offset, key_hash, expires_at, count)
+        return count
+
+    def get(self, key: str) -> int:
+        with self._locked():
+            return self._slot(key, time.time(), create=False)[3]
+
+    def get_expiry(self, key: str) -> float:
+        with self._locked():
+            return self._slot(key, time.time(), create=False)[2]
+
+    def clear(self, key: str) -> None:
+        with self._locked() as table:
+            offset, _, _, count = self._slot(key, time.time(), create=False)
+            if count:
+                _SLOT.pack_into(table, offset, 0, 0.0, 0)
+
+    def check(self) -> bool:
+        try:
+            with self._locked():
+                return True
+        except OSError:
+            return False
+
+    def reset(self) -> int:
+        now = time.time()
+        live = 0
+        with self._locked() as table:
+            for index in range(self.slots):
+                offset = _HEADER.size + index * _SLOT.size
+                slot_hash, expiry, _ = _SLOT.unpack_from(table, offset)
+                live += slot_hash != 0 and expiry > now
+            table[_HEADER.size :] = bytes(self.slots * _SLOT.size)
+        return live
+
+    ############# SLIDING WINDOW COUNTER ###############
+
+    @staticmethod
+    def _window_keys(key: str, expiry: int, now: float) -> tuple[str, str]:
+        """Return the keys of the previous and current windows of key."""
+        return f"{key}/{int((now - expiry) / expiry)}", f"{key}/{int(now / expiry)}"
+
+    def _sliding_window(
+        self, key: str, expiry: int, now: float
+    ) -> tuple[int, float, int, float]:
+        previous_key, current_key = self._window_keys(key, expiry, now)
+        previous_count = self._slot(previous_key, now, create=False)[3]
+        current_count = self._slot(current_key, now, create=False)[3]
+        previous_ttl = 0.0
+        if previous_count:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(
+        self, key: str, limit: int, expiry: int, amount: int = 1
+    ) -> bool:
+        if amount > limit:
+            return False
+
+        now = time.time()
+        with self._locked() as table:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(
+                key, expiry, now
+            )
+            weighted_count = previous_count * previous_ttl / expiry + current_count
+            if math.floor(weighted_count) + amount > limit:
+                return False
+
+            # The current window is kept until the end of the next one, when
+            # it is the previous window
+            current_key = self._window_keys(key, expiry, now)[1]
+            offset, key_hash, expires_at, count = self._slot(
+                current_key, now, create=True
+            )
+            if offset is None:
+                return False
+            if count == 0:
+                expires_at = now + 2 * expiry
+            _SLOT.pack_into(table, offset, key_hash, expires_at, count + amount)
+        return True
+
+    def get_sliding_window(
+        self, key: str, expiry: int
+    ) -> tuple[int, float, int, float]:
+        with self._locked():
+            return self._sliding_window(key, expiry, time.time())
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        for window_key in self._window_keys(key, expiry, time.time()):
+            self.clear(window_key)
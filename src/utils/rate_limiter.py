@@ -1,18 +1,100 @@
+import time
+from typing import Callable, Union
+
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import JSONResponse, RedirectResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..config import settings
+from . import rate_limit_storage  # noqa: F401 - registers the mmap:// storage
+from .metrics import rate_limit_rejections
+
+# Header identifying API clients, mapped to client IDs by settings.rate_limit_api_keys
+API_KEY_HEADER = "x-api-key"
+
+RATE_LIMIT_EXCEEDED = "Rate limit exceeded. Please try again later."
+
+# Quota units consumed by a request. Pages, partials and cached lookups cost
+# PAGE_COST and a percentile computation COMPUTE_COST. Batches, streams and
+# cohort jobs cost COMPUTE_COST up front, then one unit per record as their
+# records are parsed, however many there are
+PAGE_COST = 1
+COMPUTE_COST = 10
+
+
+def client_key(request: Request) -> str:
+    """Return the quota key of a request: its API client, or else its IP address."""
+    api_key = request.headers.get(API_KEY_HEADER)
+    client_id = settings.rate_limit_api_keys.get(api_key) if api_key else None
+    if client_id:
+        return f"client:{client_id}"
+    return f"ip:{get_remote_address(request)}"
+
+
+def client_tier(key: str) -> str:
+    """Return the tier of a client_key, e.g. "anonymous"."""
+    if key.startswith("client:"):
+        return settings.rate_limit_client_tiers.get(key[len("client:") :], "client")
+    return "anonymous"
+
+
+def tier_limit(key: str) -> str:
+    """Return the quota of the tier of a client_key, e.g. "1000/minute"."""
+    return settings.rate_limit_tiers.get(
+        client_tier(key), settings.rate_limit_tiers["anonymous"]
+    )
+
+
+limiter = Limiter(
+    key_func=client_key,
+    strategy=settings.rate_limit_strategy,
+    storage_uri=settings.rate_limit_storage_uri,
+)
+
+
+def rate_limit(cost: Union[int, Callable[[Request], int]] = PAGE_COST):
+    """Charge a route to the client's quota, which every route shares."""
+    return limiter.shared_limit(tier_limit, scope="quota", cost=cost)
+
 
-limiter = Limiter(key_func=get_remote_address)
+def quota_charger(request: Request) -> Callable[[int], bool]:
+    """Return a function charging records to the quota of a request.
+
+    The request must have been charged by rate_limit first. The function can
+    be called after the response is sent, for work done in the background,
+    and returns False, counting a rejection, when the quota is exhausted.
+    """
+    current_limit = getattr(request.state, "view_rate_limit", None)
+    tier = client_tier(client_key(request))
+
+    def charge(records: int) -> bool:
+        if not limiter.enabled or current_limit is None or records <= 0:
+            return True
+        item, args = current_limit
+        if not limiter.limiter.hit(item, *args, cost=records):
+            rate_limit_rejections.inc(tier)
+            return False
+        return True
+
+    return charge
+
+
+def charge_records(request: Request, records: int) -> bool:
+    """Charge the records of a bulk request to its client's quota; see quota_charger."""
+    return quota_charger(request)(records)
 
 
 # Custom rate limit handler if you need to wrap it
 def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> Response:
+    rate_limit_rejections.inc(client_tier(client_key(request)))
+
     # Check if the request is an API request (likely JSON) or HTML
     if "application/json" in request.headers.get("accept", ""):
         return JSONResponse(
-            content={"detail": "Rate limit exceeded. Please try again later."},
+            content={"detail": RATE_LIMIT_EXCEEDED},
             status_code=429,
         )
     else:
@@ -20,7 +102,50 @@ def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> Res
         return RedirectResponse(url="/too-many-requests", status_code=302)
 
 
+class RateLimitHeadersMiddleware:
+    """Add RateLimit-* headers, and Retry-After to 429s, to rate limited responses.
+
+    The limit checked for a request is recorded in its state by the limiter,
+    so the headers are only computed for routes with a quota.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                current_limit = scope.get("state", {}).get("view_rate_limit")
+                if current_limit is not None:
+                    message["headers"] = list(message.get("headers", [])) + (
+                        _rate_limit_headers(current_limit, message["status"])
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+def _rate_limit_headers(current_limit, status: int) -> list[tuple[bytes, bytes]]:
+    item, args = current_limit
+    reset_at, remaining = limiter.limiter.get_window_stats(item, *args)
+    reset_in = max(int(reset_at - time.time()) + 1, 0)
+    headers = [
+        ("ratelimit-limit", str(item.amount)),
+        ("ratelimit-remaining", str(remaining)),
+        ("ratelimit-reset", str(reset_in)),
+        ("ratelimit-policy", f"{item.amount};w={item.get_expiry()}"),
+    ]
+    if status == 429:
+        headers.append(("retry-after", str(reset_in)))
+    return [(name.encode(), value.encode()) for name, value in headers]
+
+
 # A utility function to add middleware and exception handler to the app
 def setup_rate_limiter(app: FastAPI):
     app.state.limiter = limiter
     app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)  # type: ignore
+    app.add_middleware(RateLimitHeadersMiddleware)
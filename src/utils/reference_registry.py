@@ -0,0 +1,479 @@
+import bisect
+import hashlib
+import math
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+from typing import Callable, Iterator, Mapping, Optional
+
+import numpy as np
+
+from ..config import logger, settings
+from .csv_loader import load_csv
+from .hcirc_utils import norm_from_percentiles, norm_ppf
+from .reference_store import (
+    DEFAULT_REFERENCE,
+    SEX_FILES,
+    ReferenceStore,
+    build_store,
+    read_reference,
+    reference_files,
+)
+
+MEASURE = "hcirc"
+REFERENCE_DIR = "data/hcirc_model"
+CENTILES = ("3", "10", "25", "50", "75", "90", "97")
+
+
+def _read_only(values) -> np.ndarray:
+    """Return a contiguous, read-only float64 array of values.
+
+    Arrays that already are, such as views of the reference store, are
+    returned as they are; anything else is copied.
+    """
+    array = np.asarray(values, dtype=np.float64)
+    if array.flags.writeable or not array.flags.c_contiguous:
+        array = np.array(array, order="C")
+        array.flags.writeable = False
+    return array
+
+
+class AgeGrid:
+    """Normal loc/scale of a reference resampled onto a uniform age grid.
+
+    A lookup is an index computation plus a fetch and a linear blend of two
+    neighbouring grid points, with no search and no branches. The exact path
+    interpolates linearly between the irregular reference ages, so the
+    difference with the grid is largest at those reference ages and is
+    measured there when the grid is built:
+
+    - max_loc_error and max_scale_error are the largest absolute differences
+      in cm between the grid and the exact loc/scale, at any age.
+    - max_percentile_error is a first-order bound, in percentile points, on
+      the resulting difference in any returned percentile:
+      100 * (phi(0) * max_loc_error + phi(1) * max_scale_error) / min(scale).
+    """
+
+    def __init__(self, age, p25, p75, step_years: float) -> None:
+        if step_years <= 0:
+            raise ValueError("Age grid step must be a positive number.")
+
+        self.start = float(age[0])
+        self.stop = float(age[-1])
+        self.step = step_years
+        self.inv_step = 1.0 / step_years
+
+        size = math.ceil((self.stop - self.start) * self.inv_step) + 1
+        grid_age = self.start + self.step * np.arange(max(size, 2))
+        loc, scale = norm_from_percentiles(
+            np.interp(grid_age, age, p25), 0.25, np.interp(grid_age, age, p75), 0.75
+        )
+        self.loc = _read_only(loc)
+        self.scale = _read_only(scale)
+        self.loc_slope = _read_only(np.diff(loc))
+        self.scale_slope = _read_only(np.diff(scale))
+
+        exact_loc, exact_scale = norm_from_percentiles(p25, 0.25, p75, 0.75)
+        grid_loc, grid_scale = self.lookup(age)
+        self.max_loc_error = float(np.max(np.abs(grid_loc - exact_loc)))
+        self.max_scale_error = float(np.max(np.abs(grid_scale - exact_scale)))
+        self.max_percentile_error = (
+            100
+            * (_PDF_AT_0 * self.max_loc_error + _PDF_AT_1 * self.max_scale_error)
+            / float(np.min(exact_scale))
+        )
+
+    def lookup(self, age_years):
+        """Return the normal (loc, scale) at age_years, capped to the grid range."""
+        position = (np.clip(age_years, self.start, self.stop) - self.start) * (
+            self.inv_step
+        )
+        index = np.minimum(position.astype(np.intp), self.loc_slope.size - 1)
+        fraction = position - index
+        loc = self.loc[index] + fraction * self.loc_slope[index]
+        scale = self.scale[index] + fraction * self.scale_slope[index]
+        return loc, scale
+
+
+# Standard normal density at 0 and 1, used to bound the grid percentile error
+_PDF_AT_0 = 1 / math.sqrt(2 * math.pi)
+_PDF_AT_1 = math.exp(-0.5) / math.sqrt(2 * math.pi)
+
+
+class CentileModel:
+    """Piecewise-linear z-score model through all the centiles of a reference.
+
+    At a given age, the centile values are interpolated linearly between the
+    reference ages, as in the normal fit. A measurement between two centiles is
+    then mapped linearly onto the z-scores of those centiles. Below the lowest
+    or above the highest centile, the outer segment is extended. Centiles
+    increase across every row, so the mapping is monotone and the returned
+    z-score can be turned into a percentile with the normal CDF.
+
+    The per-row age slopes and per-segment z-score steps are precomputed, so an
+    evaluation is a row lookup, one linear blend and one closed-form division.
+    """
+
+    def __init__(self, age, centiles) -> None:
+        self.age = age
+        self.centiles = centiles
+        self.age_slope = _read_only(np.diff(centiles, axis=0) / np.diff(age)[:, None])
+        self.z = _read_only([norm_ppf(int(centile) / 100) for centile in CENTILES])
+        self.z_step = _read_only(np.diff(self.z))
+
+        # Plain Python copies for single measurements, where NumPy call
+        # overhead would dominate the few operations needed
+        self._age_list = self.age.tolist()
+        self._centile_rows = [tuple(row) for row in self.centiles.tolist()]
+        self._slope_rows = [tuple(row) for row in self.age_slope.tolist()]
+        self._z_list = self.z.tolist()
+
+    def z_score(self, age_years, hcirc_cm) -> np.ndarray:
+        """Return the z-score of hcirc_cm at age_years, capped to the reference ages."""
+        if np.ndim(hcirc_cm) == 0 and np.ndim(age_years) == 0:
+            return np.float64(self._scalar_z_score(float(age_years), float(hcirc_cm)))
+
+        shape = np.shape(hcirc_cm)
+        age = np.clip(np.ravel(age_years), self.age[0], self.age[-1])
+        hcirc_cm = np.ravel(hcirc_cm)
+
+        row = np.searchsorted(self.age, age, side="right") - 1
+        row = np.clip(row, 0, self.age.size - 2)
+        values = (
+            self.centiles[row] + (age - self.age[row])[:, None] * self.age_slope[row]
+        )
+
+        # Index of the segment [values[k], values[k + 1]] the measurement falls in
+        segment = np.count_nonzero(hcirc_cm[:, None] >= values[:, 1:-1], axis=1)
+        rows = np.arange(values.shape[0])
+        lower = values[rows, segment]
+        upper = values[rows, segment + 1]
+        z = self.z[segment] + (hcirc_cm - lower) * self.z_step[segment] / (
+            upper - lower
+        )
+        return z.reshape(shape)
+
+    def _scalar_z_score(self, age_years: float, hcirc_cm: float) -> float:
+        ages = self._age_list
+        age = min(max(age_years, ages[0]), ages[-1])
+        row = min(max(bisect.bisect_right(ages, age) - 1, 0), len(ages) - 2)
+
+        offset = age - ages[row]
+        values = [
+            value + offset * slope
+            for value, slope in zip(self._centile_rows[row], self._slope_rows[row])
+        ]
+        segment = sum(1 for value in values[1:-1] if hcirc_cm >= value)
+        lower, upper = values[segment], values[segment + 1]
+        z_lower, z_upper = self._z_list[segment], self._z_list[segment + 1]
+        return z_lower + (hcirc_cm - lower) * (z_upper - z_lower) / (upper - lower)
+
+
+class ReferenceTable:
+    """Head circumference reference centiles for one sex, compiled for lookups.
+
+    Every array is contiguous float64 and read-only, so the table can be
+    shared freely between requests without copying.
+    """
+
+    def __init__(self, age, centiles, grid_step_years: Optional[float] = None) -> None:
+        self.age = _read_only(age)
+        self.centiles = _read_only(centiles)
+
+        if self.age.ndim != 1 or self.age.size < 2:
+            raise ValueError("Reference table needs at least two age rows.")
+        if self.centiles.shape != (self.age.size, len(CENTILES)):
+            raise ValueError(
+                f"Reference table must have one column per centile {CENTILES}."
+            )
+        if not (np.isfinite(self.age).all() and np.isfinite(self.centiles).all()):
+            raise ValueError("Reference table contains missing or invalid values.")
+        if np.any(np.diff(self.age) <= 0):
+            raise ValueError("Reference table ages must be strictly increasing.")
+        if np.any(np.diff(self.centiles, axis=1) <= 0):
+            raise ValueError("Reference table centiles must increase across columns.")
+
+        self.p25 = self.centiles[:, CENTILES.index("25")]
+        self.p75 = self.centiles[:, CENTILES.index("75")]
+        self.min_age = float(self.age[0])
+        self.max_age = float(self.age[-1])
+
+        self.centile_model = CentileModel(self.age, self.centiles)
+
+        self.grid: Optional[AgeGrid] = None
+        if grid_step_years is not None:
+            self.grid = AgeGrid(self.age, self.p25, self.p75, grid_step_years)
+
+    @classmethod
+    def from_file(
+        cls, file_path: str, grid_step_years: Optional[float] = None
+    ) -> "ReferenceTable":
+        """Compile a reference table from a TSV with an Age column and centile columns."""
+        data = load_csv(file_path)
+        centiles = np.column_stack([data[column] for column in CENTILES])
+        return cls(age=data["Age"], centiles=centiles, grid_step_years=grid_step_years)
+
+
+class ReferenceSnapshot:
+    """One loaded version of every reference table, never modified once built.
+
+    version is a short hash of the table values, the same whichever source
+    they were read from; checksum is the one of the reference store, if they
+    were read from one; signature identifies the files they were read from,
+    as returned by ReferenceRegistry.source_signature.
+    """
+
+    def __init__(
+        self,
+        references: Mapping[str, Mapping[str, ReferenceTable]],
+        checksum: Optional[str] = None,
+        signature: tuple = (),
+    ) -> None:
+        self.checksum = checksum
+        self.signature = signature
+        self.references = MappingProxyType(
+            {
+                name: MappingProxyType(dict(tables))
+                for name, tables in references.items()
+            }
+        )
+        digest = hashlib.sha256()
+        for name in sorted(references):
+            for sex in sorted(references[name]):
+                table = references[name][sex]
+                digest.update(f"{name}/{sex}".encode())
+                digest.update(table.age.tobytes())
+                digest.update(table.centiles.tobytes())
+        self.version = digest.hexdigest()[:12]
+
+
+class ReferenceRegistry:
+    """Registry of compiled reference tables, keyed by reference and sex ("M" or "F").
+
+    Tables are read from the reference store at store_path when it exists,
+    as views of its read-only mapping, and otherwise parsed from the TSV files
+    of directory: the default reference directly in it, and one reference per
+    subdirectory.
+
+    With grid_step_days set, every table also gets an AgeGrid of that step,
+    which the percentile computation then uses instead of exact interpolation.
+
+    Every load compiles and validates a new ReferenceSnapshot before swapping
+    it in, so a failed load leaves the current tables in place. Lookups made
+    within pin() all use the snapshot current when it was entered, even if
+    the tables are reloaded meanwhile. Callbacks registered with on_load run
+    after every load, outside of its lock, so that caches of results computed from the previous
+    tables can be cleared.
+    """
+
+    def __init__(
+        self,
+        directory: str = REFERENCE_DIR,
+        grid_step_days: Optional[float] = None,
+        store_path: Optional[str] = None,
+        default_reference: str = DEFAULT_REFERENCE,
+    ) -> None:
+        self.directory = directory
+        self.grid_step_days = grid_step_days
+        self.store_path = store_path
+        self.default_reference = default_reference
+        self._snapshot: Optional[ReferenceSnapshot] = None
+        self._pinned: ContextVar[Optional[ReferenceSnapshot]] = ContextVar(
+            f"reference_snapshot_{id(self)}", default=None
+        )
+        self._load_lock = threading.Lock()
+        self._listeners: list[Callable[[], None]] = []
+
+    def on_load(self, callback: Callable[[], None]) -> None:
+        """Register a callback to run whenever the tables are (re)loaded."""
+        self._listeners.append(callback)
+
+    def load(self) -> ReferenceSnapshot:
+        """Compile every reference table, from the store or the registry directory.
+
+        Returns the new snapshot once it is in place. Raises ValueError or
+        OSError, and keeps the current tables, if the new ones are invalid.
+        """
+        grid_step_years = None
+        if self.grid_step_days is not None:
+            grid_step_years = self.grid_step_days / 365.25
+
+        with self._load_lock:
+            sources, checksum, signature = self._read_sources()
+            references: dict[str, dict[str, ReferenceTable]] = {}
+            for (reference, sex), (age, centiles) in sources.items():
+                references.setdefault(reference, {})[sex] = ReferenceTable(
+                    age, centiles, grid_step_years
+                )
+            if self.default_reference not in references:
+                raise ValueError(
+                    f"Unknown default reference: {self.default_reference}."
+                )
+            for name, tables in references.items():
+                if set(tables) != set(SEX_FILES):
+                    raise ValueError(f"Reference {name} needs a table for each sex.")
+
+            snapshot = ReferenceSnapshot(references, checksum, signature)
+            self._snapshot = snapshot
+
+        for callback in self._listeners:
+            callback()
+        return snapshot
+
+    def source_signature(self) -> tuple:
+        """Return the modification time and size of the store and reference files."""
+        paths = []
+        if os.path.isdir(self.directory):
+            paths.extend(reference_files(self.directory).values())
+        if self.store_path:
+            paths.append(self.store_path)
+
+        signature = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append((path, None, None))
+            else:
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def changed(self) -> bool:
+        """Whether the files changed since the current tables were read from them."""
+        return self.source_signature() != self.snapshot.signature
+
+    def _read_sources(
+        self,
+    ) -> tuple[
+        dict[tuple[str, str], tuple[np.ndarray, np.ndarray]], Optional[str], tuple
+    ]:
+        """Return the ages and centiles of every table, by reference and sex.
+
+        Also returns the checksum of the reference store they were read from,
+        and the source_signature of the files before they were read. A store
+        older than the reference files, or without all of them, is rebuilt
+        from them first; if it cannot be written, the files are read directly.
+        """
+        # The files may have changed since they were last read
+        load_csv.cache_clear()
+
+        signature = self.source_signature()
+        store = None
+        if self.store_path and os.path.exists(self.store_path):
+            store = ReferenceStore(self.store_path)
+            if self._is_stale(store):
+                store = self._rebuild_store()
+                signature = self.source_signature()
+
+        if store is not None:
+            if store.centiles != CENTILES:
+                raise ValueError(
+                    f"{self.store_path} has other centiles than {CENTILES}."
+                )
+            sources = {
+                (key.reference, key.sex): store.arrays(key)
+                for key in store.keys()
+                if key.measure == MEASURE
+            }
+            return sources, store.checksum, signature
+
+        if self.store_path and not os.path.exists(self.store_path):
+            logger.info(
+                f"No reference store at {self.store_path}, reading {self.directory}"
+            )
+        sources = {
+            key: read_reference(path, CENTILES)
+            for key, path in reference_files(self.directory).items()
+        }
+        return sources, None, signature
+
+    def _is_stale(self, store: ReferenceStore) -> bool:
+        """Whether the reference files changed since store was built from them."""
+        if not os.path.isdir(self.directory):
+            return False
+        files = reference_files(self.directory)
+        stored = {
+            (key.reference, key.sex) for key in store.keys() if key.measure == MEASURE
+        }
+        built = os.path.getmtime(self.store_path)
+        return set(files) != stored or any(
+            os.path.getmtime(path) > built for path in files.values()
+        )
+
+    def _rebuild_store(self) -> Optional[ReferenceStore]:
+        """Rebuild the store from the reference files; None if it cannot be written.
+
+        Raises ValueError if the files are invalid, as the store is then left
+        unchanged.
+        """
+        try:
+            build_store(os.path.dirname(self.directory), self.store_path, CENTILES)
+        except OSError as e:
+            logger.warning(
+                f"{self.store_path} is older than the files in {self.directory} "
+                f"and could not be rebuilt ({e}), reading them instead"
+            )
+            return None
+        logger.info(f"Rebuilt {self.store_path} from {self.directory}")
+        return ReferenceStore(self.store_path)
+
+    @property
+    def snapshot(self) -> ReferenceSnapshot:
+        """The pinned snapshot within pin(), else the current one."""
+        snapshot = self._pinned.get() or self._snapshot
+        if snapshot is None:
+            snapshot = self.load()
+        return snapshot
+
+    @contextmanager
+    def pin(self) -> Iterator[ReferenceSnapshot]:
+        """Make every lookup of the block, and of tasks it starts, use one snapshot."""
+        token = self._pinned.set(self.snapshot)
+        try:
+            yield self._pinned.get()
+        finally:
+            self._pinned.reset(token)
+
+    @property
+    def version(self) -> str:
+        return self.snapshot.version
+
+    @property
+    def checksum(self) -> Optional[str]:
+        return self.snapshot.checksum
+
+    @property
+    def references(self) -> Mapping[str, Mapping[str, ReferenceTable]]:
+        return self.snapshot.references
+
+    @property
+    def tables(self) -> Mapping[str, ReferenceTable]:
+        """The tables of the default reference, by sex."""
+        return self.references[self.default_reference]
+
+    def tables_for(
+        self, reference: Optional[str] = None
+    ) -> Mapping[str, ReferenceTable]:
+        """Return the tables of a reference by sex, the default one for None."""
+        name = reference or self.default_reference
+        # Read the snapshot once, in case the tables are reloaded meanwhile
+        references = self.references
+        if name not in references:
+            raise ValueError(
+                f"Unknown reference: {name}. "
+                f"Available references: {', '.join(sorted(references))}."
+            )
+        return references[name]
+
+    def get(self, sex: str, reference: Optional[str] = None) -> ReferenceTable:
+        """Return the compiled reference table for the given sex and reference."""
+        return self.tables_for(reference)[sex]
+
+
+reference_registry = ReferenceRegistry(
+    grid_step_days=settings.reference_grid_step_days,
+    store_path=settings.reference_store_path,
+    default_reference=settings.reference_default,
+)
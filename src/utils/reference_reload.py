@@ -0,0 +1,137 @@
+import asyncio
+import os
+import signal
+import threading
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..config import logger
+from .reference_registry import ReferenceRegistry, ReferenceSnapshot
+
+# Response header naming the version of the reference tables used
+VERSION_HEADER = "x-reference-version"
+
+# Signal asking a process to check the reference files for changes. The
+# pre-fork server sets SERVER_PID_ENV in its workers, which send it this
+# signal after an admin reload; it then reloads its own tables and forwards
+# the signal to every worker
+RELOAD_SIGNAL = signal.SIGUSR1
+SERVER_PID_ENV = "GATHER_METRICS_SERVER_PID"
+
+
+class ReferenceVersionMiddleware:
+    """Serve every request from one version of the reference tables.
+
+    The current snapshot of registry is pinned for the whole request, so a
+    reload in the meantime only affects later requests, and its version is
+    returned in X-Reference-Version.
+    """
+
+    def __init__(self, app: ASGIApp, registry: ReferenceRegistry) -> None:
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with self.registry.pin() as snapshot:
+            header = (VERSION_HEADER.encode(), snapshot.version.encode())
+
+            async def send_with_version(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [header]
+                await send(message)
+
+            await self.app(scope, receive, send_with_version)
+
+
+async def reload_references(registry: ReferenceRegistry) -> ReferenceSnapshot:
+    """Reload the tables of registry off the event loop, and return them.
+
+    Raises ValueError or OSError, and keeps the current tables, if the new
+    ones are invalid.
+    """
+    snapshot = await run_in_threadpool(registry.load)
+    logger.info(f"Reloaded the reference tables, version {snapshot.version}")
+    return snapshot
+
+
+def notify_server() -> bool:
+    """Ask the pre-fork server, if serving from one, to reload every process.
+
+    Returns whether it was asked.
+    """
+    pid = os.environ.get(SERVER_PID_ENV)
+    if not pid:
+        return False
+    try:
+        os.kill(int(pid), RELOAD_SIGNAL)
+    except (ProcessLookupError, ValueError):
+        logger.warning(f"No pre-fork server to notify at {SERVER_PID_ENV}={pid}")
+        return False
+    return True
+
+
+class ReferenceWatcher:
+    """Reload the reference tables whenever their files change.
+
+    The store and the reference files are compared, by modification time and
+    size, to those the current tables were read from: when the watcher
+    starts, so that workers forked from a master holding older tables catch
+    up; on RELOAD_SIGNAL; and every interval seconds, if given. Invalid
+    tables are logged and left out, and the current ones are kept until the
+    files change again.
+    """
+
+    def __init__(
+        self, registry: ReferenceRegistry, interval: Optional[float] = None
+    ) -> None:
+        self.registry = registry
+        self.interval = interval
+        # Files whose tables failed to load, not retried until they change
+        self._failed_signature: Optional[tuple] = None
+        self._task: Optional[asyncio.Task] = None
+        self._signal_handled = False
+
+    async def check(self) -> bool:
+        """Reload the tables if their files changed; returns whether they were."""
+        signature = self.registry.source_signature()
+        if signature in (self.registry.snapshot.signature, self._failed_signature):
+            return False
+
+        try:
+            await reload_references(self.registry)
+        except (OSError, ValueError) as e:
+            logger.error(f"The reference tables were not reloaded: {e}")
+            self._failed_signature = signature
+            return False
+        return True
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Signal handlers can only be installed from the main thread
+        if threading.current_thread() is threading.main_thread():
+            loop.add_signal_handler(
+                RELOAD_SIGNAL, lambda: loop.create_task(self.check())
+            )
+            self._signal_handled = True
+        await self.check()
+        if self.interval:
+            self._task = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._signal_handled:
+            asyncio.get_running_loop().remove_signal_handler(RELOAD_SIGNAL)
+            self._signal_handled = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
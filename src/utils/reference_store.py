@@ -0,0 +1,195 @@
+"""Compiled store of every growth reference in data/, memory-mapped at load.
+
+References are TSV files with an Age column and one column per centile, laid
+out as data/{measure}_model/{reference}/{male,female}.tsv. The files directly
+in data/{measure}_model/ are the default reference of the measure.
+
+build_store compiles them into one binary file:
+
+- 8 bytes: MAGIC, ending with the format version.
+- 8 bytes: length of the index, a little-endian unsigned integer.
+- The index, in JSON: the centiles, the offset of the data, its SHA-256, and
+  per (measure, reference, sex) entry the number of rows and the offsets of
+  the age and centile arrays.
+- The data, aligned to ALIGNMENT bytes: per entry, the ages then the centiles
+  row by row, as little-endian float64.
+
+ReferenceStore maps the file read-only and returns the arrays as views of the
+mapping, so every process loading the store shares the same physical pages.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+from .csv_loader import load_csv
+
+MAGIC = b"GMREF\x00\x00\x01"
+ALIGNMENT = 64
+DEFAULT_REFERENCE = "default"
+SEX_FILES = {"M": "male.tsv", "F": "female.tsv"}
+MODEL_SUFFIX = "_model"
+
+_LENGTH = struct.Struct("<Q")
+_FLOAT64 = np.dtype("<f8")
+
+
+class ReferenceKey(NamedTuple):
+    measure: str
+    reference: str
+    sex: str
+
+
+def find_references(data_dir: str) -> dict[ReferenceKey, str]:
+    """Return the path of every reference file in data_dir, by key."""
+    files = {}
+    for model_dir in sorted(os.listdir(data_dir)):
+        if model_dir.endswith(MODEL_SUFFIX):
+            measure = model_dir.removesuffix(MODEL_SUFFIX)
+            for (reference, sex), path in reference_files(
+                os.path.join(data_dir, model_dir)
+            ).items():
+                files[ReferenceKey(measure, reference, sex)] = path
+    return files
+
+
+def reference_files(model_dir: str) -> dict[tuple[str, str], str]:
+    """Return the path of every reference file of one measure, by reference and sex."""
+    directories = [(DEFAULT_REFERENCE, model_dir)] + [
+        (name, os.path.join(model_dir, name))
+        for name in sorted(os.listdir(model_dir))
+        if os.path.isdir(os.path.join(model_dir, name))
+    ]
+    files = {}
+    for reference, directory in directories:
+        for sex, file_name in SEX_FILES.items():
+            path = os.path.join(directory, file_name)
+            if os.path.isfile(path):
+                files[(reference, sex)] = path
+    return files
+
+
+def read_reference(
+    file_path: str, centiles: tuple[str, ...]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return the ages and the centiles (one row per age) of a reference file."""
+    table = load_csv(file_path)
+    missing = [column for column in ("Age", *centiles) if column not in table]
+    if missing:
+        raise ValueError(f"{file_path} has no {', '.join(missing)} column.")
+
+    age = np.ascontiguousarray(table["Age"], dtype=_FLOAT64)
+    values = np.ascontiguousarray(
+        np.column_stack([table[column] for column in centiles]), dtype=_FLOAT64
+    )
+    return age, values
+
+
+def build_store(data_dir: str, path: str, centiles: tuple[str, ...]) -> str:
+    """Compile every reference in data_dir into a store at path.
+
+    The file is written next to path and then renamed over it, so processes
+    never map a partially written store. Returns the SHA-256 of the data.
+    """
+    arrays: list[tuple[int, np.ndarray]] = []
+    entries = []
+    offset = 0
+    for key, file_path in find_references(data_dir).items():
+        age, values = read_reference(file_path, centiles)
+        entry = {**key._asdict(), "rows": age.size}
+        for name, array in (("age", age), ("centiles", values)):
+            entry[f"{name}_offset"] = offset
+            arrays.append((offset, array))
+            offset = _aligned(offset + array.nbytes)
+        entries.append(entry)
+
+    if not entries:
+        raise ValueError(f"No reference files were found in {data_dir}.")
+
+    data = bytearray(offset)
+    for array_offset, array in arrays:
+        data[array_offset : array_offset + array.nbytes] = array.tobytes()
+    checksum = hashlib.sha256(data).hexdigest()
+
+    # The data offset depends on the index length, which includes it
+    index = {"centiles": list(centiles), "sha256": checksum, "entries": entries}
+    data_offset = 0
+    while True:
+        index["data_offset"] = data_offset
+        encoded = json.dumps(index, separators=(",", ":")).encode()
+        required = _aligned(len(MAGIC) + _LENGTH.size + len(encoded))
+        if required == data_offset:
+            break
+        data_offset = required
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC + _LENGTH.pack(len(encoded)) + encoded)
+        file.write(b"\x00" * (data_offset - file.tell()))
+        file.write(data)
+    os.replace(temporary_path, path)
+    return checksum
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class ReferenceStore:
+    """Read-only view of a store built by build_store.
+
+    The checksum of the data is verified when the store is opened. Arrays
+    are read-only views of the mapping, which stays open as long as any of
+    them is referenced.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a reference store of this version.")
+        (length,) = _LENGTH.unpack_from(self._buffer, len(MAGIC))
+        start = len(MAGIC) + _LENGTH.size
+        index = json.loads(self._buffer[start : start + length])
+
+        self.centiles = tuple(index["centiles"])
+        self.checksum = index["sha256"]
+        self._data_offset = index["data_offset"]
+        data = memoryview(self._buffer)[self._data_offset :]
+        try:
+            if hashlib.sha256(data).hexdigest() != self.checksum:
+                raise ValueError(f"{path} is corrupted: its checksum does not match.")
+        finally:
+            data.release()
+
+        self._entries = {
+            ReferenceKey(entry["measure"], entry["reference"], entry["sex"]): entry
+            for entry in index["entries"]
+        }
+
+    def keys(self) -> list[ReferenceKey]:
+        return list(self._entries)
+
+    def arrays(self, key: ReferenceKey) -> tuple[np.ndarray, np.ndarray]:
+        """Return the ages and the centiles (one row per age) of an entry."""
+        entry = self._entries[key]
+        rows = entry["rows"]
+        age = self._array(entry["age_offset"], rows)
+        centiles = self._array(entry["centiles_offset"], rows * len(self.centiles))
+        return age, centiles.reshape(rows, len(self.centiles))
+
+    def _array(self, offset: int, count: int) -> np.ndarray:
+        # Views of a read-only mapping are read-only themselves
+        return np.frombuffer(
+            self._buffer, dtype=_FLOAT64, count=count, offset=self._data_offset + offset
+        )
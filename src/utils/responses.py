@@ -0,0 +1,36 @@
+import hashlib
+from typing import Optional
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """Stream newline-delimited JSON while the request body is still being read.
+
+    StreamingResponse listens for client disconnects by reading from receive(),
+    which would swallow the request body messages that the body iterator is
+    consuming. This response only streams, and disconnects surface through the
+    request stream instead.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
+
+
+def make_etag(body: bytes) -> str:
+    """Return a strong ETag for a response body."""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """Return whether an If-None-Match header already matches etag."""
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
@@ -0,0 +1,71 @@
+import os
+from typing import Any, Optional
+
+import jinja2
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+
+from .responses import is_not_modified, make_etag
+
+# Fragments are served from stable URLs, so browsers revalidate them every time
+FRAGMENT_CACHE_CONTROL = "no-cache"
+
+
+def create_environment(
+    directory: str, bytecode_cache_dir: Optional[str] = None, auto_reload: bool = True
+) -> jinja2.Environment:
+    """Return a Jinja environment for the templates of directory.
+
+    With bytecode_cache_dir, compiled templates are also kept on disk, so that
+    restarted processes load them without parsing. Without auto_reload,
+    loaded templates are never checked for changes on disk.
+    """
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(directory),
+        autoescape=True,
+        auto_reload=auto_reload,
+        bytecode_cache=bytecode_cache,
+        # Keep every template compiled, however many there are
+        cache_size=-1,
+    )
+
+
+def compile_templates(env: jinja2.Environment) -> None:
+    """Load and compile every template of env, instead of on first use."""
+    for name in env.list_templates():
+        env.get_template(name)
+
+
+class Fragment:
+    """HTML rendered once from a template, served with a strong ETag.
+
+    For templates whose output does not depend on the request. Successful
+    responses are revalidated by browsers, and conditional requests get a 304
+    without a body.
+    """
+
+    def __init__(
+        self,
+        env: jinja2.Environment,
+        name: str,
+        context: Optional[dict[str, Any]] = None,
+        status_code: int = 200,
+    ) -> None:
+        self.name = name
+        self.body = env.get_template(name).render(context or {}).encode()
+        self.status_code = status_code
+        self.etag = make_etag(self.body)
+
+    def response(self, request: Request) -> Response:
+        if self.status_code != 200:
+            return HTMLResponse(self.body, status_code=self.status_code)
+
+        headers = {"ETag": self.etag, "Cache-Control": FRAGMENT_CACHE_CONTROL}
+        if is_not_modified(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(self.body, headers=headers)
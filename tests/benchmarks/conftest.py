@@ -0,0 +1,104 @@
+"""Timing fixture and report of the benchmarks.
+
+Every benchmark has a maximum time per call, in microseconds, in
+thresholds.json, and fails when it runs slower. Thresholds are calibrated for
+the CI runners at three times the slowest best time measured over repeated
+runs, rounded up. Thresholds can be scaled for slower machines with
+BENCHMARK_THRESHOLD_SCALE, e.g. 2 to double them.
+Results are written to reports/benchmarks/benchmarks.json, or to the path
+given with --benchmark-report.
+"""
+
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+import pytest
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), "thresholds.json")
+DEFAULT_REPORT_PATH = "reports/benchmarks/benchmarks.json"
+REPEATS = 5
+
+_results: list[dict[str, Any]] = []
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-report",
+        default=DEFAULT_REPORT_PATH,
+        help=f"Where to write the benchmark results (default: {DEFAULT_REPORT_PATH}).",
+    )
+
+
+def pytest_sessionfinish(session):
+    if not _results:
+        return
+
+    report_path = session.config.getoption("--benchmark-report")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w") as file:
+        json.dump(
+            {
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "machine": platform.platform(),
+                "threshold_scale": _threshold_scale(),
+                "benchmarks": _results,
+            },
+            file,
+            indent=2,
+        )
+
+
+def _threshold_scale() -> float:
+    return float(os.environ.get("BENCHMARK_THRESHOLD_SCALE", 1))
+
+
+@pytest.fixture(scope="session")
+def thresholds() -> dict[str, float]:
+    with open(THRESHOLDS_PATH) as file:
+        return json.load(file)
+
+
+@pytest.fixture
+def benchmark(thresholds) -> Callable[[str, Callable[[], Any]], float]:
+    """Return a function timing a callable, recording and checking the result.
+
+    The callable is run in loops of at least 0.2 seconds; the fastest of
+    REPEATS loops gives the time per call, which is the least disturbed by
+    other processes.
+    """
+
+    def run(name: str, func: Callable[[], Any]) -> float:
+        assert name in thresholds, f"{name} has no threshold in thresholds.json"
+        threshold_us = thresholds[name] * _threshold_scale()
+
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        loops_us = [seconds / number * 1e6 for seconds in timer.repeat(REPEATS, number)]
+        best_us = min(loops_us)
+        passed = best_us <= threshold_us
+
+        _results.append(
+            {
+                "name": name,
+                "best_us": round(best_us, 3),
+                "median_us": round(statistics.median(loops_us), 3),
+                "calls": number * REPEATS,
+                "threshold_us": threshold_us,
+                "passed": passed,
+            }
+        )
+        print(f"\n{name}: {best_us:.2f} us per call (threshold {threshold_us:g} us)")
+        assert passed, (
+            f"{name} regressed: {best_us:.2f} us per call, "
+            f"threshold {threshold_us:g} us"
+        )
+        return best_us
+
+    return run
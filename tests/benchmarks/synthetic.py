@@ -0,0 +1,51 @@
+"""Deterministic synthetic cohorts for the benchmarks."""
+
+import random
+from datetime import date, timedelta
+from typing import Any
+
+import numpy as np
+
+from src.utils.reference_registry import CENTILES, reference_registry
+
+# Age units of PatientInput and their number per year
+AGE_UNITS = {"years": 1.0, "months": 12.0, "weeks": 52.1775, "days": 365.25}
+MAX_AGE_YEARS = 21.0
+REFERENCE_DATE = date(2024, 1, 1)
+
+
+def synthetic_cohort(
+    size: int, seed: int = 0, reference_date: date = REFERENCE_DATE
+) -> list[dict[str, Any]]:
+    """Return size PatientInput records spread over ages 0-21 and both sexes.
+
+    Ages are uniform over 0-21 years and given in every age unit, including
+    dates of birth before reference_date. Head circumferences are drawn
+    around the reference median at that age, so that percentiles span the
+    whole range. The same seed always gives the same records.
+    """
+    rng = random.Random(seed)
+    records = []
+    for index in range(size):
+        sex = "M" if index % 2 == 0 else "F"
+        age_years = rng.uniform(0, MAX_AGE_YEARS)
+        table = reference_registry.get(sex)
+        median = np.interp(
+            age_years, table.age, table.centiles[:, CENTILES.index("50")]
+        )
+        hcirc_cm = round(rng.gauss(float(median), 1.5), 1)
+
+        age_unit = rng.choice([*AGE_UNITS, "dob"])
+        if age_unit == "dob":
+            days = int(age_years * 365.25)
+            age_value: Any = (reference_date - timedelta(days=days)).isoformat()
+        else:
+            age_value = round(age_years * AGE_UNITS[age_unit], 2)
+
+        record = {"age_unit": age_unit, "age_value": age_value, "sex": sex}
+        if rng.random() < 0.2:
+            record.update(hcirc_value=round(hcirc_cm / 2.54, 2), hcirc_unit="inch")
+        else:
+            record.update(hcirc_value=hcirc_cm, hcirc_unit="cm")
+        records.append(record)
+    return records
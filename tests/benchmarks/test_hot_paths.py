@@ -0,0 +1,199 @@
+"""Time per call of the hot paths, checked against thresholds.json.
+
+Run with: RUN_BENCHMARKS=1 pytest -s tests/benchmarks
+"""
+
+import itertools
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from src.main import app
+from src.models import Patient, Sex
+from src.routes import templates
+from src.schemas import AgeUnitEnum, PatientInput
+from src.services import is_valid_age
+from src.types.message import Message
+from src.utils.hcirc_utils import norm_cdf, norm_from_percentiles
+from src.utils.rate_limiter import limiter
+
+from .synthetic import REFERENCE_DATE, synthetic_cohort
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS=1 to run"
+)
+
+COHORT_SIZE = 1000
+
+# Context of each partial rendered for HTMX requests
+PARTIALS = {
+    "input_age": (
+        "forms/form_hcirc/input_age.html",
+        {"age_value": 6.0, "age_unit": AgeUnitEnum.months, "message": None},
+    ),
+    "input_dob": (
+        "forms/form_hcirc/input_dob.html",
+        {
+            "age_value": date(2023, 6, 1),
+            "age_unit": AgeUnitEnum.dob,
+            "message": Message(category="info", text="Ages over 21 years..."),
+        },
+    ),
+    "card_result": (
+        "sections/hcirc/cards/card_result.html",
+        {"hcirc_percentile": 42.17, "message": None},
+    ),
+    "card_result_error": (
+        "sections/hcirc/cards/card_result.html",
+        {
+            "hcirc_percentile": None,
+            "message": Message(category="error", text="Please check your input."),
+        },
+    ),
+    "hcirc_percentile": ("partials/hcirc_percentile.html", {"hcirc_percentile": 0.5}),
+    "message": (
+        "partials/message.html",
+        {"message": Message(category="info", text="Information")},
+    ),
+}
+
+
+@pytest.fixture(scope="module")
+def cohort():
+    return synthetic_cohort(COHORT_SIZE)
+
+
+@pytest.fixture(scope="module")
+def inputs(cohort):
+    return [PatientInput.model_validate(record) for record in cohort]
+
+
+@pytest.fixture(scope="module")
+def normalized(inputs):
+    return [patient_input.to_normalized(REFERENCE_DATE) for patient_input in inputs]
+
+
+@pytest.fixture
+def client():
+    # Benchmarks send far more requests than any quota allows
+    limiter.enabled = False
+    yield TestClient(app)
+    limiter.enabled = True
+
+
+############# MODELS ###############
+
+
+def test_patient_percentile(benchmark, normalized):
+    patients = itertools.cycle(
+        [
+            Patient(data.age_years, data.sex, {"value_cm": data.hcirc_cm})
+            for data in normalized
+        ]
+    )
+    benchmark("patient_percentile", lambda: next(patients).calculate_hcirc_percentile())
+
+
+def test_norm_from_percentiles(benchmark):
+    benchmark(
+        "norm_from_percentiles", lambda: norm_from_percentiles(40.1, 0.25, 42.3, 0.75)
+    )
+
+    rng = np.random.default_rng(0)
+    p25 = rng.uniform(30, 55, COHORT_SIZE)
+    p75 = p25 + rng.uniform(1, 3, COHORT_SIZE)
+    benchmark(
+        "norm_from_percentiles_1000",
+        lambda: norm_from_percentiles(p25, 0.25, p75, 0.75),
+    )
+
+
+def test_norm_cdf(benchmark):
+    x = np.random.default_rng(0).normal(45.0, 2.0, COHORT_SIZE * 10)
+    benchmark("norm_cdf_10000", lambda: norm_cdf(x, 45.0, 1.7))
+
+
+############# SCHEMAS ###############
+
+
+def test_patient_input_validation(benchmark, cohort):
+    records = itertools.cycle(cohort)
+    benchmark(
+        "patient_input_validation",
+        lambda: PatientInput.model_validate(next(records)),
+    )
+
+
+def test_to_normalized(benchmark, inputs):
+    patient_inputs = itertools.cycle(inputs)
+    benchmark(
+        "to_normalized", lambda: next(patient_inputs).to_normalized(REFERENCE_DATE)
+    )
+
+
+def test_to_record(benchmark, inputs):
+    patient_inputs = itertools.cycle(inputs)
+    benchmark("to_record", lambda: next(patient_inputs).to_record(REFERENCE_DATE))
+
+
+############# SERVICES ###############
+
+
+def test_is_valid_age(benchmark, inputs):
+    ages = itertools.cycle(
+        [
+            (patient_input.age_value, patient_input.age_unit.value)
+            for patient_input in inputs
+        ]
+    )
+    benchmark("is_valid_age", lambda: is_valid_age(*next(ages)))
+
+
+############# TEMPLATES ###############
+
+
+@pytest.mark.parametrize("partial", PARTIALS)
+def test_render_partial(benchmark, partial):
+    name, context = PARTIALS[partial]
+    template = templates.env.get_template(name)
+    benchmark(f"render_{partial}", lambda: template.render(context))
+
+
+############# END TO END ###############
+
+
+def test_api_percentile(benchmark, client, cohort):
+    records = itertools.cycle(cohort)
+    benchmark(
+        "api_percentile",
+        lambda: client.post("/api/v1/head-circumference", json=next(records)),
+    )
+
+
+def test_form_percentile(benchmark, client, cohort):
+    records = itertools.cycle(cohort)
+    benchmark(
+        "form_percentile",
+        lambda: client.post("/head-circumference", data=next(records)),
+    )
+
+
+def test_form_partials(benchmark, client):
+    benchmark("show_age", lambda: client.get("/show-age"))
+    benchmark(
+        "validate_age",
+        lambda: client.post(
+            "/validate-age", data={"age_value": "6", "age_unit": "months"}
+        ),
+    )
+
+
+def test_api_batch(benchmark, client, cohort):
+    body = {"records": cohort, "reference_date": REFERENCE_DATE.isoformat()}
+    benchmark(
+        "api_batch_1000",
+        lambda: client.post("/api/v1/head-circumference/batch", json=body),
+    )
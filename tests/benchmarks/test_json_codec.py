@@ -0,0 +1,103 @@
+"""Time per request of the JSON API codec, against FastAPI's body parameters.
+
+Run with: RUN_BENCHMARKS=1 pytest -s tests/benchmarks
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from src.schemas import BatchPatientInput, PatientInput
+from src.utils.json_codec import FastJSONResponse, parse_json_body
+
+from .synthetic import synthetic_cohort
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS=1 to run"
+)
+
+# A result per record, so that only decoding, validation and encoding differ
+RESULT = {"hcirc_percentile": 42.17}
+
+
+def _codec_app() -> FastAPI:
+    app = FastAPI()
+
+    # How the API routes read and wrote JSON before
+    @app.post("/previous")
+    async def previous(patient_input: PatientInput):
+        return JSONResponse(content=RESULT)
+
+    @app.post("/previous/batch")
+    async def previous_batch(batch_input: BatchPatientInput):
+        return JSONResponse(content={"results": [RESULT] * len(batch_input.records)})
+
+    @app.post("/current")
+    async def current(request: Request):
+        await parse_json_body(request, PatientInput)
+        return FastJSONResponse(content=RESULT)
+
+    @app.post("/current/batch")
+    async def current_batch(request: Request):
+        batch_input = await parse_json_body(request, BatchPatientInput)
+        return FastJSONResponse(
+            content={"results": [RESULT] * len(batch_input.records)}
+        )
+
+    return app
+
+
+def _post(app: FastAPI, path: str, body: bytes):
+    """Return a function sending one request to app, without a server."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    loop = asyncio.new_event_loop()
+
+    def post():
+        loop.run_until_complete(app(dict(scope), receive, send))
+        assert statuses.pop() == 200
+
+    return post
+
+
+@pytest.mark.parametrize("path", ["previous", "current"])
+def test_single_record_codec(benchmark, path):
+    body = json.dumps(synthetic_cohort(1)[0]).encode()
+    benchmark(f"json_codec_{path}", _post(_codec_app(), f"/{path}", body))
+
+
+@pytest.mark.parametrize("path", ["previous", "current"])
+def test_batch_codec(benchmark, path):
+    body = json.dumps({"records": synthetic_cohort(1000)}).encode()
+    benchmark(
+        f"json_codec_{path}_batch_1000", _post(_codec_app(), f"/{path}/batch", body)
+    )
@@ -0,0 +1,110 @@
+"""Per-request latency of the middleware stack, before and after SecurityMiddleware.
+
+Run with: RUN_BENCHMARKS=1 pytest -s tests/benchmarks
+"""
+
+import asyncio
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from src.config import settings
+from src.main import SecurityMiddleware
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS=1 to run"
+)
+
+
+def _json_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"hcirc_percentile": 50.0}
+
+    return app
+
+
+def _previous_stack() -> FastAPI:
+    """The stack main.py used before: two @app.middleware layers and a BaseHTTPMiddleware."""
+    app = _json_app()
+
+    @app.middleware("http")
+    async def log_exceptions(request: Request, call_next):
+        try:
+            return await call_next(request)
+        except Exception:
+            return JSONResponse(
+                status_code=500, content={"message": "Internal Server Error"}
+            )
+
+    @app.middleware("http")
+    async def add_security_headers(request: Request, call_next):
+        response = await call_next(request)
+        response.headers["Strict-Transport-Security"] = (
+            "max-age=63072000; includeSubDomains; preload"
+        )
+        return response
+
+    class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request, call_next):
+            response = await call_next(request)
+            response.headers["Content-Security-Policy"] = settings.csp_policy
+            response.headers["X-Content-Type-Options"] = "nosniff"
+            response.headers["X-Frame-Options"] = "DENY"
+            response.headers["Strict-Transport-Security"] = (
+                "max-age=63072000; includeSubDomains; preload"
+            )
+            response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+            return response
+
+    app.add_middleware(SecurityHeadersMiddleware)
+    return app
+
+
+def _current_stack() -> FastAPI:
+    app = _json_app()
+    app.add_middleware(SecurityMiddleware)
+    return app
+
+
+def _get(app):
+    """Return a function sending one request to app, without a server."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/ping",
+        "raw_path": b"/ping",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    loop = asyncio.new_event_loop()
+
+    def get():
+        loop.run_until_complete(app(dict(scope), receive, send))
+
+    return get
+
+
+def test_middleware_latency(benchmark):
+    benchmark("middleware_none", _get(_json_app()))
+    previous = benchmark("middleware_previous", _get(_previous_stack()))
+    current = benchmark("middleware_current", _get(_current_stack()))
+    assert current < previous
@@ -0,0 +1,40 @@
+"""Per-request overhead of the rate limiter storages.
+
+Run with: RUN_BENCHMARKS=1 pytest -s tests/benchmarks
+"""
+
+import itertools
+import os
+
+import pytest
+from limits import RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+
+import src.utils.rate_limit_storage  # noqa: F401
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS=1 to run"
+)
+
+STORAGES = {"memory": "memory://", "mmap": "mmap://{path}"}
+TIMED_STRATEGIES = ["fixed-window", "sliding-window-counter"]
+
+
+def _hit(uri: str, strategy: str):
+    """Return a function charging one hit, for one of 1000 clients in turn."""
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    limit = RateLimitItemPerMinute(10**9)
+    clients = itertools.cycle([f"client-{index}" for index in range(1000)])
+
+    def hit():
+        limiter.hit(limit, next(clients))
+
+    return hit
+
+
+@pytest.mark.parametrize("storage", list(STORAGES))
+@pytest.mark.parametrize("strategy", TIMED_STRATEGIES)
+def test_rate_limiter_overhead(benchmark, tmp_path, storage, strategy):
+    uri = STORAGES[storage].format(path=tmp_path / "ratelimit")
+    benchmark(f"rate_limiter_{storage}_{strategy}", _hit(uri, strategy))
@@ -0,0 +1,27 @@
+from src.schemas import PatientInput
+
+from .synthetic import MAX_AGE_YEARS, REFERENCE_DATE, synthetic_cohort
+
+
+def test_synthetic_cohort_is_deterministic():
+    assert synthetic_cohort(50, seed=1) == synthetic_cohort(50, seed=1)
+    assert synthetic_cohort(50, seed=1) != synthetic_cohort(50, seed=2)
+
+
+def test_synthetic_cohort_covers_ages_sexes_and_units():
+    cohort = synthetic_cohort(500)
+    normalized = [
+        PatientInput.model_validate(record).to_normalized(REFERENCE_DATE)
+        for record in cohort
+    ]
+
+    assert {data.sex.value for data in normalized} == {"M", "F"}
+    assert {record["age_unit"] for record in cohort} == {
+        "years",
+        "months",
+        "weeks",
+        "days",
+        "dob",
+    }
+    ages = [data.age_years for data in normalized]
+    assert 0 <= min(ages) < 1 and MAX_AGE_YEARS - 1 < max(ages) <= MAX_AGE_YEARS
@@ -0,0 +1,87 @@
+import csv
+
+import pytest
+
+from src.cli import main, score_file
+from src.utils.reference_store import ReferenceStore
+
+COHORT = (
+    "id\tage_unit\tage_value\tsex\thcirc_value\thcirc_unit\n"
+    + "".join(
+        f"{i}\tyears\t{i % 20}\t{'MF'[i % 2]}\t{40 + i % 15}\tcm\n" for i in range(50)
+    )
+    + "50\tyears\tinvalid\tM\t48\tcm\n"
+)
+
+
+@pytest.fixture
+def cohort_file(tmp_path):
+    path = tmp_path / "cohort.tsv"
+    path.write_text(COHORT)
+    return str(path)
+
+
+def _read(path):
+    with open(path, newline="") as file:
+        return list(csv.DictReader(file, delimiter="\t"))
+
+
+def test_score_file_with_workers_matches_single_process(cohort_file, tmp_path):
+    single = str(tmp_path / "single.tsv")
+    parallel = str(tmp_path / "parallel.tsv")
+
+    summary = score_file(cohort_file, single, workers=1, chunk_size=7)
+    score_file(cohort_file, parallel, workers=2, chunk_size=7)
+
+    assert summary["rows"] == 51
+    assert summary["errors"] == 1
+    assert _read(single) == _read(parallel)
+    assert [row["id"] for row in _read(parallel)] == [str(i) for i in range(51)]
+
+
+def test_cli_score_prints_throughput_summary(cohort_file, tmp_path, capsys):
+    output = str(tmp_path / "scored.csv")
+    exit_code = main(
+        [
+            "score",
+            cohort_file,
+            "-o",
+            output,
+            "--workers",
+            "1",
+            "--reference-date",
+            "2024-01-01",
+        ]
+    )
+
+    assert exit_code == 0
+    assert "Scored 51 rows (1 with errors)" in capsys.readouterr().err
+    with open(output, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert rows[0]["hcirc_percentile"] != ""
+
+
+def test_cli_build_references(tmp_path, capsys):
+    output = str(tmp_path / "references.bin")
+
+    assert main(["build-references", "-o", output]) == 0
+    assert ReferenceStore(output).keys()
+    assert "Compiled 2 reference tables" in capsys.readouterr().err
+
+
+def test_cli_build_assets(tmp_path, capsys):
+    output = tmp_path / "assets"
+
+    assert main(["build-assets", "static", "-o", str(output)]) == 0
+    assert {path.suffix for path in output.iterdir()} >= {".gzip"}
+    assert "compressed assets" in capsys.readouterr().err
+
+
+def test_cli_score_reports_missing_columns(tmp_path, capsys):
+    path = tmp_path / "cohort.csv"
+    path.write_text("a,b\n1,2\n")
+
+    exit_code = main(["score", str(path), "-o", str(tmp_path / "out.csv")])
+
+    assert exit_code == 1
+    assert "Missing required columns" in capsys.readouterr().err
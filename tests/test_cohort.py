@@ -0,0 +1,72 @@
+import csv
+
+import pytest
+
+from src.cohort import (
+    CohortWriter,
+    count_rows,
+    detect_delimiter,
+    read_chunks,
+    read_header,
+    score_rows,
+)
+
+HEADER = ["patient_id", "age_unit", "age_value", "sex", "hcirc_value", "hcirc_unit"]
+
+
+@pytest.fixture
+def cohort_file(tmp_path):
+    path = tmp_path / "cohort.tsv"
+    rows = [
+        ["p1", "years", "2", "M", "48", "cm"],
+        ["p2", "months", "6", "F", "42", "cm"],
+        ["p3", "dob", "2020-01-01", "F", "19", "inch"],
+        ["p4", "years", "two", "M", "48", "cm"],
+        ["p5", "days", "0", "M", "35", "cm"],
+    ]
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file, delimiter="\t")
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_detect_delimiter():
+    assert detect_delimiter("cohort.TSV") == "\t"
+    assert detect_delimiter("cohort.csv") == ","
+
+
+def test_read_header_requires_input_columns(tmp_path):
+    path = tmp_path / "cohort.csv"
+    path.write_text("age_unit,age_value,sex\nyears,2,M\n")
+    with pytest.raises(ValueError, match="hcirc_value, hcirc_unit"):
+        read_header(str(path))
+
+
+def test_read_chunks_and_count_rows(cohort_file):
+    assert read_header(cohort_file) == HEADER
+    assert count_rows(cohort_file) == 5
+    assert [len(chunk) for chunk in read_chunks(cohort_file, 2)] == [2, 2, 1]
+
+
+def test_score_rows_adds_percentile_or_errors(cohort_file):
+    rows = score_rows(next(read_chunks(cohort_file, 10)))
+
+    assert 1 <= float(rows[0]["hcirc_percentile"]) <= 99
+    assert rows[0]["errors"] == ""
+    assert rows[2]["hcirc_percentile"] != ""
+    assert rows[3]["hcirc_percentile"] == ""
+    assert rows[3]["errors"].startswith("age_value")
+    assert rows[4]["patient_id"] == "p5"
+
+
+def test_cohort_writer_keeps_input_columns(cohort_file, tmp_path):
+    output = str(tmp_path / "scored.tsv")
+    with CohortWriter(output, read_header(cohort_file)) as writer:
+        for chunk in read_chunks(cohort_file, 2):
+            writer.write(score_rows(chunk))
+
+    with open(output, newline="") as file:
+        rows = list(csv.DictReader(file, delimiter="\t"))
+    assert list(rows[0]) == HEADER + ["hcirc_percentile", "errors"]
+    assert [row["patient_id"] for row in rows] == ["p1", "p2", "p3", "p4", "p5"]
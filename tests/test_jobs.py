@@ -0,0 +1,317 @@
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.config import settings
+from src.jobs import (
+    INTERRUPTED_ERROR,
+    QUOTA_ERROR,
+    CohortJobManager,
+    JobStatus,
+    UploadTooLarge,
+    save_upload,
+)
+from src.main import app
+from src.utils.rate_limiter import COMPUTE_COST, limiter
+
+COHORT = (
+    "age_unit,age_value,sex,hcirc_value,hcirc_unit\n"
+    "years,2,M,48,cm\n"
+    "months,6,F,42,cm\n"
+    "years,invalid,M,48,cm\n"
+)
+
+
+@pytest.fixture
+def job_manager(tmp_path, monkeypatch):
+    manager = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    monkeypatch.setattr("src.routes.job_manager", manager)
+    yield manager
+    manager.shutdown()
+
+
+@pytest.fixture
+def client(job_manager):
+    # Keep the event loop running between requests for the background jobs
+    with TestClient(app) as client:
+        yield client
+
+
+def _wait_for_job(client, job_id, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+
+def test_cohort_job_scores_uploaded_file(client):
+    response = client.post(
+        "/api/v1/jobs",
+        files={"file": ("cohort.csv", COHORT, "text/csv")},
+        data={"reference_date": "2024-01-01"},
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    job = _wait_for_job(client, job_id)
+    assert job["status"] == "done"
+    assert job["rows_total"] == job["rows_processed"] == 3
+    assert job["progress"] == 1.0
+
+    result = client.get(f"/api/v1/jobs/{job_id}/result")
+    assert result.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(result.text)))
+    assert 1 <= float(rows[0]["hcirc_percentile"]) <= 99
+    assert rows[2]["hcirc_percentile"] == ""
+    assert rows[2]["errors"] != ""
+
+
+def test_cohort_job_stops_when_its_rows_exceed_the_quota(
+    client, job_manager, monkeypatch
+):
+    limiter.reset()
+    # Enough for the upload and the first chunk of two rows, not the second
+    monkeypatch.setitem(
+        settings.rate_limit_tiers, "anonymous", f"{COMPUTE_COST + 2}/minute"
+    )
+    response = client.post(
+        "/api/v1/jobs", files={"file": ("cohort.csv", COHORT, "text/csv")}
+    )
+    assert response.status_code == 202
+
+    job = job_manager.jobs[response.json()["job_id"]]
+    deadline = time.monotonic() + 60
+    while job.unfinished and time.monotonic() < deadline:
+        time.sleep(0.1)
+    limiter.reset()
+
+    assert job.status == JobStatus.failed
+    assert job.error == QUOTA_ERROR
+    assert job.rows_processed == 2
+
+
+def test_cohort_job_rejects_file_without_columns(client, job_manager):
+    response = client.post(
+        "/api/v1/jobs", files={"file": ("cohort.csv", "a,b\n1,2\n", "text/csv")}
+    )
+    assert response.status_code == 422
+    assert "Missing required columns" in response.json()["detail"]
+    assert job_manager.jobs == {}
+
+
+def test_cohort_job_rejects_large_upload(client, job_manager, monkeypatch):
+    monkeypatch.setattr("src.routes.settings.jobs_max_upload_bytes", 10)
+    response = client.post(
+        "/api/v1/jobs", files={"file": ("cohort.csv", COHORT, "text/csv")}
+    )
+    assert response.status_code == 413
+    assert job_manager.jobs == {}
+
+
+def _fail_form_parsing(monkeypatch):
+    async def form(self, **kwargs):
+        raise AssertionError("the form must not be parsed")
+
+    monkeypatch.setattr("starlette.requests.Request.form", form)
+
+
+def test_cohort_job_rejects_declared_large_upload_before_parsing(
+    client, job_manager, monkeypatch
+):
+    monkeypatch.setattr("src.routes.settings.jobs_max_upload_bytes", 10)
+    monkeypatch.setattr("src.routes.FORM_OVERHEAD_BYTES", 0)
+    _fail_form_parsing(monkeypatch)
+    response = client.post(
+        "/api/v1/jobs", files={"file": ("cohort.csv", COHORT, "text/csv")}
+    )
+    assert response.status_code == 413
+    assert job_manager.jobs == {}
+
+
+def test_cohort_job_is_charged_before_parsing(client, job_manager, monkeypatch):
+    limiter.reset()
+    monkeypatch.setitem(
+        settings.rate_limit_tiers, "anonymous", f"{COMPUTE_COST - 1}/minute"
+    )
+    _fail_form_parsing(monkeypatch)
+    response = client.post(
+        "/api/v1/jobs", files={"file": ("cohort.csv", COHORT, "text/csv")}
+    )
+    limiter.reset()
+    assert response.status_code == 429
+    assert job_manager.jobs == {}
+
+
+def test_cohort_job_validates_its_form(client, job_manager):
+    response = client.post(
+        "/api/v1/jobs",
+        files={"other": ("cohort.csv", COHORT, "text/csv")},
+        data={"model": "unknown"},
+    )
+    assert response.status_code == 422
+    locations = [error["loc"] for error in response.json()["detail"]]
+    assert locations == [["body", "file"], ["body", "model"]]
+    assert job_manager.jobs == {}
+
+
+def test_cohort_job_requires_content_length(client, job_manager):
+    boundary = "cohort-boundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="cohort.csv"\r\n'
+        "Content-Type: text/csv\r\n\r\n"
+        f"{COHORT}\r\n--{boundary}--\r\n"
+    ).encode()
+
+    # A generator body is sent chunked, without a Content-Length
+    response = client.post(
+        "/api/v1/jobs",
+        content=iter([body]),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    assert response.status_code == 411
+    assert job_manager.jobs == {}
+
+
+def test_cohort_job_unknown_id(client):
+    assert client.get("/api/v1/jobs/unknown").status_code == 404
+    assert client.get("/api/v1/jobs/unknown/result").status_code == 404
+
+
+def test_cohort_job_result_not_ready(client, job_manager):
+    job = job_manager.new_job("cohort.csv")
+    response = client.get(f"/api/v1/jobs/{job.job_id}/result")
+    assert response.status_code == 409
+
+
+def test_prune_removes_expired_jobs(job_manager):
+    job = job_manager.new_job("cohort.csv")
+    job.finished_at = time.time() - 120
+    job_manager.prune()
+    assert job_manager.get(job.job_id) is None
+
+
+def _age_files(directory, seconds):
+    old = time.time() - seconds
+    for path in directory.iterdir():
+        os.utime(path, (old, old))
+
+
+def test_prune_removes_expired_jobs_of_other_and_restarted_workers(tmp_path):
+    worker = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    finished = worker.new_job("cohort.csv")
+    finished.status = JobStatus.done
+    finished.finished_at = time.time()
+    worker._save(finished)
+    (tmp_path / os.path.basename(finished.output_path)).write_text(COHORT)
+    running = worker.new_job("cohort.csv")
+    # Left by a worker that died before saving the state of its job
+    orphan = tmp_path / f"{'0' * 32}.input.csv"
+    orphan.write_text(COHORT)
+    _age_files(tmp_path, 120)
+
+    # A fresh worker, as after a restart, knows none of these jobs
+    restarted = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    restarted.prune()
+    assert restarted.get(finished.job_id) is None
+    assert not os.path.exists(finished.output_path)
+    assert not orphan.exists()
+    # Jobs still running in a live worker are kept
+    assert restarted.get(running.job_id).status == JobStatus.queued
+
+
+def test_prune_keeps_recent_files(tmp_path):
+    worker = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    orphan = tmp_path / f"{'0' * 32}.output.csv"
+    orphan.write_text(COHORT)
+
+    worker.prune()
+    assert orphan.exists()
+
+
+def test_jobs_are_visible_to_other_workers(tmp_path):
+    worker = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    other = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    job = worker.new_job("cohort.csv")
+
+    snapshot = other.get(job.job_id)
+    assert snapshot.to_dict() == job.to_dict()
+    assert snapshot.output_path == job.output_path
+
+    worker.remove(job.job_id)
+    assert other.get(job.job_id) is None
+    assert other.get("../../etc/passwd") is None
+
+
+def test_shutdown_marks_unfinished_jobs_as_failed(tmp_path):
+    worker = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    other = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    job = worker.new_job("cohort.csv")
+
+    worker.shutdown()
+    snapshot = other.get(job.job_id)
+    assert snapshot.status == JobStatus.failed
+    assert snapshot.error == INTERRUPTED_ERROR
+
+
+def test_jobs_of_dead_workers_are_reported_as_failed(tmp_path):
+    worker = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    other = CohortJobManager(
+        jobs_dir=str(tmp_path), max_workers=1, chunk_size=2, retention_seconds=60
+    )
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    job = worker.new_job("cohort.csv")
+    job.status = JobStatus.running
+    job.pid = process.pid
+    worker._save(job)
+
+    assert other.get(job.job_id).status == JobStatus.failed
+    # The failure is saved for every other worker
+    with open(os.path.join(tmp_path, f"{job.job_id}.json")) as file:
+        assert json.load(file)["error"] == INTERRUPTED_ERROR
+
+
+def test_save_upload_limits_size(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        save_upload(io.BytesIO(b"x" * 100), str(tmp_path / "upload"), 10)
+
+
+def test_cohort_job_upload_errors_are_not_too_large(client, job_manager, monkeypatch):
+    def failing_save_upload(*args):
+        raise ValueError("embedded null byte")
+
+    monkeypatch.setattr("src.routes.save_upload", failing_save_upload)
+    response = client.post(
+        "/api/v1/jobs", files={"file": ("cohort.csv", COHORT, "text/csv")}
+    )
+    assert response.status_code == 500
+    assert not job_manager.jobs
@@ -1,9 +1,29 @@
+import subprocess
+import sys
 from unittest.mock import Mock  # Correct import for Mock
 
 import pytest
+from fastapi import Response
 from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
 
-from src.main import app  # Assuming your app is initialized in main.py
+from src.config import settings
+from src.main import (  # Assuming your app is initialized in main.py
+    SecurityMiddleware,
+    app,
+)
+from src.utils.assets import asset_manifest
+from src.utils.reference_registry import reference_registry
+
+# Time allowed to import each module in a fresh interpreter: about 1.5 times
+# the measured times (1.35 s, 0.30 s and 0.095 s)
+IMPORT_BUDGET_SECONDS = {
+    "src.main": 2.0,
+    "src.models": 0.45,
+    "src.utils.hcirc_utils": 0.15,
+}
 
 
 # Define a route that will raise an unhandled exception to test the middleware
@@ -40,3 +60,75 @@ def test_middleware_logs_exception(client, monkeypatch):
     args, kwargs = mock_logger.error.call_args
     assert "Exception occurred" in args[0]
     assert "exc_info" in kwargs
+
+
+@app.get("/framed")
+async def framed_route():
+    return Response(headers={"X-Frame-Options": "SAMEORIGIN"})
+
+
+def test_middleware_adds_security_headers_once(client):
+    response = client.get("/framed")
+    assert response.headers.get_list("x-frame-options") == ["DENY"]
+    assert response.headers.get_list("strict-transport-security") == [
+        "max-age=63072000; includeSubDomains; preload"
+    ]
+    assert response.headers["content-security-policy"] == settings.csp_policy
+
+
+def test_middleware_adds_security_headers_to_errors(client, monkeypatch):
+    monkeypatch.setattr("src.main.logger", Mock())
+    response = client.get("/error")
+    assert response.status_code == 500
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+
+def test_middleware_logs_requests_outside_development(monkeypatch):
+    mock_logger = Mock()
+    monkeypatch.setattr("src.main.logger", mock_logger)
+    monkeypatch.setattr(settings, "environment", "production")
+
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    client = TestClient(
+        SecurityMiddleware(Starlette(routes=[Route("/ok", ok)])),
+        base_url="https://testserver",
+    )
+    assert client.get("/ok?x=1").text == "ok"
+    mock_logger.info.assert_called_once_with(
+        "New request: GET https://testserver/ok?x=1"
+    )
+
+
+def test_reference_reload_refreshes_assets(monkeypatch, tmp_path):
+    # The reference files are served as assets too
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "reference.tsv").write_text("Age\t3\n")
+    monkeypatch.setattr(asset_manifest, "directories", (str(tmp_path / "data"),))
+    try:
+        reference_registry.load()
+        assert asset_manifest.url("data/reference.tsv").startswith(
+            "/assets/data/reference."
+        )
+    finally:
+        monkeypatch.undo()
+        asset_manifest.load()
+
+
+@pytest.mark.parametrize("module", list(IMPORT_BUDGET_SECONDS))
+def test_startup_imports_stay_within_budget(module):
+    """Importing the app must not load pandas or scipy, and must stay fast."""
+    code = (
+        "import importlib, sys, time\n"
+        "started = time.perf_counter()\n"
+        f"importlib.import_module({module!r})\n"
+        "print(time.perf_counter() - started)\n"
+        "print(' '.join(m for m in ('pandas', 'scipy') if m in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    seconds, heavy_modules = (result.stdout.splitlines() + [""])[:2]
+    assert heavy_modules == ""
+    assert float(seconds) < IMPORT_BUDGET_SECONDS[module]
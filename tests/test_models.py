@@ -2,8 +2,17 @@ from unittest.mock import patch
 
 import numpy as np
 import pytest
-
-from src.models import Patient, Sex
+from scipy import stats  # type: ignore
+
+from src.models import (
+    Patient,
+    PatientRecord,
+    ReferenceModel,
+    Sex,
+    hcirc_percentile,
+    hcirc_percentiles,
+)
+from src.utils.reference_registry import CENTILES, ReferenceRegistry, reference_registry
 
 ############# PATIENT ###############
 
@@ -131,3 +140,93 @@ def test_female_percentile_larger_than_male(patch_dependencies):
         f"head circumference {hcirc_value}cm and age {age}, but got {female_percentile}% "
         f"for female and {male_percentile}% for male."
     )
+
+
+def test_vectorized_percentiles_match_single_patient():
+    """Test that the vectorized path returns the same percentiles as Patient."""
+    ages = np.array([0.0, 0.5, 2.0, 10.3, 25.0])
+    sexes = np.array(["M", "F", "M", "F", "M"])
+    hcirc_values = np.array([35.0, 44.0, 48.0, 52.5, 57.0])
+
+    percentiles = hcirc_percentiles(ages, sexes, hcirc_values)
+
+    for age, sex, hcirc, percentile in zip(ages, sexes, hcirc_values, percentiles):
+        patient = Patient(age=age, sex=Sex(sex), hcirc={"value_cm": hcirc})
+        assert percentile == patient.calculate_hcirc_percentile()
+
+
+def test_vectorized_percentiles_unknown_sex_is_nan():
+    percentiles = hcirc_percentiles([2.0], ["X"], [48.0])
+    assert np.isnan(percentiles[0])
+
+
+def test_percentile_matches_scipy_normal_fit():
+    """Test that the kernel reproduces the original scipy.stats computation."""
+    reference = reference_registry.get(Sex.F)
+    p25ppf, p75ppf = stats.norm.ppf(0.25), stats.norm.ppf(0.75)
+
+    for age in np.linspace(0.0, reference.max_age, 57):
+        age25 = np.interp(age, reference.age, reference.p25)
+        age75 = np.interp(age, reference.age, reference.p75)
+        loc = (age25 * p75ppf - age75 * p25ppf) / (p75ppf - p25ppf)
+        scale = (age75 - age25) / (p75ppf - p25ppf)
+        for hcirc in (30.0, 42.5, 50.0, 55.0):
+            expected = round(stats.norm.cdf(hcirc, loc=loc, scale=scale) * 100, 2)
+            assert hcirc_percentile(age, Sex.F, hcirc) == expected
+
+
+def test_grid_percentiles_within_documented_bound(monkeypatch):
+    """Test that the age grid mode stays within its documented error bound."""
+    ages = np.linspace(0.0, 22.0, 5001)
+    hcirc_values = np.linspace(30.0, 60.0, ages.size)
+    sexes = np.where(np.arange(ages.size) % 2, "M", "F")
+    exact = hcirc_percentiles(ages, sexes, hcirc_values)
+
+    grid_registry = ReferenceRegistry(grid_step_days=1)
+    monkeypatch.setattr("src.models.reference_registry", grid_registry)
+    gridded = hcirc_percentiles(ages, sexes, hcirc_values)
+
+    bound = max(
+        reference.grid.max_percentile_error
+        for reference in grid_registry.tables.values()
+    )
+    assert np.max(np.abs(gridded - exact)) <= bound + 0.01
+
+
+def test_centiles_model_returns_reference_centiles():
+    """Test that measurements on a reference centile return that centile."""
+    reference = reference_registry.get(Sex.F)
+    for row in (0, 10, 30):
+        for centile, hcirc in zip(CENTILES, reference.centiles[row]):
+            percentile = hcirc_percentile(
+                reference.age[row], Sex.F, hcirc, ReferenceModel.centiles
+            )
+            assert percentile == pytest.approx(int(centile), abs=0.01)
+
+
+def test_centiles_model_vectorized_matches_single_patient():
+    ages = np.array([0.0, 0.5, 2.0, 10.3, 25.0])
+    sexes = np.array(["M", "F", "M", "F", "M"])
+    hcirc_values = np.array([30.0, 44.0, 48.0, 52.5, 62.0])
+
+    percentiles = hcirc_percentiles(ages, sexes, hcirc_values, ReferenceModel.centiles)
+
+    for age, sex, hcirc, percentile in zip(ages, sexes, hcirc_values, percentiles):
+        assert percentile == hcirc_percentile(age, sex, hcirc, ReferenceModel.centiles)
+
+
+def test_calculate_percentile_leaves_patient_unchanged():
+    hcirc = {"value_cm": 55.0}
+    patient = Patient(age=25, sex=Sex.M, hcirc=hcirc)
+
+    percentile = patient.calculate_hcirc_percentile()
+    assert patient.age == 25
+    assert hcirc == {"value_cm": 55.0}
+    assert patient.calculate_hcirc_percentile() == percentile
+
+
+def test_patient_record():
+    patient = Patient(age=2.0, sex=Sex.F, hcirc={"value_cm": 47.0})
+
+    assert patient.to_record() == PatientRecord(2.0, Sex.F, 47.0)
+    assert patient.calculate_hcirc_percentile() == hcirc_percentile(2.0, Sex.F, 47.0)
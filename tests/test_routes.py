@@ -1,13 +1,21 @@
+import json
 import re
 
 import pytest
 from fastapi.testclient import TestClient
+from markupsafe import escape
 
+from src.config import settings
 from src.main import app  # Assuming 'app' is your FastAPI instance
+from src.routes import render_result_card
+from src.utils.rate_limiter import limiter
+from src.utils.reference_registry import reference_registry
 
 
 @pytest.fixture
 def client():
+    # Every test starts with a full quota
+    limiter.reset()
     return TestClient(app)
 
 
@@ -131,6 +139,31 @@ def test_validate_age_route_no_age(client, no_age_data):
     assert response.status_code == 200
 
 
+def test_validate_age_route_unchanged_message(client, high_age_data):
+    response = client.post("/validate-age", data=high_age_data)
+    message = "Ages over 21 years are accepted, but they won't affect the result."
+    assert f'name="age_message" value="{escape(message)}"' in response.text
+
+    response = client.post(
+        "/validate-age", data={**high_age_data, "age_value": 30, "age_message": message}
+    )
+    assert response.status_code == 204
+    assert response.content == b""
+
+
+def test_validate_age_route_changed_message(client, valid_age_data):
+    response = client.post(
+        "/validate-age", data={**valid_age_data, "age_message": "none"}
+    )
+    assert response.status_code == 204
+
+    response = client.post(
+        "/validate-age", data={**valid_age_data, "age_value": 22, "age_message": "none"}
+    )
+    assert response.status_code == 200
+    assert "Ages over 21 years are accepted" in response.text
+
+
 def test_validate_age_route_generic_error(client, patch_dependencies):
     response = client.post("/validate-age", data={"age_value": 10, "age_unit": "years"})
     assert response.status_code == 500
@@ -228,3 +261,318 @@ def test_calculate_percentile_api_invalid_data(client, invalid_data):
 #     for _ in range(101):  # Assuming the limit is 100 requests/minute
 #         response = client.get("/")
 #     assert response.status_code == 429  # Too many requests
+
+
+def test_calculate_percentile_batch_api_matches_single(
+    client, low_hcirc_data, mid_hcirc_data, high_hcirc_data
+):
+    records = [low_hcirc_data, mid_hcirc_data, high_hcirc_data]
+    response = client.post(
+        "/api/v1/head-circumference/batch", json={"records": records}
+    )
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert len(results) == len(records)
+    for record, result in zip(records, results):
+        single = client.post("/api/v1/head-circumference", json=record).json()
+        assert result == {"hcirc_percentile": single["hcirc_percentile"]}
+
+
+def test_calculate_percentile_batch_api_reports_errors_in_order(
+    client, mid_hcirc_data, invalid_data
+):
+    records = [invalid_data, mid_hcirc_data, {**mid_hcirc_data, "sex": "X"}]
+    response = client.post(
+        "/api/v1/head-circumference/batch", json={"records": records}
+    )
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert "errors" in results[0]
+    assert 1 <= results[1]["hcirc_percentile"] <= 99
+    assert results[2]["errors"][0]["loc"] == ["sex"]
+
+
+def test_calculate_percentile_batch_api_reports_records_that_are_not_objects(
+    client, mid_hcirc_data
+):
+    response = client.post(
+        "/api/v1/head-circumference/batch",
+        json={"records": [mid_hcirc_data, "not a record", [1, 2]]},
+    )
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert 1 <= results[0]["hcirc_percentile"] <= 99
+    assert results[1]["errors"][0]["msg"] == "Each record must be an object."
+    assert results[2]["errors"][0]["type"] == "value_error"
+
+
+def test_calculate_percentile_batch_api_reference_date(client):
+    record = {
+        "age_unit": "dob",
+        "age_value": "2020-01-01",
+        "sex": "F",
+        "hcirc_value": 48.0,
+        "hcirc_unit": "cm",
+    }
+    age_record = {**record, "age_unit": "years", "age_value": 731 / 365.25}
+    response = client.post(
+        "/api/v1/head-circumference/batch",
+        json={"records": [record, age_record], "reference_date": "2022-01-01"},
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0] == results[1]
+
+
+def test_calculate_percentile_batch_api_dob_after_reference_date(client):
+    record = {
+        "age_unit": "dob",
+        "age_value": "2020-01-01",
+        "sex": "F",
+        "hcirc_value": 48.0,
+        "hcirc_unit": "cm",
+    }
+    response = client.post(
+        "/api/v1/head-circumference/batch",
+        json={"records": [record], "reference_date": "2019-01-01"},
+    )
+    assert response.status_code == 200
+    error = response.json()["results"][0]["errors"][0]
+    assert "after the reference date" in error["msg"]
+
+
+def test_calculate_percentile_batch_api_too_large(client, mid_hcirc_data):
+    records = [mid_hcirc_data] * (settings.batch_max_size + 1)
+    response = client.post(
+        "/api/v1/head-circumference/batch", json={"records": records}
+    )
+    assert response.status_code == 422
+
+
+def test_calculate_percentile_stream_api(client, low_hcirc_data, high_hcirc_data):
+    body = "\n".join(json.dumps(record) for record in [low_hcirc_data, high_hcirc_data])
+    response = client.post(
+        "/api/v1/head-circumference/stream",
+        content=body,
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert results[0]["hcirc_percentile"] < 1
+    assert results[1]["hcirc_percentile"] > 99
+
+
+def test_calculate_percentile_api_centiles_model(client, mid_hcirc_data):
+    response = client.post(
+        "/api/v1/head-circumference?model=centiles", json=mid_hcirc_data
+    )
+    assert response.status_code == 200
+    assert 1 <= response.json()["hcirc_percentile"] <= 99
+
+    batch = client.post(
+        "/api/v1/head-circumference/batch",
+        json={"records": [mid_hcirc_data], "model": "centiles"},
+    )
+    assert batch.json()["results"][0] == response.json()
+
+
+def test_calculate_percentile_api_unknown_model(client, mid_hcirc_data):
+    response = client.post("/api/v1/head-circumference?model=lms", json=mid_hcirc_data)
+    assert response.status_code == 422
+
+
+def test_api_rejects_unknown_reference(client, mid_hcirc_data):
+    response = client.post(
+        "/api/v1/head-circumference?reference=unknown", json=mid_hcirc_data
+    )
+    assert response.status_code == 422
+    assert "Available references: default" in response.json()["detail"]
+
+
+def test_api_accepts_default_reference_by_name(client, mid_hcirc_data):
+    default = client.post("/api/v1/head-circumference", json=mid_hcirc_data)
+    named = client.post(
+        "/api/v1/head-circumference?reference=default", json=mid_hcirc_data
+    )
+    assert named.json() == default.json()
+
+
+def test_batch_api_rejects_unknown_reference(client, mid_hcirc_data):
+    response = client.post(
+        "/api/v1/head-circumference/batch",
+        json={"records": [mid_hcirc_data], "reference": "unknown"},
+    )
+    assert response.status_code == 422
+
+
+def test_responses_carry_reference_version(client, mid_hcirc_data):
+    response = client.post("/api/v1/head-circumference", json=mid_hcirc_data)
+    assert response.headers["x-reference-version"] == reference_registry.version
+
+
+def test_reload_references_is_disabled_without_admin_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", None)
+    response = client.post("/api/v1/admin/references/reload")
+    assert response.status_code == 404
+
+
+def test_reload_references_rejects_invalid_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    response = client.post(
+        "/api/v1/admin/references/reload", headers={"X-Admin-Token": "wrong"}
+    )
+    assert response.status_code == 403
+
+
+def test_reload_references(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    notified = []
+    monkeypatch.setattr("src.routes.notify_server", lambda: notified.append(True))
+    version = reference_registry.version
+    response = client.post(
+        "/api/v1/admin/references/reload", headers={"X-Admin-Token": "s3cret"}
+    )
+    assert response.status_code == 200
+    # The other workers of the pre-fork server reload their tables too
+    assert notified == [True]
+    assert response.json() == {
+        "version": version,
+        "previous_version": version,
+        "references": ["default"],
+    }
+
+
+def test_get_curves_api(client):
+    response = client.get(
+        "/api/v1/head-circumference/curves",
+        params={"sex": "F", "centiles": "97,3", "step": 1},
+    )
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == (
+        f"public, max-age={settings.curves_max_age}"
+    )
+
+    curves = response.json()
+    assert curves["sex"] == "F"
+    assert list(curves["centiles"]) == ["3", "97"]
+    assert curves["age"][:3] == [0.0, 1.0, 2.0]
+    for values in curves["centiles"].values():
+        assert len(values) == len(curves["age"])
+    assert all(
+        low < high for low, high in zip(*curves["centiles"].values(), strict=True)
+    )
+
+
+def test_get_curves_api_not_modified(client):
+    url = "/api/v1/head-circumference/curves?sex=M"
+    etag = client.get(url).headers["etag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    response = client.get(url, headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_get_curves_api_invalid_parameters(client):
+    url = "/api/v1/head-circumference/curves"
+    assert client.get(url, params={"sex": "M", "centiles": "3,42"}).status_code == 422
+    assert client.get(url, params={"sex": "M", "step": 0}).status_code == 422
+    assert client.get(url, params={"sex": "X"}).status_code == 422
+
+
+def test_templates_link_fingerprinted_assets(client):
+    response = client.get("/")
+    urls = re.findall(r'"(/assets/static/styles\.[0-9a-f]{12}\.css)"', response.text)
+    assert urls
+
+    asset = client.get(urls[0])
+    assert asset.status_code == 200
+    assert "immutable" in asset.headers["cache-control"]
+    assert client.get("/static/styles.css").content == asset.content
+
+
+def test_get_cache_stats_api(client, mid_hcirc_data):
+    client.post("/api/v1/head-circumference", json=mid_hcirc_data)
+    client.post("/api/v1/head-circumference", json=mid_hcirc_data)
+
+    stats = client.get("/api/v1/cache/stats").json()["percentile"]
+    assert stats["hits"] >= 1
+    assert {"size", "max_size", "misses", "evictions", "hit_rate"} <= set(stats)
+
+
+def test_get_metrics(client, mid_hcirc_data):
+    client.post("/api/v1/head-circumference", json=mid_hcirc_data)
+    client.post("/head-circumference", data=mid_hcirc_data)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "ratelimit-limit" not in response.headers
+    assert "/metrics" not in client.get("/openapi.json").json()["paths"]
+
+    text = response.text
+    assert 'route="/api/v1/head-circumference",status="200"' in text
+    assert (
+        'http_request_duration_seconds_count{method="POST",route="/head-circumference"}'
+        in text
+    )
+    for stage in ("validation", "normalization", "computation", "rendering"):
+        assert f'hcirc_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert 'cache_hits_total{cache="percentile"}' in text
+    assert "http_requests_in_progress 1" in text
+
+
+@pytest.mark.parametrize("path", ["/", "/show-dob", "/show-age", "/legal"])
+def test_static_fragments_are_revalidated_with_etags(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-cache"
+    etag = response.headers["etag"]
+
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_too_many_requests_page(client):
+    response = client.get("/too-many-requests")
+    assert response.status_code == 429
+    assert "Too many requests" in response.text
+    assert "etag" not in response.headers
+
+
+def test_result_cards_are_rendered_once_per_percentile(client, mid_hcirc_data):
+    render_result_card.cache_clear()
+    first = client.post("/head-circumference", data=mid_hcirc_data)
+    second = client.post("/head-circumference", data=mid_hcirc_data)
+
+    assert first.text == second.text
+    info = render_result_card.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+
+def test_api_documents_json_bodies(client):
+    paths = client.get("/openapi.json").json()["paths"]
+    for path in ("/api/v1/head-circumference", "/api/v1/head-circumference/batch"):
+        body = paths[path]["post"]["requestBody"]
+        assert body["required"] is True
+        assert "properties" in body["content"]["application/json"]["schema"]
+
+
+def test_calculate_percentile_api_invalid_json(client):
+    response = client.post(
+        "/api/v1/head-circumference",
+        content=b"{not json",
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body"]
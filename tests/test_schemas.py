@@ -3,7 +3,7 @@ from datetime import date
 import pytest
 
 from src.models import Sex
-from src.schemas import AgeUnitEnum, HcircUnitEnum, PatientInput
+from src.schemas import AgeUnitEnum, HcircUnitEnum, PatientInput, normalize_age
 
 
 @pytest.fixture
@@ -109,6 +109,48 @@ def test_normalize_hcirc_in_inches(patient_input_inches):
     assert pytest.approx(normalized.hcirc_cm, 0.001) == 50.0
 
 
+@pytest.mark.parametrize(
+    "fixture",
+    [
+        "patient_input_years",
+        "patient_input_months",
+        "patient_input_weeks",
+        "patient_input_days",
+        "patient_input_dob",
+        "patient_input_inches",
+    ],
+)
+def test_record_matches_normalized_data(request, fixture):
+    patient_input = request.getfixturevalue(fixture)
+    record = patient_input.to_record()
+    normalized = patient_input.to_normalized()
+    assert record == (normalized.age_years, normalized.sex, normalized.hcirc_cm)
+    assert isinstance(record.sex, Sex)
+
+
+@pytest.mark.parametrize(
+    "age_value, age_unit, age_years",
+    [
+        (5.0, AgeUnitEnum.years, 5.0),
+        (24.0, AgeUnitEnum.months, 2.0),
+        (104.355, AgeUnitEnum.weeks, 2.0),
+        (730.5, AgeUnitEnum.days, 2.0),
+        (date(2022, 1, 1), AgeUnitEnum.dob, 730 / 365.25),
+        (date(1970, 1, 1), AgeUnitEnum.years, 0.0),
+    ],
+)
+def test_normalize_age(age_value, age_unit, age_years):
+    reference_date = date(2024, 1, 1)
+    assert normalize_age(age_value, age_unit, reference_date) == pytest.approx(
+        age_years
+    )
+
+
+def test_normalize_age_rejects_dob_after_reference_date():
+    with pytest.raises(ValueError):
+        normalize_age(date(2024, 1, 2), AgeUnitEnum.dob, date(2024, 1, 1))
+
+
 def test_invalid_dob_in_future():
     future_dob = date.today().replace(year=date.today().year + 1)
     with pytest.raises(ValueError, match="Date of birth cannot be in the future."):
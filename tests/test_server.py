@@ -0,0 +1,125 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from src.utils.reference_registry import CENTILES
+from src.utils.reference_reload import RELOAD_SIGNAL
+from src.utils.reference_store import build_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get(url: str, timeout: float = 30.0) -> int:
+    return _open(url, timeout).status
+
+
+def _open(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return response
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+@pytest.fixture
+def server(tmp_path):
+    port = _free_port()
+    env = {
+        **os.environ,
+        "RATE_LIMIT_STORAGE_URI": f"mmap://{tmp_path / 'ratelimit'}",
+        "SERVER_MAX_REQUESTS": "2",
+        "SERVER_MAX_REQUESTS_JITTER": "0",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.server", "--host", "127.0.0.1"]
+        + ["--port", str(port), "--workers", "2"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    yield process, f"http://127.0.0.1:{port}/show-age"
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def test_server_recycles_workers_and_stops_gracefully(server):
+    process, url = server
+
+    # Each worker restarts after two requests
+    assert [_get(url) for _ in range(8)] == [200] * 8
+
+    process.send_signal(signal.SIGHUP)
+    assert _get(url) == 200
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=60) == 0
+
+
+def _build_shifted_store(tmp_path, path: str, amount: float) -> None:
+    """Build a store of the default references, every centile shifted by amount cm."""
+    model_dir = tmp_path / f"data-{amount}" / "hcirc_model"
+    model_dir.mkdir(parents=True)
+    for file_name in ("male.tsv", "female.tsv"):
+        with open(os.path.join(ROOT, "data", "hcirc_model", file_name)) as file:
+            lines = file.read().splitlines()
+        shifted = [lines[0]] + [
+            "\t".join([age] + [f"{float(value) + amount:.2f}" for value in values])
+            for age, *values in (line.split("\t") for line in lines[1:])
+        ]
+        (model_dir / file_name).write_text("\n".join(shifted) + "\n")
+    build_store(str(model_dir.parent), path, CENTILES)
+
+
+def test_reload_signal_reaches_every_worker(tmp_path):
+    store_path = str(tmp_path / "references.bin")
+    _build_shifted_store(tmp_path, store_path, 0.0)
+    port = _free_port()
+    env = {
+        **os.environ,
+        "RATE_LIMIT_STORAGE_URI": f"mmap://{tmp_path / 'ratelimit'}",
+        "REFERENCE_STORE_PATH": store_path,
+        "SERVER_MAX_REQUESTS": "0",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.server", "--host", "127.0.0.1"]
+        + ["--port", str(port), "--workers", "3"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/show-age"
+    try:
+        previous = _open(url).headers["x-reference-version"]
+
+        _build_shifted_store(tmp_path, store_path, 1.0)
+        process.send_signal(RELOAD_SIGNAL)
+
+        deadline = time.monotonic() + 30
+        while True:
+            versions = {_open(url).headers["x-reference-version"] for _ in range(30)}
+            if previous not in versions or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        assert len(versions) == 1 and previous not in versions
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
@@ -0,0 +1,211 @@
+import json
+from datetime import date
+
+import numpy as np
+import pytest
+
+from src.config import settings
+from src.models import PatientRecord, ReferenceModel, Sex, hcirc_percentile
+from src.schemas import NormalizedPatientData
+from src.services import (
+    calculate_hcirc_curves,
+    calculate_hcirc_percentile,
+    calculate_hcirc_percentile_batch,
+    calculate_hcirc_percentile_stream,
+    is_valid_age,
+    percentile_cache,
+)
+from src.utils.reference_registry import reference_registry
+
+
+@pytest.fixture
+def record():
+    return {
+        "age_unit": "years",
+        "age_value": 2,
+        "sex": "M",
+        "hcirc_value": 48.0,
+        "hcirc_unit": "cm",
+    }
+
+
+def test_is_valid_age_over_21(capsys):
+    has_error, context = is_valid_age(260.0, "months")
+    assert not has_error
+    assert context["message"].category == "info"
+    assert capsys.readouterr().out == ""
+
+
+def test_is_valid_age_future_dob():
+    has_error, context = is_valid_age(date(2100, 1, 1), "dob")
+    assert has_error
+    assert context["message"].text == "Date of birth cannot be in the future."
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def _collect(stream) -> list[dict]:
+    lines = []
+    async for chunk in stream:
+        lines.extend(json.loads(line) for line in chunk.splitlines())
+    return lines
+
+
+def test_batch_accepts_dicts_and_json(record):
+    results = calculate_hcirc_percentile_batch([record, json.dumps(record).encode()])
+    assert results[0] == results[1]
+    assert "hcirc_percentile" in results[0]
+
+
+def test_batch_reports_records_that_are_not_objects(record):
+    results = calculate_hcirc_percentile_batch([42, record, json.dumps(record), None])
+    assert "hcirc_percentile" in results[1]
+    for index in (0, 2, 3):
+        assert results[index]["errors"][0]["msg"] == "Each record must be an object."
+
+
+def test_batch_rejects_negative_age(record):
+    results = calculate_hcirc_percentile_batch([{**record, "age_value": -2}])
+    assert results[0]["errors"][0]["msg"] == "Age must not be a negative number."
+
+
+@pytest.mark.asyncio
+async def test_stream_matches_batch_across_arbitrary_chunks(record):
+    records = [{**record, "hcirc_value": 40.0 + i} for i in range(23)]
+    body = b"\n".join(json.dumps(r).encode() for r in records)
+
+    # Tiny network chunks split records mid-line
+    stream = calculate_hcirc_percentile_stream(
+        _chunks(body, 7), date(2024, 1, 1), chunk_size=5
+    )
+    assert await _collect(stream) == calculate_hcirc_percentile_batch(records)
+
+
+@pytest.mark.asyncio
+async def test_stream_yields_one_chunk_at_a_time(record):
+    body = b"\n".join(json.dumps(record).encode() for _ in range(10)) + b"\n"
+
+    stream = calculate_hcirc_percentile_stream(_chunks(body, len(body)), chunk_size=4)
+    sizes = [len(chunk.splitlines()) async for chunk in stream]
+    assert sizes == [4, 4, 2]
+
+
+@pytest.mark.asyncio
+async def test_stream_skips_blank_lines_and_reports_invalid_ones(record):
+    body = b"\n\n" + json.dumps(record).encode() + b"\nnot json\n\n"
+
+    results = await _collect(calculate_hcirc_percentile_stream(_chunks(body, 3)))
+    assert len(results) == 2
+    assert "hcirc_percentile" in results[0]
+    assert results[1]["errors"][0]["type"] == "json_invalid"
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_on_oversized_record(record):
+    body = json.dumps(record).encode() + b"\n" + b"x" * 300
+
+    stream = calculate_hcirc_percentile_stream(_chunks(body, 16), max_line_bytes=128)
+    results = await _collect(stream)
+    assert "hcirc_percentile" in results[0]
+    assert results[-1]["errors"][0]["msg"] == "Record is too long."
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_on_oversized_complete_record(record):
+    line = json.dumps(record).encode()
+    body = line + b"\n" + b"x" * 300 + b"\n" + line + b"\n"
+
+    # The whole body arrives in a single chunk
+    stream = calculate_hcirc_percentile_stream(
+        _chunks(body, len(body)), max_line_bytes=128
+    )
+    results = await _collect(stream)
+    assert len(results) == 2
+    assert "hcirc_percentile" in results[0]
+    assert results[1]["errors"][0]["msg"] == "Record is too long."
+
+
+@pytest.mark.asyncio
+async def test_stream_charges_each_chunk_until_refused(record):
+    body = b"\n".join(json.dumps(record).encode() for _ in range(5))
+    charges = []
+
+    def charge(records):
+        charges.append(records)
+        return len(charges) < 2
+
+    stream = calculate_hcirc_percentile_stream(
+        _chunks(body, 16), chunk_size=2, charge=charge
+    )
+    results = await _collect(stream)
+    assert charges == [2, 2]
+    assert len(results) == 3
+    assert results[-1]["errors"][0]["msg"] == "Rate limit exceeded."
+
+
+def test_curves_use_reference_ages_by_default():
+    body, etag = calculate_hcirc_curves(Sex.M, ("50",))
+    curves = json.loads(body)
+    reference = reference_registry.get(Sex.M)
+    assert curves["age"] == reference.age.tolist()
+    assert curves["centiles"]["50"] == np.round(reference.centiles[:, 3], 3).tolist()
+    assert calculate_hcirc_curves(Sex.M, ("50",)) == (body, etag)
+
+
+def test_curves_resample_ages_and_end_at_max_age():
+    curves = json.loads(calculate_hcirc_curves(Sex.F, step=0.5)[0])
+    reference = reference_registry.get(Sex.F)
+    assert curves["age"][:3] == [0.0, 0.5, 1.0]
+    assert curves["age"][-1] == reference.max_age
+
+
+@pytest.fixture
+def patient_data():
+    return NormalizedPatientData(age_years=2.0, sex=Sex.F, hcirc_cm=47.0)
+
+
+def test_percentile_cache_reuses_results(patient_data):
+    percentile_cache.clear()
+    hits = percentile_cache.hits
+
+    first = calculate_hcirc_percentile(patient_data)
+    assert calculate_hcirc_percentile(patient_data) == first
+    assert percentile_cache.hits == hits + 1
+    assert first == hcirc_percentile(2.0, Sex.F, 47.0)
+
+
+def test_percentile_accepts_patient_records(patient_data):
+    record = PatientRecord(2.0, Sex.F, 47.0)
+    assert calculate_hcirc_percentile(record) == calculate_hcirc_percentile(
+        patient_data
+    )
+
+
+def test_percentile_cache_keys_on_model(patient_data):
+    percentile_cache.clear()
+    calculate_hcirc_percentile(patient_data)
+    centiles = calculate_hcirc_percentile(patient_data, ReferenceModel.centiles)
+    assert centiles == hcirc_percentile(2.0, Sex.F, 47.0, ReferenceModel.centiles)
+    assert percentile_cache.stats()["size"] == 2
+
+
+def test_percentile_cache_is_cleared_on_reference_reload(patient_data):
+    calculate_hcirc_percentile(patient_data)
+    assert percentile_cache.stats()["size"] > 0
+
+    reference_registry.load()
+    assert percentile_cache.stats()["size"] == 0
+
+
+def test_percentile_cache_quantizes_inputs(monkeypatch, patient_data):
+    monkeypatch.setattr(settings, "result_cache_hcirc_quantum_cm", 0.1)
+    percentile_cache.clear()
+
+    nearby = patient_data.model_copy(update={"hcirc_cm": 47.04})
+    assert calculate_hcirc_percentile(nearby) == calculate_hcirc_percentile(
+        patient_data
+    )
+    assert percentile_cache.stats()["size"] == 1
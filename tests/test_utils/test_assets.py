@@ -0,0 +1,103 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from src.utils import assets
+from src.utils.assets import ASSETS_PREFIX, AssetManifest, AssetsApp
+
+CSS = b"body { color: black; }\n" * 100
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    static = tmp_path / "static"
+    (static / "img").mkdir(parents=True)
+    (static / "styles.css").write_bytes(CSS)
+    (static / "img" / "logo.png").write_bytes(b"\x89PNG" + bytes(range(256)))
+
+    manifest = AssetManifest(directories=(str(static),))
+    manifest.load()
+    return manifest
+
+
+@pytest.fixture
+def client(manifest):
+    app = Starlette(routes=[Mount(ASSETS_PREFIX, AssetsApp(manifest))])
+    return TestClient(app)
+
+
+def test_manifest_fingerprints_asset_urls(manifest):
+    url = manifest.url("static/styles.css")
+    assert url.startswith("/assets/static/styles.")
+    assert url.endswith(".css")
+    assert manifest.url("/static/styles.css") == url
+    assert manifest.url("static/missing.css") == "/static/missing.css"
+
+
+def test_manifest_compresses_text_assets_only_when_used(manifest):
+    css = manifest.assets["static/styles.css"]
+    assert not css.compressed
+    assert gzip.decompress(css.variants["gzip"]) == CSS
+    assert css.compressed
+    assert "gzip" not in manifest.assets["static/img/logo.png"].variants
+
+
+def test_manifest_reads_variants_built_in_cache_dir(manifest, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    manifest.build(cache_dir)
+
+    def compress(body):
+        raise AssertionError("built variants must not be compressed again")
+
+    monkeypatch.setattr(
+        assets, "COMPRESSORS", dict.fromkeys(assets.COMPRESSORS, compress)
+    )
+    cached = AssetManifest(manifest.directories, cache_dir)
+    cached.load()
+    assert cached.assets["static/styles.css"].variants == (
+        manifest.assets["static/styles.css"].variants
+    )
+
+
+def test_manifest_reload_only_reads_changed_files(manifest, tmp_path):
+    css = manifest.assets["static/styles.css"]
+    logo = manifest.assets["static/img/logo.png"]
+    (tmp_path / "static" / "styles.css").write_bytes(CSS * 2)
+
+    manifest.load()
+    assert manifest.assets["static/img/logo.png"] is logo
+    assert manifest.assets["static/styles.css"].hashed_path != css.hashed_path
+    assert manifest.get(css.hashed_path) is None
+
+
+def test_assets_app_serves_negotiated_variant(client, manifest):
+    url = manifest.url("static/styles.css")
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.status_code == 200
+    assert manifest.assets["static/styles.css"].compressed
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == CSS
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in response.headers
+    assert response.content == CSS
+
+
+def test_assets_app_returns_not_modified(client, manifest):
+    url = manifest.url("static/img/logo.png")
+    etag = client.get(url).headers["etag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_assets_app_rejects_unknown_paths(client):
+    assert client.get("/assets/static/styles.css").status_code == 404
+    assert client.post("/assets/static/styles.css").status_code == 405
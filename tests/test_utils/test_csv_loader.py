@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from src.utils.csv_loader import load_csv
+
+
+def test_load_csv_returns_float_columns():
+    data = load_csv("data/hcirc_model/male.tsv")
+    assert list(data) == ["Age", "3", "10", "25", "50", "75", "90", "97"]
+    assert data["Age"].dtype == np.float64
+    assert data["Age"][0] == 0.0
+    assert data["3"][0] == 31.49
+    assert all(column.size == data["Age"].size for column in data.values())
+
+
+def test_load_csv_skips_blank_lines(tmp_path):
+    path = tmp_path / "table.tsv"
+    path.write_text("Age\t50\n0\t35.5\n\n1\t46.0\n")
+    data = load_csv(str(path))
+    np.testing.assert_array_equal(data["50"], [35.5, 46.0])
+
+
+def test_load_csv_rejects_non_numeric_values(tmp_path):
+    path = tmp_path / "table.tsv"
+    path.write_text("Age\t50\n0\tn/a\n")
+    with pytest.raises(ValueError, match="numeric table"):
+        load_csv(str(path))
@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+import pytest
+from scipy import stats  # type: ignore
+
+from src.utils.hcirc_utils import erfc, norm_cdf, norm_from_percentiles, norm_ppf
+
+
+def test_norm_ppf_matches_scipy():
+    for p in (0.03, 0.25, 0.5, 0.75, 0.97):
+        assert norm_ppf(p) == pytest.approx(stats.norm.ppf(p), rel=1e-15, abs=1e-15)
+
+
+def test_norm_ppf_is_computed_once():
+    norm_ppf.cache_clear()
+    norm_ppf(0.25)
+    norm_ppf(0.25)
+    assert norm_ppf.cache_info().hits == 1
+
+
+def test_erfc_is_within_error_bound_of_math_erfc():
+    x = np.concatenate(
+        [
+            np.linspace(-6.0, 10.0, 200_001),
+            np.random.default_rng(0).normal(0.0, 2.0, 100_000),
+            # Boundaries between the approximations
+            np.nextafter([-1.0, 1.0, 8.0], [np.inf, -np.inf, np.inf]),
+            [-1.0, 1.0, 8.0],
+        ]
+    )
+    expected = np.array([math.erfc(value) for value in x])
+    np.testing.assert_allclose(erfc(x), expected, rtol=1e-14, atol=0)
+
+    # Further out, the rounding of exp(-x^2) loosens the bound
+    x = np.linspace(10.0, 26.0, 10_001)
+    expected = np.array([math.erfc(value) for value in x])
+    np.testing.assert_allclose(erfc(x), expected, rtol=1e-13, atol=0)
+
+
+def test_erfc_special_values():
+    result = erfc(np.array([0.0, 40.0, -40.0, np.inf, -np.inf, np.nan]))
+    assert result[:5].tolist() == [1.0, 0.0, 2.0, 0.0, 2.0]
+    assert np.isnan(result[5])
+
+
+def test_norm_cdf_matches_scipy_on_arrays():
+    x = np.linspace(20.0, 70.0, 101)
+    loc = np.full_like(x, 45.0)
+    scale = np.full_like(x, 1.7)
+    np.testing.assert_allclose(
+        norm_cdf(x, loc, scale), stats.norm.cdf(x, loc=loc, scale=scale), rtol=1e-13
+    )
+
+
+def test_norm_cdf_keeps_scalar_and_array_shapes():
+    assert norm_cdf(45.0, 45.0, 1.7) == 0.5
+    assert np.ndim(norm_cdf(45.0, 45.0, 1.7)) == 0
+
+    x = np.full((2, 3), 45.0)
+    result = norm_cdf(x, 45.0, 1.7)
+    assert result.shape == (2, 3)
+    assert result.dtype == np.float64
+
+
+def test_norm_cdf_tails():
+    assert norm_cdf(np.array([-40.0, 40.0]), 0.0, 1.0).tolist() == [0.0, 1.0]
+    assert norm_cdf(-10.0, 0.0, 1.0) == pytest.approx(stats.norm.cdf(-10.0))
+
+
+def test_norm_from_percentiles_recovers_distribution():
+    loc, scale = 45.0, 1.5
+    x25 = stats.norm.ppf(0.25, loc=loc, scale=scale)
+    x75 = stats.norm.ppf(0.75, loc=loc, scale=scale)
+    assert norm_from_percentiles(x25, 0.25, x75, 0.75) == pytest.approx((loc, scale))
+
+
+def test_norm_from_percentiles_is_vectorized():
+    x25 = np.array([40.0, 45.0])
+    x75 = np.array([42.0, 48.0])
+    loc, scale = norm_from_percentiles(x25, 0.25, x75, 0.75)
+    assert loc.shape == scale.shape == (2,)
+    np.testing.assert_allclose(loc, [41.0, 46.5])
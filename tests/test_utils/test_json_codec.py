@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.exceptions import RequestValidationError
+from starlette.requests import Request
+
+from src.schemas import BatchPatientInput, PatientInput
+from src.utils.json_codec import (
+    FastJSONResponse,
+    dumps,
+    json_body_schema,
+    parse_json_body,
+)
+
+
+def _request(body: bytes) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request({"type": "http", "method": "POST", "headers": []}, receive)
+
+
+def test_dumps_matches_the_json_module():
+    content = {"results": [{"hcirc_percentile": 42.17}, {"errors": [{"loc": []}]}]}
+    assert json.loads(dumps(content)) == content
+    assert b" " not in dumps(content)
+
+
+def test_fast_json_response():
+    response = FastJSONResponse({"hcirc_percentile": 42.17})
+    assert response.body == b'{"hcirc_percentile":42.17}'
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_parse_json_body_validates_in_one_step():
+    body = b'{"age_unit":"years","age_value":2,"sex":"M","hcirc_value":48,"hcirc_unit":"cm"}'
+    patient_input = asyncio.run(parse_json_body(_request(body), PatientInput))
+    assert patient_input.age_value == 2.0
+    assert patient_input.hcirc_value == 48.0
+
+
+@pytest.mark.parametrize(
+    "body, loc",
+    [
+        (b'{"age_unit":"years","age_value":2}', ("body", "sex")),
+        (b"{not json", ("body",)),
+    ],
+)
+def test_parse_json_body_errors_are_located_in_the_body(body, loc):
+    with pytest.raises(RequestValidationError) as raised:
+        asyncio.run(parse_json_body(_request(body), PatientInput))
+    assert loc in [tuple(error["loc"]) for error in raised.value.errors()]
+
+
+@pytest.mark.parametrize("model", [PatientInput, BatchPatientInput])
+def test_json_body_schema_is_inlined(model):
+    schema = json_body_schema(model)["requestBody"]["content"]["application/json"]
+    assert "$ref" not in json.dumps(schema)
+    assert "$defs" not in schema["schema"]
+    assert set(schema["schema"]["required"]) <= set(schema["schema"]["properties"])
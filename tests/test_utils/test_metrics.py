@@ -0,0 +1,103 @@
+import jinja2
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from fastapi.testclient import TestClient
+
+from src.utils.metrics import (
+    MetricsMiddleware,
+    MetricsRegistry,
+    cache_metrics,
+    http_request_duration,
+    http_requests,
+    instrument_templates,
+    stage_duration,
+)
+
+
+def test_counter_and_gauge_render_per_label_values():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ("route",))
+    in_progress = registry.gauge("in_progress", "In progress.")
+    requests.inc("/a")
+    requests.inc("/a")
+    requests.inc("/b", amount=3)
+    in_progress.inc()
+    in_progress.dec()
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="/a"} 2' in text
+    assert 'requests_total{route="/b"} 3' in text
+    assert "in_progress 0" in text
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.1)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 5.65" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors.", ("message",)).inc('say "hi"\n')
+    assert 'errors_total{message="say \\"hi\\"\\n"} 1' in registry.render()
+
+
+def test_collectors_of_the_same_metric_are_merged():
+    registry = MetricsRegistry()
+    registry.register_collector(cache_metrics("a", lambda: {"hits": 1, "size": 2}))
+    registry.register_collector(cache_metrics("b", lambda: {"hits": 3, "size": 4}))
+
+    text = registry.render()
+    assert text.count("# TYPE cache_hits_total counter") == 1
+    assert 'cache_hits_total{cache="a"} 1' in text
+    assert 'cache_hits_total{cache="b"} 3' in text
+    assert 'cache_size{cache="b"} 4' in text
+    assert "cache_evictions_total" not in text
+
+
+def _count(histogram, *labels):
+    return sum(histogram._observations.get(labels, [0.0])[:-1])
+
+
+def test_middleware_labels_requests_with_route_templates():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"item_id": item_id}
+
+    app.mount("/files", StaticFiles(directory="static"))
+    app.add_middleware(MetricsMiddleware)
+    client = TestClient(app)
+    before = http_requests._values.get(("GET", "/items/{item_id}", "200"), 0)
+
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/files/styles.css")
+    client.get("/other")
+
+    assert http_requests._values[("GET", "/items/{item_id}", "200")] == before + 2
+    assert http_requests._values[("GET", "/files", "200")] >= 1
+    assert http_requests._values[("GET", "unmatched", "404")] >= 1
+    assert ("GET", "/other", "404") not in http_requests._values
+    assert _count(http_request_duration, "GET", "/items/{item_id}") >= 2
+
+
+def test_instrumented_templates_observe_rendering():
+    env = jinja2.Environment(loader=jinja2.DictLoader({"page": "{{ 1 + 1 }}"}))
+    instrument_templates(env)
+    before = _count(stage_duration, "rendering")
+
+    assert env.get_template("page").render() == "2"
+    assert _count(stage_duration, "rendering") == before + 1
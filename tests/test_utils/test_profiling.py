@@ -0,0 +1,105 @@
+import pstats
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.config import settings
+from src.main import app
+from src.routes import router
+from src.utils.profiling import (
+    PROFILE_HEADER,
+    PROFILE_ID_HEADER,
+    ProfilingMiddleware,
+    setup_profiling,
+)
+
+TOKEN = "s3cret"
+RECORD = {
+    "age_unit": "years",
+    "age_value": 2,
+    "sex": "M",
+    "hcirc_value": 48.0,
+    "hcirc_unit": "cm",
+}
+
+
+def _client(directory, sample_rate=0.0) -> TestClient:
+    return TestClient(
+        ProfilingMiddleware(
+            app,
+            routes=router.routes,
+            token=TOKEN,
+            directory=str(directory),
+            sample_rate=sample_rate,
+        )
+    )
+
+
+def test_requests_with_the_token_are_profiled(tmp_path):
+    response = _client(tmp_path).post(
+        "/api/v1/head-circumference", json=RECORD, headers={PROFILE_HEADER: TOKEN}
+    )
+    assert response.status_code == 200
+
+    profile_id = response.headers[PROFILE_ID_HEADER]
+    stats = pstats.Stats(str(tmp_path / f"{profile_id}.prof"))
+    functions = {function for _, _, function in stats.stats}
+    assert "calculate_percentile_api" in functions
+
+    folded = (tmp_path / f"{profile_id}.alloc.folded").read_text().splitlines()
+    assert folded
+    for line in folded:
+        stack, size = line.rsplit(" ", 1)
+        assert int(size) > 0
+        assert all(frame.rpartition(":")[2].isdigit() for frame in stack.split(";"))
+
+
+def test_requests_without_the_token_are_not_profiled(tmp_path):
+    client = _client(tmp_path)
+    response = client.get("/show-age", headers={PROFILE_HEADER: "wrong"})
+    assert PROFILE_ID_HEADER not in response.headers
+    response = client.get("/show-age")
+    assert PROFILE_ID_HEADER not in response.headers
+    assert not list(tmp_path.iterdir())
+
+
+def test_requests_are_sampled(tmp_path):
+    response = _client(tmp_path, sample_rate=1.0).get("/show-age")
+    assert PROFILE_ID_HEADER in response.headers
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_only_routes_are_profiled(tmp_path):
+    client = _client(tmp_path)
+    for path in ("/static/styles.css", "/docs", "/unknown"):
+        response = client.get(path, headers={PROFILE_HEADER: TOKEN})
+        assert PROFILE_ID_HEADER not in response.headers
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize(
+    "environment, enabled, token, added",
+    [
+        ("production", False, TOKEN, False),
+        ("development", True, TOKEN, False),
+        ("production", True, None, False),
+        ("production", True, TOKEN, True),
+    ],
+)
+def test_setup_profiling_is_gated_by_settings(
+    monkeypatch, environment, enabled, token, added
+):
+    monkeypatch.setattr(settings, "environment", environment)
+    monkeypatch.setattr(settings, "profiling_enabled", enabled)
+    monkeypatch.setattr(settings, "profiling_token", token)
+
+    profiled_app = FastAPI()
+    assert setup_profiling(profiled_app, router.routes) is added
+    middleware = [m.cls for m in profiled_app.user_middleware]
+    assert (ProfilingMiddleware in middleware) is added
+
+
+def test_profiling_is_off_by_default():
+    assert settings.profiling_enabled is False
+    assert ProfilingMiddleware not in [m.cls for m in app.user_middleware]
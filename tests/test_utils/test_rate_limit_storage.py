@@ -0,0 +1,104 @@
+import multiprocessing
+
+import pytest
+from limits import RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+from src.utils.metrics import rate_limit_storage_full
+from src.utils.rate_limit_storage import FULL_COUNT, PROBES, SharedFileStorage
+
+
+@pytest.fixture
+def uri(tmp_path):
+    return f"mmap://{tmp_path / 'ratelimit'}"
+
+
+@pytest.fixture
+def storage(uri):
+    return storage_from_string(uri)
+
+
+def test_storage_is_registered_as_mmap_scheme(storage):
+    assert isinstance(storage, SharedFileStorage)
+    assert storage.check()
+
+
+def test_storage_counts_and_expires(storage, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.utils.rate_limit_storage.time.time", lambda: now[0])
+
+    assert storage.incr("key", 60) == 1
+    assert storage.incr("key", 60, amount=2) == 3
+    assert storage.get("key") == 3
+    assert storage.get_expiry("key") == 1060.0
+    assert storage.decr("key") == 2
+
+    now[0] = 1061.0
+    assert storage.get("key") == 0
+    assert storage.incr("key", 60) == 1
+
+
+def test_storage_clear_and_reset(storage):
+    storage.incr("a", 60)
+    storage.incr("b", 60)
+    storage.clear("a")
+    assert storage.get("a") == 0
+    assert storage.get("b") == 1
+
+    assert storage.reset() == 1
+    assert storage.get("b") == 0
+
+
+def test_storage_is_shared_between_instances(uri):
+    storage_from_string(uri).incr("key", 60)
+    assert storage_from_string(uri).get("key") == 1
+
+
+def test_full_probes_reject_new_keys_without_evicting(uri, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.utils.rate_limit_storage.time.time", lambda: now[0])
+    storage = storage_from_string(f"{uri}?slots={PROBES}")
+    for index in range(PROBES):
+        storage.incr(f"key{index}", 60 + index)
+    before = rate_limit_storage_full._values.get((), 0)
+
+    assert not FixedWindowRateLimiter(storage).hit(RateLimitItemPerMinute(10), "new")
+    assert not storage.acquire_sliding_window_entry("new", 10, 60)
+    assert storage.incr("new", 60) == FULL_COUNT
+    assert all(storage.get(f"key{index}") == 1 for index in range(PROBES))
+    assert rate_limit_storage_full._values[()] == before + 3
+
+    # Once a counter expires, its slot is free again
+    now[0] = 1060.0
+    assert storage.incr("new", 60) == 1
+    assert storage.get("key0") == 0
+
+
+def test_sliding_window_counter_strategy(storage):
+    limiter = SlidingWindowCounterRateLimiter(storage)
+    limit = RateLimitItemPerMinute(3)
+
+    assert all(limiter.hit(limit, "client") for _ in range(3))
+    assert not limiter.hit(limit, "client")
+    assert limiter.hit(limit, "other")
+
+
+def _hit_many(uri: str, hits: int, results) -> None:
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    limit = RateLimitItemPerMinute(100)
+    results.put(sum(limiter.hit(limit, "client") for _ in range(hits)))
+
+
+def test_limit_is_shared_across_processes(uri):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_hit_many, args=(uri, 50, results)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sum(results.get() for _ in workers) == 100
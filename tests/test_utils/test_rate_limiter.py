@@ -0,0 +1,155 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from src.config import settings
+from src.main import app
+from src.utils.metrics import rate_limit_rejections
+from src.utils.rate_limiter import (
+    COMPUTE_COST,
+    client_key,
+    client_tier,
+    limiter,
+    tier_limit,
+)
+
+RECORD = {
+    "age_unit": "years",
+    "age_value": 2,
+    "sex": "M",
+    "hcirc_value": 48.0,
+    "hcirc_unit": "cm",
+}
+
+
+def _request(headers: dict[str, str]) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("10.0.0.1", 1234),
+        }
+    )
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_api_keys", {"secret": "hospital-a"})
+    monkeypatch.setattr(settings, "rate_limit_client_tiers", {"hospital-a": "partner"})
+    monkeypatch.setattr(
+        settings,
+        "rate_limit_tiers",
+        {"anonymous": "20/minute", "client": "50/minute", "partner": "100/minute"},
+    )
+
+
+@pytest.fixture
+def client(clients):
+    limiter.reset()
+    yield TestClient(app)
+    limiter.reset()
+
+
+def test_client_key_uses_api_key_or_ip(clients):
+    assert client_key(_request({"X-API-Key": "secret"})) == "client:hospital-a"
+    assert client_key(_request({"X-API-Key": "unknown"})) == "ip:10.0.0.1"
+    assert client_key(_request({})) == "ip:10.0.0.1"
+
+
+def test_client_tier(clients):
+    assert client_tier("client:hospital-a") == "partner"
+    assert client_tier("client:other") == "client"
+    assert client_tier("ip:10.0.0.1") == "anonymous"
+
+
+def test_tier_limit(clients):
+    assert tier_limit("client:hospital-a") == "100/minute"
+    assert tier_limit("client:other") == "50/minute"
+    assert tier_limit("ip:10.0.0.1") == "20/minute"
+
+
+def test_responses_carry_rate_limit_headers(client):
+    response = client.get("/show-age")
+    assert response.headers["ratelimit-limit"] == "20"
+    assert response.headers["ratelimit-remaining"] == "19"
+    assert 0 < int(response.headers["ratelimit-reset"]) <= 61
+    assert response.headers["ratelimit-policy"] == "20;w=60"
+
+
+def test_quota_is_shared_between_routes_and_weighted(client):
+    client.get("/show-age")
+    response = client.get("/show-dob")
+    assert response.headers["ratelimit-remaining"] == "18"
+
+    response = client.post("/api/v1/head-circumference", json=RECORD)
+    assert response.headers["ratelimit-remaining"] == str(18 - COMPUTE_COST)
+
+
+def test_batch_records_are_charged_once_parsed(client, monkeypatch):
+    monkeypatch.setitem(settings.rate_limit_tiers, "anonymous", "30/minute")
+    url = "/api/v1/head-circumference/batch"
+
+    response = client.post(url, json={"records": [RECORD] * 3})
+    assert response.status_code == 200
+    assert response.headers["ratelimit-remaining"] == str(30 - COMPUTE_COST - 3)
+
+    # The up-front cost fits in the quota left, but the records do not
+    response = client.post(url, json={"records": [RECORD] * 10})
+    assert response.status_code == 429
+    assert response.headers["ratelimit-remaining"] == "0"
+
+
+def test_bulk_request_cost_is_not_capped(client, monkeypatch):
+    monkeypatch.setitem(settings.rate_limit_tiers, "anonymous", "2000/minute")
+    monkeypatch.setattr(settings, "batch_max_size", 1000)
+    response = client.post(
+        "/api/v1/head-circumference/batch", json={"records": [RECORD] * 1000}
+    )
+    assert response.status_code == 200
+    assert response.headers["ratelimit-remaining"] == str(2000 - COMPUTE_COST - 1000)
+
+
+def test_stream_stops_when_its_records_exceed_the_quota(client):
+    body = "\n".join(json.dumps(RECORD) for _ in range(25))
+    response = client.post("/api/v1/head-circumference/stream", content=body)
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["errors"][0]["msg"] == "Rate limit exceeded."
+
+
+def test_exceeded_quota_returns_retry_after(client):
+    for _ in range(20):
+        client.get("/show-age")
+
+    response = client.get("/show-age", headers={"Accept": "application/json"})
+    assert response.status_code == 429
+    assert response.headers["ratelimit-remaining"] == "0"
+    assert int(response.headers["retry-after"]) > 0
+
+    response = client.get("/show-age", follow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers["location"] == "/too-many-requests"
+
+
+def test_api_clients_have_their_own_quota(client):
+    for _ in range(20):
+        client.get("/show-age")
+    assert client.get("/show-age", follow_redirects=False).status_code == 302
+
+    response = client.get("/show-age", headers={"X-API-Key": "secret"})
+    assert response.status_code == 200
+    assert response.headers["ratelimit-limit"] == "100"
+
+
+def test_rejections_are_counted_per_tier(client):
+    before = rate_limit_rejections._values.get(("anonymous",), 0)
+    for _ in range(21):
+        client.get("/show-age", follow_redirects=False)
+
+    assert rate_limit_rejections._values[("anonymous",)] == before + 1
+    assert f'rate_limit_rejections_total{{tier="anonymous"}} {before + 1}' in (
+        client.get("/metrics").text
+    )
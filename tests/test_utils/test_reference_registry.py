@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from src.models import Sex
+from src.utils.hcirc_utils import norm_from_percentiles
+from src.utils.reference_registry import (
+    CENTILES,
+    ReferenceRegistry,
+    ReferenceTable,
+    reference_registry,
+)
+
+
+@pytest.fixture
+def registry():
+    registry = ReferenceRegistry()
+    registry.load()
+    return registry
+
+
+def test_registry_compiles_both_sexes(registry):
+    assert set(registry.tables) == {"M", "F"}
+    assert registry.get(Sex.M) is registry.get("M")
+
+
+def test_reference_arrays_are_read_only_and_contiguous(registry):
+    reference = registry.get(Sex.F)
+    for array in (reference.age, reference.centiles, reference.p25, reference.p75):
+        assert array.dtype == np.float64
+        assert not array.flags.writeable
+    assert reference.age.flags.c_contiguous
+    assert reference.centiles.flags.c_contiguous
+
+    with pytest.raises(ValueError):
+        reference.age[0] = 1.0
+
+
+def test_reference_precomputes_age_bounds(registry):
+    reference = registry.get(Sex.M)
+    assert reference.min_age == 0.0
+    assert reference.max_age == reference.age.max()
+    assert reference.centiles.shape == (reference.age.size, len(CENTILES))
+
+
+def test_registry_loads_lazily():
+    registry = ReferenceRegistry()
+    assert registry.get(Sex.F).max_age > 0
+
+
+def test_shared_registry_returns_same_arrays_between_calls():
+    assert reference_registry.get(Sex.M).age is reference_registry.get(Sex.M).age
+
+
+def test_reference_table_rejects_unsorted_ages():
+    centiles = np.tile(np.arange(len(CENTILES), dtype=float), (3, 1))
+    with pytest.raises(ValueError, match="strictly increasing"):
+        ReferenceTable(age=[0.0, 2.0, 1.0], centiles=centiles)
+
+
+def test_reference_table_rejects_missing_values():
+    centiles = np.tile(np.arange(len(CENTILES), dtype=float), (2, 1))
+    centiles[1, 3] = np.nan
+    with pytest.raises(ValueError, match="missing or invalid"):
+        ReferenceTable(age=[0.0, 1.0], centiles=centiles)
+
+
+@pytest.fixture
+def grid_registry():
+    registry = ReferenceRegistry(grid_step_days=1)
+    registry.load()
+    return registry
+
+
+def test_registry_without_grid_step_has_no_grid(registry):
+    assert registry.get(Sex.M).grid is None
+
+
+def test_age_grid_matches_exact_fit_within_bound(grid_registry):
+    for sex in Sex:
+        reference = grid_registry.get(sex)
+        grid = reference.grid
+        assert grid.step == pytest.approx(1 / 365.25)
+
+        ages = np.linspace(0.0, reference.max_age, 20001)
+        exact_loc, exact_scale = norm_from_percentiles(
+            np.interp(ages, reference.age, reference.p25),
+            0.25,
+            np.interp(ages, reference.age, reference.p75),
+            0.75,
+        )
+        loc, scale = grid.lookup(ages)
+        assert np.max(np.abs(loc - exact_loc)) <= grid.max_loc_error + 1e-12
+        assert np.max(np.abs(scale - exact_scale)) <= grid.max_scale_error + 1e-12
+
+
+def test_age_grid_lookup_caps_ages_to_reference_range(grid_registry):
+    grid = grid_registry.get(Sex.F).grid
+    assert grid.lookup(100.0) == grid.lookup(grid.stop)
+    assert grid.lookup(-1.0) == grid.lookup(0.0)
+
+
+def test_age_grid_rejects_invalid_step():
+    with pytest.raises(ValueError, match="positive"):
+        ReferenceRegistry(grid_step_days=0).load()
+
+
+def test_centile_model_maps_centiles_to_their_z_scores(registry):
+    reference = registry.get(Sex.M)
+    model = reference.centile_model
+    for row in (0, 5, reference.age.size - 1):
+        ages = np.full(len(CENTILES), reference.age[row])
+        z = model.z_score(ages, reference.centiles[row])
+        np.testing.assert_allclose(z, model.z, atol=1e-12)
+
+
+def test_centile_model_is_monotone_in_measurement(registry):
+    model = registry.get(Sex.F).centile_model
+    hcirc_values = np.linspace(20.0, 70.0, 2001)
+    for age in (0.0, 0.3, 2.0, 12.5, 21.0):
+        z = model.z_score(np.full_like(hcirc_values, age), hcirc_values)
+        assert np.all(np.diff(z) > 0)
+
+
+def test_centile_model_keeps_scalar_shape(registry):
+    assert registry.get(Sex.F).centile_model.z_score(1.0, 46.0).shape == ()
+
+
+def test_reference_table_rejects_decreasing_centiles():
+    centiles = np.tile(np.arange(len(CENTILES), dtype=float), (2, 1))
+    centiles[1, 3] = 0.5
+    with pytest.raises(ValueError, match="increase across columns"):
+        ReferenceTable(age=[0.0, 1.0], centiles=centiles)
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import shutil
+import signal
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.models import Sex
+from src.utils.reference_registry import CENTILES, ReferenceRegistry
+from src.utils.reference_reload import (
+    RELOAD_SIGNAL,
+    SERVER_PID_ENV,
+    ReferenceVersionMiddleware,
+    ReferenceWatcher,
+    notify_server,
+    reload_references,
+)
+from src.utils.reference_store import ReferenceStore, build_store
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    model_dir = tmp_path / "hcirc_model"
+    model_dir.mkdir()
+    for file_name in ("male.tsv", "female.tsv"):
+        shutil.copy(f"data/hcirc_model/{file_name}", model_dir / file_name)
+    return model_dir
+
+
+@pytest.fixture
+def registry(model_dir):
+    registry = ReferenceRegistry(directory=str(model_dir))
+    registry.load()
+    return registry
+
+
+@pytest.fixture
+def store_registry(model_dir, tmp_path):
+    store_path = str(tmp_path / "build" / "references.bin")
+    build_store(str(model_dir.parent), store_path, CENTILES)
+    registry = ReferenceRegistry(directory=str(model_dir), store_path=store_path)
+    registry.load()
+    return registry
+
+
+def _shift_centiles(path, amount: float) -> None:
+    """Rewrite a reference file with every centile shifted by amount cm."""
+    lines = path.read_text().splitlines()
+    shifted = [lines[0]] + [
+        "\t".join([row[0]] + [f"{float(value) + amount:.2f}" for value in row[1:]])
+        for row in (line.split("\t") for line in lines[1:])
+    ]
+    path.write_text("\n".join(shifted) + "\n")
+    # Make the change visible to the watcher even within one clock tick
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_reload_swaps_in_new_version(registry, model_dir):
+    previous = registry.version
+    median = registry.get(Sex.M).centiles[0, 3]
+
+    _shift_centiles(model_dir / "male.tsv", 1.0)
+    snapshot = registry.load()
+
+    assert snapshot.version != previous
+    assert registry.version == snapshot.version
+    assert registry.get(Sex.M).centiles[0, 3] == pytest.approx(median + 1.0)
+
+
+def test_reload_reads_edited_files_over_the_store(store_registry, model_dir):
+    previous = store_registry.snapshot
+    median = store_registry.get(Sex.F).centiles[0, 3]
+
+    _shift_centiles(model_dir / "female.tsv", 1.0)
+    snapshot = asyncio.run(reload_references(store_registry))
+
+    assert snapshot.version != previous.version
+    assert store_registry.get(Sex.F).centiles[0, 3] == pytest.approx(median + 1.0)
+    # The store was rebuilt, so other processes map the new tables too
+    assert snapshot.checksum == ReferenceStore(store_registry.store_path).checksum
+    assert snapshot.checksum != previous.checksum
+
+
+def test_invalid_tables_keep_current_version(registry, model_dir):
+    previous = registry.version
+    (model_dir / "female.tsv").write_text("Age\t3\n0\tnot a number\n")
+
+    with pytest.raises(ValueError):
+        registry.load()
+    assert registry.version == previous
+
+
+def test_pinned_lookups_keep_their_snapshot(registry, model_dir):
+    with registry.pin() as snapshot:
+        _shift_centiles(model_dir / "male.tsv", 1.0)
+        registry.load()
+        assert registry.version == snapshot.version
+        assert registry.get(Sex.M) is snapshot.references["default"]["M"]
+    assert registry.version != snapshot.version
+
+
+def test_middleware_serves_request_from_one_version(registry, model_dir):
+    async def reload(request):
+        before = registry.version
+        _shift_centiles(model_dir / "male.tsv", 1.0)
+        await reload_references(registry)
+        return JSONResponse({"before": before, "during": registry.version})
+
+    app = Starlette(routes=[Route("/reload", reload, methods=["POST"])])
+    client = TestClient(ReferenceVersionMiddleware(app, registry=registry))
+
+    previous = registry.version
+    response = client.post("/reload")
+    assert response.json() == {"before": previous, "during": previous}
+    assert response.headers["x-reference-version"] == previous
+
+    response = client.post("/reload")
+    assert response.headers["x-reference-version"] not in (previous, registry.version)
+
+
+def test_watcher_reloads_changed_files(registry, model_dir):
+    watcher = ReferenceWatcher(registry, interval=60)
+    previous = registry.version
+
+    assert not asyncio.run(watcher.check())
+    _shift_centiles(model_dir / "female.tsv", -1.0)
+    assert asyncio.run(watcher.check())
+    assert registry.version != previous
+    assert not asyncio.run(watcher.check())
+
+
+def test_watcher_keeps_tables_when_new_ones_are_invalid(registry, model_dir):
+    watcher = ReferenceWatcher(registry, interval=60)
+    previous = registry.version
+
+    (model_dir / "male.tsv").write_text("Age\t3\n")
+    stat = os.stat(model_dir / "male.tsv")
+    os.utime(model_dir / "male.tsv", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert not asyncio.run(watcher.check())
+    assert registry.version == previous
+
+
+def test_watcher_does_not_retry_invalid_files(registry, model_dir, monkeypatch):
+    watcher = ReferenceWatcher(registry)
+    (model_dir / "male.tsv").write_text("Age\t3\n")
+    _shift_centiles(model_dir / "male.tsv", 0.0)
+
+    assert not asyncio.run(watcher.check())
+    monkeypatch.setattr(registry, "load", lambda: pytest.fail("reloaded again"))
+    assert not asyncio.run(watcher.check())
+
+
+def test_watcher_reloads_store_and_files_once(store_registry, model_dir):
+    watcher = ReferenceWatcher(store_registry)
+
+    _shift_centiles(model_dir / "male.tsv", 1.0)
+    assert asyncio.run(watcher.check())
+    # Rebuilding the store changed its file, but not the tables
+    assert not asyncio.run(watcher.check())
+
+
+def test_watcher_catches_up_with_files_changed_before_start(registry, model_dir):
+    # As in a worker forked from a master that loaded the previous files
+    previous = registry.version
+    _shift_centiles(model_dir / "male.tsv", 1.0)
+
+    async def start_and_stop():
+        watcher = ReferenceWatcher(registry)
+        await watcher.start()
+        await watcher.stop()
+
+    asyncio.run(start_and_stop())
+    assert registry.version != previous
+
+
+def test_watcher_checks_files_on_reload_signal(registry, model_dir):
+    previous = registry.version
+
+    async def signal_watcher():
+        watcher = ReferenceWatcher(registry)
+        await watcher.start()
+        try:
+            _shift_centiles(model_dir / "female.tsv", 1.0)
+            os.kill(os.getpid(), RELOAD_SIGNAL)
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if registry.version != previous:
+                    break
+        finally:
+            await watcher.stop()
+
+    asyncio.run(signal_watcher())
+    assert registry.version != previous
+    assert signal.getsignal(RELOAD_SIGNAL) == signal.SIG_DFL
+
+
+def test_notify_server_signals_the_prefork_server(monkeypatch):
+    signals = []
+    monkeypatch.setattr(os, "kill", lambda pid, signum: signals.append((pid, signum)))
+
+    monkeypatch.delenv(SERVER_PID_ENV, raising=False)
+    assert not notify_server()
+
+    monkeypatch.setenv(SERVER_PID_ENV, "1234")
+    assert notify_server()
+    assert signals == [(1234, RELOAD_SIGNAL)]
@@ -0,0 +1,195 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from src.models import Sex, hcirc_percentile
+from src.utils.csv_loader import load_csv
+from src.utils.reference_registry import CENTILES, ReferenceRegistry
+from src.utils.reference_store import (
+    ReferenceKey,
+    ReferenceStore,
+    build_store,
+    find_references,
+)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A data directory with the default reference and a larger 'alt' one."""
+    model_dir = tmp_path / "data" / "hcirc_model"
+    (model_dir / "alt").mkdir(parents=True)
+    for file_name in ("male.tsv", "female.tsv"):
+        shutil.copy(f"data/hcirc_model/{file_name}", model_dir / file_name)
+        lines = (model_dir / file_name).read_text().splitlines()
+        shifted = [lines[0]] + [
+            "\t".join([row[0]] + [f"{float(value) + 1:.2f}" for value in row[1:]])
+            for row in (line.split("\t") for line in lines[1:])
+        ]
+        (model_dir / "alt" / file_name).write_text("\n".join(shifted) + "\n")
+    return tmp_path / "data"
+
+
+@pytest.fixture
+def store_path(data_dir, tmp_path):
+    path = str(tmp_path / "build" / "references.bin")
+    build_store(str(data_dir), path, CENTILES)
+    return path
+
+
+def test_find_references_keys_files_by_measure_reference_and_sex(data_dir):
+    files = find_references(str(data_dir))
+    assert set(files) == {
+        ReferenceKey("hcirc", reference, sex)
+        for reference in ("default", "alt")
+        for sex in ("M", "F")
+    }
+    assert files[ReferenceKey("hcirc", "alt", "F")].endswith("alt/female.tsv")
+
+
+def test_store_arrays_match_reference_files(data_dir, store_path):
+    store = ReferenceStore(store_path)
+    data = load_csv(str(data_dir / "hcirc_model" / "male.tsv"))
+
+    age, centiles = store.arrays(ReferenceKey("hcirc", "default", "M"))
+    np.testing.assert_array_equal(age, data["Age"])
+    np.testing.assert_array_equal(centiles[:, CENTILES.index("50")], data["50"])
+    assert centiles.shape == (age.size, len(CENTILES))
+    assert not age.flags.writeable and not centiles.flags.writeable
+    assert store.centiles == CENTILES
+
+
+def test_store_rejects_corrupted_data(store_path):
+    with open(store_path, "r+b") as file:
+        file.seek(-1, 2)
+        last = file.read(1)
+        file.seek(-1, 2)
+        file.write(bytes([last[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError, match="checksum"):
+        ReferenceStore(store_path)
+
+
+def test_store_rejects_other_files(tmp_path):
+    path = tmp_path / "references.bin"
+    path.write_bytes(b"not a reference store")
+    with pytest.raises(ValueError, match="not a reference store"):
+        ReferenceStore(str(path))
+
+
+def test_build_store_without_references_fails(tmp_path):
+    with pytest.raises(ValueError, match="No reference files"):
+        build_store(str(tmp_path), str(tmp_path / "references.bin"), CENTILES)
+
+
+def test_registry_maps_tables_from_store(data_dir, store_path):
+    registry = ReferenceRegistry(
+        directory=str(data_dir / "hcirc_model"), store_path=store_path
+    )
+    registry.load()
+
+    assert registry.checksum == ReferenceStore(store_path).checksum
+    assert set(registry.references) == {"default", "alt"}
+    table = registry.get(Sex.F, "alt")
+    assert not table.age.flags.writeable
+    np.testing.assert_allclose(
+        table.centiles, registry.get(Sex.F).centiles + 1, atol=1e-9
+    )
+
+
+def _touch_later(path) -> None:
+    """Make a file newer than the store, even within one clock tick."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_registry_rebuilds_store_older_than_files(data_dir, store_path):
+    registry = ReferenceRegistry(
+        directory=str(data_dir / "hcirc_model"), store_path=store_path
+    )
+    previous = registry.load()
+
+    # Shift the centiles of the first age by 0.5 cm
+    male = data_dir / "hcirc_model" / "male.tsv"
+    lines = male.read_text().splitlines()
+    age, *values = lines[1].split("\t")
+    lines[1] = "\t".join([age] + [f"{float(value) + 0.5:.2f}" for value in values])
+    male.write_text("\n".join(lines) + "\n")
+    _touch_later(male)
+
+    snapshot = registry.load()
+    assert snapshot.version != previous.version
+    assert snapshot.checksum == ReferenceStore(store_path).checksum != previous.checksum
+    assert registry.get(Sex.M).centiles[0, 0] == pytest.approx(
+        previous.references["default"]["M"].centiles[0, 0] + 0.5
+    )
+
+
+def test_registry_rebuilds_store_missing_a_reference(data_dir, store_path):
+    registry = ReferenceRegistry(
+        directory=str(data_dir / "hcirc_model"), store_path=store_path
+    )
+    shutil.rmtree(data_dir / "hcirc_model" / "alt")
+
+    assert set(registry.load().references) == {"default"}
+    assert {key.reference for key in ReferenceStore(store_path).keys()} == {"default"}
+
+
+def test_registry_reads_files_when_store_cannot_be_rebuilt(
+    monkeypatch, data_dir, store_path
+):
+    def read_only(*args):
+        raise PermissionError("read-only file system")
+
+    monkeypatch.setattr("src.utils.reference_registry.build_store", read_only)
+    registry = ReferenceRegistry(
+        directory=str(data_dir / "hcirc_model"), store_path=store_path
+    )
+    _touch_later(data_dir / "hcirc_model" / "female.tsv")
+
+    snapshot = registry.load()
+    assert snapshot.checksum is None
+    assert set(snapshot.references) == {"default", "alt"}
+
+
+def test_registry_keeps_tables_when_newer_files_are_invalid(data_dir, store_path):
+    registry = ReferenceRegistry(
+        directory=str(data_dir / "hcirc_model"), store_path=store_path
+    )
+    previous = registry.load()
+    checksum = ReferenceStore(store_path).checksum
+
+    female = data_dir / "hcirc_model" / "female.tsv"
+    female.write_text("Age\t3\n0\tnot a number\n")
+    _touch_later(female)
+
+    with pytest.raises(ValueError):
+        registry.load()
+    assert registry.version == previous.version
+    assert ReferenceStore(store_path).checksum == checksum
+
+
+def test_registry_reads_files_without_store(data_dir, tmp_path):
+    registry = ReferenceRegistry(
+        directory=str(data_dir / "hcirc_model"),
+        store_path=str(tmp_path / "missing.bin"),
+    )
+    assert set(registry.references) == {"default", "alt"}
+    assert registry.checksum is None
+
+
+def test_registry_rejects_unknown_reference(data_dir):
+    registry = ReferenceRegistry(directory=str(data_dir / "hcirc_model"))
+    with pytest.raises(ValueError, match="Unknown reference: who"):
+        registry.get(Sex.M, "who")
+
+
+def test_percentile_uses_requested_reference(monkeypatch, data_dir):
+    registry = ReferenceRegistry(directory=str(data_dir / "hcirc_model"))
+    monkeypatch.setattr("src.models.reference_registry", registry)
+
+    # Every centile of the alt reference is 1 cm larger
+    assert hcirc_percentile(2.0, Sex.M, 48.0, reference="alt") < hcirc_percentile(
+        2.0, Sex.M, 48.0
+    )
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.result_cache import ResultCache
+
+
+def test_cache_counts_hits_and_misses():
+    cache = ResultCache(max_size=10)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 42
+
+    assert cache.get_or_compute("key", compute) == 42
+    assert cache.get_or_compute("key", compute) == 42
+    assert len(calls) == 1
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResultCache(max_size=2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("c", lambda: 3)
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.get_or_compute("a", lambda: None) == 1
+    assert cache.get_or_compute("b", lambda: None) is None
+
+
+def test_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.utils.result_cache.time.monotonic", lambda: now[0])
+    cache = ResultCache(max_size=10, ttl_seconds=5)
+
+    cache.get_or_compute("key", lambda: 1)
+    now[0] += 4
+    assert cache.get_or_compute("key", lambda: 2) == 1
+    now[0] += 2
+    assert cache.get_or_compute("key", lambda: 2) == 2
+
+
+def test_cache_clear_and_disabled_cache():
+    cache = ResultCache(max_size=10)
+    cache.get_or_compute("key", lambda: 1)
+    cache.clear()
+    assert cache.get_or_compute("key", lambda: 2) == 2
+
+    disabled = ResultCache(max_size=0)
+    assert disabled.get_or_compute("key", lambda: 1) == 1
+    assert disabled.stats()["size"] == 0
+
+
+def test_cache_is_consistent_under_concurrency():
+    cache = ResultCache(max_size=50)
+    keys = [i % 100 for i in range(5000)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda key: cache.get_or_compute(key, lambda: key * 2), keys)
+        )
+
+    assert results == [key * 2 for key in keys]
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == len(keys)
+    assert stats["size"] <= 50
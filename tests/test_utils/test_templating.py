@@ -0,0 +1,65 @@
+import jinja2
+from starlette.requests import Request
+
+from src.utils.templating import Fragment, compile_templates, create_environment
+
+
+def _request(headers: dict[str, str]) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        }
+    )
+
+
+def _environment() -> jinja2.Environment:
+    return jinja2.Environment(
+        loader=jinja2.DictLoader({"page": "<p>{{ text }}</p>", "other": "x"}),
+        autoescape=True,
+    )
+
+
+def test_bytecode_cache_keeps_compiled_templates(tmp_path):
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "templates" / "page.html").write_text("<p>{{ 1 + 1 }}</p>")
+    cache_dir = tmp_path / "cache"
+
+    env = create_environment(
+        str(tmp_path / "templates"), bytecode_cache_dir=str(cache_dir)
+    )
+    compile_templates(env)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    env = create_environment(
+        str(tmp_path / "templates"), bytecode_cache_dir=str(cache_dir)
+    )
+    assert env.get_template("page.html").render() == "<p>2</p>"
+
+
+def test_compile_templates_loads_every_template():
+    env = _environment()
+    compile_templates(env)
+    assert len(env.cache) == 2
+
+
+def test_fragment_is_rendered_once_with_an_etag():
+    fragment = Fragment(_environment(), "page", {"text": "<hello>"})
+    assert fragment.body == b"<p>&lt;hello&gt;</p>"
+
+    response = fragment.response(_request({}))
+    assert response.status_code == 200
+    assert response.body == fragment.body
+    assert response.headers["etag"] == fragment.etag
+
+    response = fragment.response(_request({"If-None-Match": fragment.etag}))
+    assert response.status_code == 304
+    assert response.body == b""
+
+
+def test_error_fragments_are_not_cached():
+    fragment = Fragment(_environment(), "page", {"text": "Slow down"}, status_code=429)
+    response = fragment.response(_request({"If-None-Match": fragment.etag}))
+    assert response.status_code == 429
+    assert response.body == fragment.body
+    assert "etag" not in response.headers